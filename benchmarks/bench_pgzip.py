@@ -0,0 +1,115 @@
+"""
+Сравнение обычного gzip и параллельного (modules/pgzip.py) на пути скачивания (pipe) и пути бэкапа (файл).
+
+Запуск из корня репозитория (модули читают settings.json из текущей папки):
+    python -m benchmarks.bench_pgzip [--size-mb 128] [--files 64] [--levels 1,9] [--threads 4] [--repeat 3]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+import zlib
+
+from modules.compression import Codec
+from modules.file_manager import writer, create_archive_chunk_generator
+
+
+def generate_tree(root: str, size_mb: int, files: int):
+    """Сохранения игр обычно сжимаются средне: смешиваем повторяющиеся структуры и случайные байты."""
+    rng = random.Random(42)
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 12))) for _ in range(512)]
+    file_size = size_mb * 1024 * 1024 // files
+
+    for index in range(files):
+        path = os.path.join(root, f"slot{index % 8}", f"save_{index}.dat")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            written = 0
+            while written < file_size:
+                if rng.random() < 0.3:
+                    chunk = rng.randbytes(4096)
+                else:
+                    chunk = b" ".join(rng.choices(words, k=700))[:4096]
+                file.write(chunk)
+                written += len(chunk)
+
+
+def gunzip_digest(data: bytes) -> str:
+    return hashlib.md5(zlib.decompress(data, 16 + zlib.MAX_WBITS)).hexdigest()
+
+
+def bench_file(folder: str, codec: Codec, out_dir: str) -> tuple[float, bytes]:
+    tar_path = os.path.join(out_dir, f"bench-{codec.cache_tag}.tar.gz")
+    started = time.perf_counter()
+    if not writer(folder_path=folder, tar_path=tar_path, codec=codec):
+        raise RuntimeError("writer failed")
+    elapsed = time.perf_counter() - started
+    with open(tar_path, "rb") as file:
+        data = file.read()
+    os.remove(tar_path)
+    return elapsed, data
+
+
+def bench_pipe(folder: str, codec: Codec) -> tuple[float, bytes]:
+    async def consume():
+        chunks = list()
+        status = dict()
+        async for chunk in create_archive_chunk_generator(folder, status=status, codec=codec):
+            chunks.append(chunk)
+        if not status.get("success"):
+            raise RuntimeError("writer failed")
+        return b"".join(chunks)
+
+    started = time.perf_counter()
+    data = asyncio.run(consume())
+    return time.perf_counter() - started, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gzip vs parallel gzip benchmark")
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--files", type=int, default=64)
+    parser.add_argument("--levels", default="1,6,9")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="mnemy-bench-") as tmp:
+        folder = os.path.join(tmp, "saves")
+        generate_tree(folder, args.size_mb, args.files)
+        raw_size = sum(os.path.getsize(os.path.join(d, f)) for d, _, names in os.walk(folder) for f in names)
+        print(f"Данные: {raw_size / 2**20:.1f} МБ в {args.files} файлах, потоков: {args.threads}, повторов: {args.repeat}")
+        print(f"{'режим':<6} {'кодек':<10} {'потоки':>6} {'время, с':>9} {'МБ/с':>8} {'размер, МБ':>11} {'ускорение':>10}")
+
+        for level in (int(level) for level in args.levels.split(",")):
+            for mode in ("file", "pipe"):
+                baseline = None
+                reference_digest = None
+                for threads in (1, args.threads):
+                    codec = Codec("gzip", level, threads)
+                    timings = list()
+                    for _ in range(args.repeat):
+                        if mode == "file":
+                            elapsed, data = bench_file(folder, codec, tmp)
+                        else:
+                            elapsed, data = bench_pipe(folder, codec)
+                        timings.append(elapsed)
+
+                    # Оба варианта должны распаковываться в один и тот же tar
+                    digest = gunzip_digest(data)
+                    if reference_digest is None:
+                        reference_digest = digest
+                    elif digest != reference_digest:
+                        raise RuntimeError(f"Архив {codec.cache_tag} распаковывается в другие данные")
+
+                    best = min(timings)
+                    baseline = baseline or best
+                    print(f"{mode:<6} {codec.spec:<10} {threads:>6} {best:>9.3f} {raw_size / 2**20 / best:>8.1f} "
+                          f"{len(data) / 2**20:>11.2f} {baseline / best:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
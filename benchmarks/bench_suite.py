@@ -0,0 +1,500 @@
+"""
+Бенчмарки горячих путей синхронизации, архивов и бэкапов с машиночитаемым результатом.
+
+Зависимости сверх requirements.txt (httpx): pip install -r benchmarks/requirements.txt
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_suite [--profiles small_text,mixed,large_binary] [--scale 1.0] [--repeat 3]
+                                     [--backup-formats cas,indexed,tar] [--set download_codec=zstd:3] [--output out.json]
+Сравнение двух прогонов (код возврата 1, если что-то замедлилось больше порога):
+    python -m benchmarks.bench_suite --compare base.json new.json [--threshold 0.1]
+
+Прогон идёт во временной рабочей папке с копией settings.json: users.db, saves/, backups/ и прочие папки
+сервера создаются там, а не в репозитории. Модули сервера читают настройки при импорте,
+поэтому импортируются только после перехода в эту папку.
+
+Профили деревьев сохранений различаются числом файлов, распределением размеров (логнормальное) и сжимаемостью:
+доля текстоподобных блоков, остальное — случайные байты.
+Замеряются hash_generator (без индекса и с индексом), check_files, writer (файл и pipe), распаковка get_files,
+create_backup с ротацией для каждого формата бэкапов, get_backups_info и те же сценарии через HTTP:
+приложение вызывается через httpx.ASGITransport, Redis (чёрный список JWT) заменён словарём в памяти.
+"""
+import argparse
+import asyncio
+import contextlib
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime, UTC
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERNAME = "bench"
+
+PROFILES = {
+    # Много мелких текстовых файлов (конфиги, JSON-сохранения)
+    "small_text": {"files": 1000, "median_size": 8 * 1024, "sigma": 1.0, "compressibility": 0.9},
+    # Смесь размеров от килобайт до мегабайт
+    "mixed": {"files": 80, "median_size": 128 * 1024, "sigma": 1.5, "compressibility": 0.5},
+    # Несколько больших почти несжимаемых файлов
+    "large_binary": {"files": 4, "median_size": 8 * 1024 * 1024, "sigma": 0.2, "compressibility": 0.05},
+}
+
+
+# === Данные ===
+
+def generate_tree(root: str, files: int, median_size: int, sigma: float, compressibility: float,
+                  seed: int = 42) -> tuple[int, int]:
+    """Генерирует дерево сохранений. :returns (число файлов, суммарный размер)"""
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 12))) for _ in range(512)]
+    generated_at = time.time() - 3600
+    total_size = 0
+
+    for index in range(files):
+        size = max(1, int(rng.lognormvariate(0, sigma) * median_size))
+        path = os.path.join(root, f"slot{index % 8}", f"dir{index % 3}", f"save_{index}.dat")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            written = 0
+            while written < size:
+                if rng.random() < compressibility:
+                    chunk = b" ".join(rng.choices(words, k=700))[:4096]
+                else:
+                    chunk = rng.randbytes(4096)
+                chunk = chunk[:size - written]
+                file.write(chunk)
+                written += len(chunk)
+        # Свежие файлы индекс хэшей перехэширует всегда (окно гонки mtime), а сохранения обычно старше
+        os.utime(path, (generated_at, generated_at))
+        total_size += size
+
+    return files, total_size
+
+
+def replace_file(path: str, data: bytes):
+    """Меняет файл новым inode: файлы сохранений могут быть жёсткими ссылками версий снимков."""
+    tmp_path = f"{path}.bench-tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def tree_hashes(root: str) -> dict[str, str]:
+    import hashlib
+
+    hashes = dict()
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as file:
+                hashes["/" + os.path.relpath(path, root)] = hashlib.file_digest(file, "md5").hexdigest()
+    return hashes
+
+
+# === Замеры ===
+
+async def measure(repeat: int, func, setup=None) -> list[float]:
+    """Время repeat вызовов func (синхронной или возвращающей awaitable); вывод модулей сервера подавляется."""
+    timings = list()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = func()
+            if inspect.isawaitable(result):
+                await result
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def record(results: dict, name: str, timings: list[float], data_bytes: int = None, **extra):
+    best = min(timings)
+    entry = {
+        "runs": [round(value, 6) for value in timings],
+        "best": round(best, 6),
+        "median": round(statistics.median(timings), 6),
+        "mean": round(statistics.fmean(timings), 6),
+    }
+    if data_bytes is not None:
+        entry["bytes"] = data_bytes
+        entry["mb_per_s"] = round(data_bytes / 2 ** 20 / best, 3) if best > 0 else None
+    entry.update(extra)
+    results[name] = entry
+
+    throughput = f" {entry['mb_per_s']:>9.1f} МБ/с" if entry.get("mb_per_s") else ""
+    print(f"  {name:<48} лучшее {best * 1000:>10.2f} мс, медиана {entry['median'] * 1000:>10.2f} мс{throughput}")
+
+
+# === Модули сервера (file_manager и т.д.) ===
+
+async def bench_profile(name: str, source: str, raw_size: int, args, results: dict, archives: dict):
+    from starlette.datastructures import UploadFile
+
+    from modules import file_manager
+    from modules.hash_index import drop_index
+    from modules.models import GameFilesData
+    from modules.snapshots import resolve_snapshot
+
+    game_name = name
+    saves_path = f"saves/{USERNAME}/{game_name}"
+    shutil.copytree(source, saves_path)
+
+    results_prefix = f"{name}/"
+
+    timings = await measure(args.repeat, lambda: file_manager.hash_generator(game_name, USERNAME),
+                            setup=lambda: drop_index(saves_path))
+    record(results, results_prefix + "hash_generator_cold", timings, raw_size)
+    timings = await measure(args.repeat, lambda: file_manager.hash_generator(game_name, USERNAME))
+    record(results, results_prefix + "hash_generator_warm", timings, raw_size)
+
+    # Клиент отличается от сервера в ~5% файлов
+    client_hashes = tree_hashes(source)
+    for relative_path in sorted(client_hashes)[::20]:
+        client_hashes[relative_path] = "0" * 32
+    files_data = GameFilesData(game_name=game_name, files_data=client_hashes, last_sync_date=None)
+    timings = await measure(args.repeat, lambda: file_manager.check_files(USERNAME, files_data))
+    record(results, results_prefix + "check_files", timings, files=len(client_hashes))
+
+    codec = file_manager.download_codec
+    archive_path = f"tmp_data/{name}-archive"
+    os.makedirs("tmp_data", exist_ok=True)
+    timings = await measure(args.repeat, lambda: file_manager.writer(folder_path=resolve_snapshot(USERNAME, game_name),
+                                                                     tar_path=archive_path, codec=codec))
+    with open(archive_path, "rb") as archive_file:
+        archives[name] = archive_file.read()
+    os.remove(archive_path)
+    record(results, results_prefix + "writer_file", timings, raw_size, codec=codec,
+           archive_bytes=len(archives[name]))
+
+    async def consume_pipe():
+        status = dict()
+        async for _ in file_manager.create_archive_chunk_generator(resolve_snapshot(USERNAME, game_name),
+                                                                   status=status, codec=codec):
+            pass
+        if not status.get("success"):
+            raise RuntimeError("writer failed")
+
+    timings = await measure(args.repeat, consume_pipe)
+    record(results, results_prefix + "writer_pipe", timings, raw_size, codec=codec)
+
+    # Распаковка загрузки в новую версию снимка (потоковый режим upload_data)
+    upload = dict()
+    extract_game = f"{name}-extract"
+    timings = await measure(
+        args.repeat,
+        lambda: file_manager.get_files(upload["file"], extract_game, f"tmp_data/{USERNAME}/upload", USERNAME),
+        setup=lambda: upload.update(file=UploadFile(io.BytesIO(archives[name]), size=len(archives[name]),
+                                                    filename="saves.tar.gz"))
+    )
+    record(results, results_prefix + "get_files_extract", timings, raw_size,
+           upload_streaming=file_manager.upload_streaming)
+
+    # Бэкапы с ротацией: каждый раз меняется один файл, иначе бэкап с тем же отпечатком пропускается
+    largest_file = max((os.path.join(directory, file_name) for directory, _, names in os.walk(saves_path)
+                        for file_name in names), key=os.path.getsize)
+    with open(largest_file, "rb") as file:
+        original_data = file.read()
+    rotations = file_manager.backups_limit + 2
+    for backup_format in args.backup_formats:
+        file_manager.backup_format = backup_format
+        backup_game = f"{name}-backup-{backup_format}"
+        backup_path = f"saves/{USERNAME}/{backup_game}"
+        shutil.copytree(source, backup_path)
+        changed_file = os.path.join(backup_path, os.path.relpath(largest_file, saves_path))
+        counter = iter(range(rotations))
+
+        timings = await measure(rotations, lambda: file_manager.create_backup(backup_game, USERNAME),
+                                setup=lambda: replace_file(changed_file, original_data + str(next(counter)).encode()))
+        backups_dir = f"backups/{USERNAME}/{backup_game}"
+        record(results, results_prefix + f"create_backup_{backup_format}", timings, raw_size,
+               backups_kept=len(os.listdir(backups_dir)), backups_limit=file_manager.backups_limit)
+
+    timings = await measure(args.repeat * 10, lambda: file_manager.get_backups_info(USERNAME))
+    record(results, results_prefix + "get_backups_info", timings)
+
+
+# === HTTP (end-to-end) ===
+
+class InMemoryRedis:
+    """Заглушка redis.Redis для чёрного списка JWT (modules/admin_panel/auth_controller.py)."""
+
+    def __init__(self):
+        self._values = dict()
+
+    def _alive(self, key) -> bool:
+        value = self._values.get(key)
+        if value is not None and value[1] < time.monotonic():
+            del self._values[key]
+            return False
+        return value is not None
+
+    def setex(self, key, seconds, value):
+        self._values[key] = (value, time.monotonic() + seconds)
+        return True
+
+    def get(self, key):
+        return self._values[key][0] if self._alive(key) else None
+
+    def exists(self, *keys) -> int:
+        return sum(1 for key in keys if self._alive(key))
+
+    def delete(self, *keys) -> int:
+        return sum(1 for key in keys if self._values.pop(key, None) is not None)
+
+
+async def wait_job(client, headers: dict, job_id: str, timeout: float = 300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = await client.get(f"/manage/jobs/{job_id}", headers=headers)
+        if response.json().get("status") in ("done", "failed"):
+            return response.json()["status"]
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout} s")
+
+
+async def bench_http(args, results: dict, archives: dict, sources: dict, panel_password: str):
+    import httpx
+
+    import main
+    from modules.admin_panel import auth_controller
+
+    auth_controller.redis_cli = InMemoryRedis()
+    transport = httpx.ASGITransport(app=main.app)
+
+    # ASGITransport не отправляет lifespan-события: запускаем их сами (подхват очереди задач)
+    async with (main.app.router.lifespan_context(main.app),
+                httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client):
+        login = await client.post("/panel/auth/login", json={"username": "bench-admin", "password": panel_password})
+        login.raise_for_status()
+        panel_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        created = await client.put("/panel/users/add", params={"username": "bench-http"}, headers=panel_headers)
+        created.raise_for_status()
+        headers = {"X-API-Token": created.json()["token"]}
+
+        for name, archive in archives.items():
+            prefix = f"http/{name}/"
+            game_name = f"{name}-http"
+            client_hashes = tree_hashes(sources[name])
+            state = dict()
+
+            async def upload():
+                response = await client.post("/files/upload_data", data={"game_name": game_name},
+                                             files={"file": ("saves.tar.gz", archive)}, headers=headers)
+                response.raise_for_status()
+                state["job_id"] = response.json()["backup_job_id"]
+
+            async def backup_job():
+                if await wait_job(client, headers, state["job_id"]) != "done":
+                    raise RuntimeError("Backup job failed")
+
+            async def check():
+                response = await client.post("/files/check_files", headers=headers, json={
+                    "game_name": game_name, "files_data": client_hashes, "last_sync_date": None})
+                response.raise_for_status()
+
+            async def download(etag: str = None):
+                request_headers = {**headers, "If-None-Match": etag} if etag else headers
+                response = await client.get("/files/download_data", params={"game_name": game_name},
+                                            headers=request_headers)
+                if response.status_code not in (200, 304):
+                    response.raise_for_status()
+                state["etag"] = response.headers.get("etag")
+                state["download_bytes"] = len(response.content)
+
+            async def get(path: str):
+                response = await client.get(path, headers=headers)
+                response.raise_for_status()
+
+            upload_timings = list()
+            job_timings = list()
+            for _ in range(args.repeat):
+                upload_timings += await measure(1, upload)
+                job_timings += await measure(1, backup_job)
+            record(results, prefix + "upload_data", upload_timings, len(archive))
+            record(results, prefix + "backup_job", job_timings)
+            record(results, prefix + "check_files", await measure(args.repeat, check), files=len(client_hashes))
+            # Первое скачивание строит архив и кладёт его в кэш, следующие отдаются из кэша
+            record(results, prefix + "download_data_cold", await measure(1, download))
+            record(results, prefix + "download_data", await measure(args.repeat, download),
+                   state["download_bytes"])
+            record(results, prefix + "download_data_304", await measure(args.repeat, lambda: download(state["etag"])))
+            record(results, prefix + "get_games_data", await measure(args.repeat, lambda: get("/manage/get_games_data")))
+            record(results, prefix + "get_backups_data",
+                   await measure(args.repeat, lambda: get("/files/get_backups_data")))
+
+        logout = await client.post("/panel/auth/logout",
+                                   headers={"Authorization": f"Bearer {login.json()['refresh_token']}"})
+        logout.raise_for_status()
+
+
+# === Прогон ===
+
+def git_revision() -> dict:
+    def git(*command) -> str | None:
+        try:
+            return subprocess.run(["git", *command], cwd=REPO_ROOT, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def prepare_workdir(workdir: str, overrides: dict) -> dict:
+    """Рабочая папка сервера: settings.json с переопределениями и ссылка на modules (статика админ-панели)."""
+    with open(os.path.join(REPO_ROOT, "settings.json"), "r") as settings_file:
+        settings = json.load(settings_file)
+    settings.update(overrides)
+    with open(os.path.join(workdir, "settings.json"), "w") as settings_file:
+        json.dump(settings, settings_file)
+    os.symlink(os.path.join(REPO_ROOT, "modules"), os.path.join(workdir, "modules"))
+    return settings
+
+
+def parse_overrides(items: list[str]) -> dict:
+    overrides = {"jobs_mode": "inprocess"}
+    for item in items:
+        key, _, value = item.partition("=")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+async def run_suite(args, workdir: str) -> dict:
+    from passlib.context import CryptContext
+
+    # auth_controller читает учётные данные панели из окружения при импорте
+    panel_password = secrets.token_urlsafe(16)
+    os.environ["SECRET_KEY"] = secrets.token_hex(32)
+    os.environ["PANEL_USERNAME"] = "bench-admin"
+    os.environ["PANEL_PASSWORD"] = CryptContext(schemes=["bcrypt"]).hash(panel_password)
+
+    from modules import sqls
+    from modules.async_sqls import async_engine
+    from modules.file_manager import create_all_folders
+
+    create_all_folders()
+    sqls.add_user(USERNAME, secrets.token_urlsafe(32))
+    os.makedirs(f"saves/{USERNAME}", exist_ok=True)
+
+    results = dict()
+    archives = dict()
+    sources = dict()
+    trees = dict()
+    try:
+        for name in args.profiles:
+            profile = dict(PROFILES[name])
+            profile["files"] = max(1, int(profile["files"] * args.scale))
+            source = os.path.join(workdir, "source", name)
+            file_count, raw_size = generate_tree(source, **profile)
+            sources[name] = source
+            trees[name] = {**profile, "total_bytes": raw_size}
+            print(f"📁 {name}: {file_count} файлов, {raw_size / 2 ** 20:.1f} МБ")
+            await bench_profile(name, source, raw_size, args, results, archives)
+
+        if not args.skip_http:
+            print("🌐 HTTP")
+            await bench_http(args, results, archives, sources, panel_password)
+    finally:
+        # Пул соединений aiosqlite привязан к циклу событий: закрываем до завершения asyncio.run
+        await async_engine.dispose()
+
+    return {"trees": trees, "results": results}
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    with open(base_path, "r") as base_file, open(new_path, "r") as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+
+    print(f"база:  {base['meta'].get('commit')} ({base['meta']['created_at']})")
+    print(f"новый: {new['meta'].get('commit')} ({new['meta']['created_at']})")
+    print(f"{'замер':<48} {'база, мс':>11} {'новый, мс':>11} {'изменение':>10}")
+
+    regressions = 0
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        base_entry, new_entry = base["results"].get(name), new["results"].get(name)
+        if base_entry is None or new_entry is None:
+            print(f"{name:<48} {'—' if base_entry is None else f'{base_entry['best'] * 1000:.2f}':>11} "
+                  f"{'—' if new_entry is None else f'{new_entry['best'] * 1000:.2f}':>11}")
+            continue
+        change = new_entry["best"] / base_entry["best"] - 1 if base_entry["best"] > 0 else 0.0
+        mark = ""
+        if change > threshold:
+            mark = " ⚠️"
+            regressions += 1
+        elif change < -threshold:
+            mark = " ✅"
+        print(f"{name:<48} {base_entry['best'] * 1000:>11.2f} {new_entry['best'] * 1000:>11.2f} "
+              f"{change * 100:>+9.1f}%{mark}")
+
+    print(f"Замедлений больше {threshold * 100:.0f}%: {regressions}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mnemy hot path benchmarks")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help=f"Профили через запятую: {', '.join(PROFILES)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель числа файлов в профилях")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backup-formats", default="cas,indexed,tar")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Переопределить параметр settings.json (значение — JSON или строка)")
+    parser.add_argument("--skip-http", action="store_true", help="Без сценариев через HTTP")
+    parser.add_argument("--output", default=None, help="Файл результатов (по умолчанию bench-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Сравнить два файла результатов")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Порог замедления для --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    args.profiles = args.profiles.split(",")
+    args.backup_formats = args.backup_formats.split(",")
+    unknown = [name for name in args.profiles if name not in PROFILES]
+    if unknown:
+        parser.error(f"Неизвестные профили: {', '.join(unknown)}")
+
+    revision = git_revision()
+    output = os.path.abspath(args.output or f"bench-{(revision['commit'] or 'unknown')[:12]}.json")
+    launch_dir = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="mnemy-bench-") as workdir:
+        settings = prepare_workdir(workdir, parse_overrides(args.set))
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(run_suite(args, workdir))
+        finally:
+            os.chdir(launch_dir)
+
+    report["meta"] = {
+        **revision,
+        "created_at": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "scale": args.scale,
+        "settings": settings,
+    }
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2)
+    print(f"💾 Результаты: {output}")
+
+
+if __name__ == "__main__":
+    main()
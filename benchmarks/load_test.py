@@ -0,0 +1,406 @@
+"""
+Нагрузочный тест: много устройств одновременно синхронизируют сохранения с одним сервером.
+
+Зависимости сверх requirements.txt (httpx): pip install -r benchmarks/requirements.txt
+
+Запуск из корня репозитория — сервер main:app поднимается отдельным процессом во временной папке
+(копия settings.json, как в benchmarks/bench_suite.py), учётные данные админ-панели генерируются:
+    python -m benchmarks.load_test [--users 20] [--concurrency 20] [--duration 60] [--think-time 0.5]
+                                   [--workers 1] [--mix check_files=40,upload_data=10] [--output load.json]
+Против уже запущенного сервера:
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --panel-username admin --panel-password ...
+
+Пользователи load-<n> создаются через /panel/users/add (уже существующие берутся из /panel/users/get_users).
+Каждая сессия — устройство одного из пользователей (при concurrency > users у пользователя несколько устройств),
+оно в цикле выбирает запрос по весам --mix: check_files, upload_data (следующая версия сохранений),
+download_data (с If-None-Match), get_games_data, get_backups_data — и ждёт случайную паузу со средним --think-time.
+Ошибки — ответы 4xx/5xx (кроме 304) и сетевые исключения; отчёт — пропускная способность,
+перцентили задержки и доля ошибок по каждому запросу.
+Клиент — один цикл событий: при тысячах запросов в секунду он сам может стать узким местом.
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+from collections import Counter, defaultdict
+from datetime import datetime, UTC
+
+from benchmarks.bench_suite import REPO_ROOT, generate_tree, git_revision, parse_overrides, prepare_workdir
+
+DEFAULT_MIX = {"check_files": 40, "upload_data": 10, "download_data": 15, "get_games_data": 20, "get_backups_data": 15}
+PERCENTILES = (50, 90, 95, 99)
+
+
+# === Данные устройств ===
+
+def build_variants(root: str, count: int, seed: int = 7) -> list[dict]:
+    """
+    Версии одного дерева сохранений: в каждой следующей меняется ~10% файлов (набор файлов тот же —
+    check_files удаляет на сервере файлы, которых нет у клиента). :returns [{"archive": bytes, "hashes": {...}}]
+    """
+    import hashlib
+
+    rng = random.Random(seed)
+    files = dict()
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, "rb") as file:
+                files["/" + os.path.relpath(path, root)] = file.read()
+
+    variants = list()
+    for _ in range(count):
+        for relative_path in rng.sample(sorted(files), max(1, len(files) // 10)):
+            files[relative_path] = rng.randbytes(16) + files[relative_path][16:]
+
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=1, mtime=0) as compressed, \
+                tarfile.open(fileobj=compressed, mode="w|") as tar:
+            for relative_path, data in sorted(files.items()):
+                info = tarfile.TarInfo(relative_path.lstrip("/"))
+                info.size = len(data)
+                info.mtime = int(time.time())
+                tar.addfile(info, io.BytesIO(data))
+        variants.append({
+            "archive": buffer.getvalue(),
+            "hashes": {path: hashlib.md5(data).hexdigest() for path, data in files.items()},
+        })
+    return variants
+
+
+class Device:
+    def __init__(self, username: str, token: str, games: list[str]):
+        self.username = username
+        self.headers = {"X-API-Token": token}
+        # Номер последней загруженной версии и ETag последнего скачивания для каждой игры
+        self.games = {game_name: {"variant": 0, "etag": None} for game_name in games}
+
+
+# === Запросы ===
+
+async def check_files(client, device: Device, variants: list[dict], rng: random.Random):
+    game_name = rng.choice(list(device.games))
+    hashes = variants[device.games[game_name]["variant"]]["hashes"]
+    response = await client.post("/files/check_files", headers=device.headers,
+                                 json={"game_name": game_name, "files_data": hashes, "last_sync_date": None})
+    return response, len(response.request.content)
+
+
+async def upload_data(client, device: Device, variants: list[dict], rng: random.Random):
+    game_name = rng.choice(list(device.games))
+    state = device.games[game_name]
+    variant = (state["variant"] + 1) % len(variants)
+    archive = variants[variant]["archive"]
+    response = await client.post("/files/upload_data", headers=device.headers, data={"game_name": game_name},
+                                 files={"file": ("saves.tar.gz", archive)})
+    if response.status_code == 200:
+        state["variant"] = variant
+    return response, len(archive)
+
+
+async def download_data(client, device: Device, variants: list[dict], rng: random.Random):
+    game_name = rng.choice(list(device.games))
+    state = device.games[game_name]
+    headers = {**device.headers, "If-None-Match": state["etag"]} if state["etag"] else device.headers
+    response = await client.get("/files/download_data", params={"game_name": game_name}, headers=headers)
+    if response.status_code == 200:
+        state["etag"] = response.headers.get("etag")
+    return response, 0
+
+
+async def get_games_data(client, device: Device, variants: list[dict], rng: random.Random):
+    return await client.get("/manage/get_games_data", headers=device.headers), 0
+
+
+async def get_backups_data(client, device: Device, variants: list[dict], rng: random.Random):
+    return await client.get("/files/get_backups_data", params={"limit": 50}, headers=device.headers), 0
+
+
+ACTIONS = {
+    "check_files": check_files,
+    "upload_data": upload_data,
+    "download_data": download_data,
+    "get_games_data": get_games_data,
+    "get_backups_data": get_backups_data,
+}
+
+
+# === Статистика ===
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+        self.bytes_sent = Counter()
+        self.bytes_received = Counter()
+
+    def add(self, action: str, seconds: float, status, sent: int = 0, received: int = 0):
+        self.latencies[action].append(seconds)
+        self.statuses[action][str(status)] += 1
+        if not isinstance(status, int) or (status >= 400 and status != 304):
+            self.errors[action] += 1
+        self.bytes_sent[action] += sent
+        self.bytes_received[action] += received
+
+    @staticmethod
+    def percentile(sorted_values: list[float], p: float) -> float:
+        if not sorted_values:
+            return 0.0
+        return sorted_values[min(len(sorted_values) - 1, max(0, int(round(len(sorted_values) * p / 100)) - 1))]
+
+    def summarize(self, elapsed: float) -> dict:
+        def summary(latencies: list[float], errors: int, statuses: Counter, sent: int, received: int) -> dict:
+            values = sorted(latencies)
+            return {
+                "requests": len(values),
+                "rps": round(len(values) / elapsed, 3) if elapsed > 0 else 0.0,
+                "errors": errors,
+                "error_rate": round(errors / len(values), 4) if values else 0.0,
+                "statuses": dict(statuses),
+                "latency": {
+                    **{f"p{p}": round(self.percentile(values, p), 6) for p in PERCENTILES},
+                    "mean": round(sum(values) / len(values), 6) if values else 0.0,
+                    "max": round(values[-1], 6) if values else 0.0,
+                },
+                "bytes_sent": sent,
+                "bytes_received": received,
+            }
+
+        actions = {
+            action: summary(latencies, self.errors[action], self.statuses[action],
+                            self.bytes_sent[action], self.bytes_received[action])
+            for action, latencies in sorted(self.latencies.items())
+        }
+        total = summary([value for latencies in self.latencies.values() for value in latencies],
+                        sum(self.errors.values()), sum(self.statuses.values(), Counter()),
+                        sum(self.bytes_sent.values()), sum(self.bytes_received.values()))
+        return {"elapsed": round(elapsed, 3), "total": total, "actions": actions}
+
+
+def print_report(report: dict):
+    columns = "".join(f"{f'p{p}, мс':>10}" for p in PERCENTILES)
+    print(f"{'запрос':<18}{'всего':>8}{'в сек':>9}{'ошибки':>9}{columns}{'макс, мс':>10}")
+    for name, summary in [*report["actions"].items(), ("ИТОГО", report["total"])]:
+        latency = summary["latency"]
+        values = "".join(f"{latency[f'p{p}'] * 1000:>10.1f}" for p in PERCENTILES)
+        print(f"{name:<18}{summary['requests']:>8}{summary['rps']:>9.1f}{summary['error_rate'] * 100:>8.2f}%"
+              f"{values}{latency['max'] * 1000:>10.1f}")
+    failed = {name: {status: count for status, count in summary["statuses"].items() if status not in ("200", "304")}
+              for name, summary in report["actions"].items()}
+    failed = {name: statuses for name, statuses in failed.items() if statuses}
+    if failed:
+        print(f"Неуспешные ответы: {failed}")
+    print(f"Отправлено {report['total']['bytes_sent'] / 2 ** 20:.1f} МБ, "
+          f"получено {report['total']['bytes_received'] / 2 ** 20:.1f} МБ за {report['elapsed']:.1f} с")
+
+
+# === Сервер и пользователи ===
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_server(workdir: str, workers: int, panel_username: str, panel_password: str):
+    """Запускает main.py в workdir на свободном порту. :returns базовый URL"""
+    from passlib.context import CryptContext
+
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_ROOT,
+        "SECRET_KEY": secrets.token_hex(32),
+        "PANEL_USERNAME": panel_username,
+        "PANEL_PASSWORD": CryptContext(schemes=["bcrypt"]).hash(panel_password),
+    }
+    log_path = os.path.join(workdir, "server.log")
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, "main.py"), "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 60
+        while True:
+            if process.poll() is not None or time.monotonic() > deadline:
+                with open(log_path, "r", errors="replace") as log_file:
+                    raise RuntimeError(f"Server did not start:\n{log_file.read()[-4000:]}")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                    break
+            except OSError:
+                time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            print("⚠️  Сервер не завершился за 30 с после SIGTERM, процесс убит")
+            process.kill()
+            process.wait()
+
+
+async def create_users(client, count: int, panel_username: str, panel_password: str) -> list[tuple[str, str]]:
+    """Создаёт пользователей load-<n> через API админ-панели. :returns [(username, api_token)]"""
+    login = await client.post("/panel/auth/login", json={"username": panel_username, "password": panel_password})
+    login.raise_for_status()
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    users = list()
+    existing = None
+    for index in range(count):
+        username = f"load-{index}"
+        response = await client.put("/panel/users/add", params={"username": username}, headers=headers)
+        if response.status_code == 409:
+            if existing is None:
+                existing = (await client.get("/panel/users/get_users", headers=headers)).json()["users"]
+            users.append((username, existing[username]))
+            continue
+        response.raise_for_status()
+        users.append((username, response.json()["token"]))
+    return users
+
+
+# === Прогон ===
+
+async def run_session(client, device: Device, variants: list[dict], args, deadline: float, start_delay: float,
+                      stats: LoadStats, rng: random.Random):
+    import httpx
+
+    names = list(args.mix)
+    weights = list(args.mix.values())
+    await asyncio.sleep(start_delay)
+    while time.monotonic() < deadline:
+        action = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            response, sent = await ACTIONS[action](client, device, variants, rng)
+            stats.add(action, time.perf_counter() - started, response.status_code, sent, len(response.content))
+        except httpx.HTTPError as e:
+            stats.add(action, time.perf_counter() - started, type(e).__name__)
+        if args.think_time > 0:
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+
+async def run_load(url: str, args, variants: list[dict]) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        users = await create_users(client, args.users, args.panel_username, args.panel_password)
+        games = [f"game-{index}" for index in range(args.games)]
+
+        devices = [Device(*users[index % len(users)], games) for index in range(args.concurrency)]
+        # Начальная загрузка, чтобы скачивания и проверки работали с первого запроса
+        for username, token in users:
+            for game_name in games:
+                response = await client.post("/files/upload_data", headers={"X-API-Token": token},
+                                             data={"game_name": game_name},
+                                             files={"file": ("saves.tar.gz", variants[0]["archive"])})
+                response.raise_for_status()
+        print(f"👥 Пользователей: {len(users)}, устройств: {len(devices)}, игр у пользователя: {len(games)}")
+
+        stats = LoadStats()
+        started = time.monotonic()
+        deadline = started + args.ramp_up + args.duration
+        await asyncio.gather(*(
+            run_session(client, device, variants, args, deadline, args.ramp_up * index / len(devices), stats,
+                        random.Random(args.seed + index))
+            for index, device in enumerate(devices)
+        ))
+        return stats.summarize(time.monotonic() - started)
+
+
+def parse_mix(value: str) -> dict:
+    mix = dict()
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"Unknown request {name!r}, expected one of: {', '.join(ACTIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mnemy multi-client load test")
+    parser.add_argument("--url", default=None, help="Уже запущенный сервер; без него main:app запускается локально")
+    parser.add_argument("--panel-username", default="load-admin")
+    parser.add_argument("--panel-password", default=None, help="Обязателен вместе с --url")
+    parser.add_argument("--workers", type=int, default=1, help="Воркеры uvicorn локального сервера")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Переопределить параметр settings.json локального сервера")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=None, help="Одновременных устройств (по умолчанию = users)")
+    parser.add_argument("--games", type=int, default=2, help="Игр у каждого пользователя")
+    parser.add_argument("--duration", type=float, default=60, help="Длительность нагрузки, с")
+    parser.add_argument("--ramp-up", type=float, default=0, help="Устройства стартуют равномерно за это время, с")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Средняя пауза между запросами устройства, с")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="Веса запросов: " + ",".join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()))
+    parser.add_argument("--files", type=int, default=30, help="Файлов в сохранениях игры")
+    parser.add_argument("--file-size", type=int, default=32 * 1024, help="Медианный размер файла, байт")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="Сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    if args.concurrency is None:
+        args.concurrency = args.users
+    if args.url and not args.panel_password:
+        parser.error("--panel-password is required with --url")
+
+    with tempfile.TemporaryDirectory(prefix="mnemy-load-") as workdir:
+        tree_path = os.path.join(workdir, "client-saves")
+        generate_tree(tree_path, args.files, args.file_size, sigma=1.0, compressibility=0.6)
+        variants = build_variants(tree_path, count=4)
+
+        if args.url:
+            report = asyncio.run(run_load(args.url, args, variants))
+            settings = None
+        else:
+            args.panel_password = args.panel_password or secrets.token_urlsafe(16)
+            server_dir = os.path.join(workdir, "server")
+            os.mkdir(server_dir)
+            settings = prepare_workdir(server_dir, parse_overrides(args.set))
+            with local_server(server_dir, args.workers, args.panel_username, args.panel_password) as url:
+                print(f"🚀 Локальный сервер {url}, воркеров: {args.workers}")
+                report = asyncio.run(run_load(url, args, variants))
+
+    print_report(report)
+    if args.output:
+        report["meta"] = {
+            **git_revision(),
+            "created_at": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key != "panel_password"},
+            "settings": settings,
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,85 @@
+import argparse
+import json
+import os
+
 import uvicorn
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from modules.admin_panel.admin_panel import panel_router, users_panel_router
 from modules.admin_panel.auth_controller import  panel_auth_router
-from modules.controllers import files_router, manage_router
-from modules.file_manager import create_all_folders
+from modules.async_sqls import async_engine
+from modules.controllers import files_router, manage_router, metrics_router
+from modules.file_manager import create_all_folders, reconcile_backup_catalog
+from modules.jobs import start_jobs
+from modules.locks import GameLockTimeout
+from modules.metrics import MetricsMiddleware
+from modules.resumable_uploads import collect_stale_uploads
+from modules.snapshots import prepare_snapshots
+
 
-app = FastAPI()
-routers = [files_router, manage_router, panel_router, panel_auth_router, users_panel_router]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_jobs()
+    yield
+    # aiosqlite держит поток на каждое соединение пула: без dispose процесс не завершится
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+routers = [files_router, manage_router, panel_router, panel_auth_router, users_panel_router, metrics_router]
 
 app.mount("/static", StaticFiles(directory="modules/admin_panel/static"), name="admin_static")
 
 for router in routers:
     app.include_router(router)
 
+
+@app.exception_handler(GameLockTimeout)
+async def game_lock_timeout_handler(request: Request, exc: GameLockTimeout):
+    return JSONResponse(status_code=423, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
+def parse_args():
+    with open("settings.json", "r") as settings_file:
+        settings = json.load(settings_file)
+
+    parser = argparse.ArgumentParser(description="Mnemy server")
+    parser.add_argument("--host", default=settings.get("host", "0.0.0.0"), help="Адрес для прослушивания")
+    parser.add_argument("--port", type=int, default=settings.get("port", 8000), help="Порт")
+    parser.add_argument("--uds", default=None, help="Unix-сокет вместо host/port (например, за nginx)")
+    parser.add_argument("--workers", type=int, default=settings.get("workers", 1),
+                        help="Число процессов-воркеров, 0 — по числу ядер")
+    parser.add_argument("--reload", action="store_true",
+                        help="Режим разработки: перезапуск при изменении кода (только с одним воркером)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--forwarded-allow-ips", default=None,
+                        help="IP прокси, которым доверяются заголовки X-Forwarded-*")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    workers = args.workers or os.cpu_count() or 1
+    if args.reload and workers > 1:
+        raise SystemExit("❌ --reload работает только с одним воркером")
+
     create_all_folders()
-    uvicorn.run(app="main:app", reload=True, host="0.0.0.0")
\ No newline at end of file
+    prepare_snapshots()
+    collect_stale_uploads()
+    reconcile_backup_catalog()
+    uvicorn.run(
+        app="main:app",
+        host=args.host,
+        port=args.port,
+        uds=args.uds,
+        workers=None if args.reload else workers,
+        reload=args.reload,
+        log_level=args.log_level,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+    )
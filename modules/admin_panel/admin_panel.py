@@ -6,8 +6,10 @@ from fastapi.responses import HTMLResponse, FileResponse
 from fastapi_jwt import JwtAuthorizationCredentials
 
 from modules.admin_panel.auth_controller import access_security
+from modules.executor import get_executor_stats
 from modules.models import Settings
-from modules.sqls import add_user, delete_user, get_user
+from modules.async_sqls import add_user, delete_user, get_user
+from modules.token_cache import get_token_cache_stats
 
 panel_router = APIRouter(prefix='/panel', tags=['Panel 🎛️'])
 users_panel_router = APIRouter(prefix='/panel/users', tags=['Panel 🎛️'])
@@ -47,20 +49,36 @@ async def get_settings(credentials: JwtAuthorizationCredentials = Depends(access
 
 @users_panel_router.post("/change_settings")
 async def change_settings(settings_data: Settings, credentials: JwtAuthorizationCredentials = Depends(access_security)):
+    import json
+
     try:
-        with open('settings.json', 'w+') as json_file:
-            data_to_load = settings_data.model_dump_json()
-            json_file.write(data_to_load)
+        with open('settings.json', 'r') as json_file:
+            settings = json.load(json_file)
+
+        # Дополняем, а не перезаписываем: в файле есть параметры, которых нет в панели
+        settings.update(settings_data.model_dump())
+        with open('settings.json', 'w') as json_file:
+            json.dump(settings, json_file)
 
         return {'msg':"Settings updated!"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error! {e}")
 
 
+@users_panel_router.get("/executor_stats")
+async def executor_stats(credentials: JwtAuthorizationCredentials = Depends(access_security)):
+    return {'executors': get_executor_stats()}
+
+
+@users_panel_router.get("/token_cache_stats")
+async def token_cache_stats(credentials: JwtAuthorizationCredentials = Depends(access_security)):
+    return {'token_cache': get_token_cache_stats()}
+
+
 @users_panel_router.put("/add", status_code=status.HTTP_201_CREATED)
 async def add_new_user(username: str, credentials: JwtAuthorizationCredentials = Depends(access_security)):
     api_token = generate_api_token()
-    status_result = add_user(username, api_token)
+    status_result = await add_user(username, api_token)
 
     if status_result is True:
         return {
@@ -74,7 +92,7 @@ async def add_new_user(username: str, credentials: JwtAuthorizationCredentials =
 
 @users_panel_router.delete("/delete")
 async def panel_delete_user(username: str, credentials: JwtAuthorizationCredentials = Depends(access_security)):
-    status_result = delete_user(username)
+    status_result = await delete_user(username)
 
     if status_result is True:
         return {
@@ -85,7 +103,7 @@ async def panel_delete_user(username: str, credentials: JwtAuthorizationCredenti
 
 @users_panel_router.get("/get_users")
 async def get_all_users(credentials: JwtAuthorizationCredentials = Depends(access_security)):
-    all_users = get_user(all_users=True)
+    all_users = await get_user(all_users=True)
 
     if all_users:
         return {
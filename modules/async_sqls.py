@@ -0,0 +1,300 @@
+"""
+Асинхронный доступ к базе для обработчиков HTTP (SQLAlchemy async engine поверх aiosqlite).
+
+Те же операции, что и в modules/sqls.py, но запросы не блокируют цикл событий.
+Синхронный modules/sqls.py остаётся для CLI и фоновых воркеров; он же создаёт таблицы и проводит миграции,
+поэтому этот модуль импортирует модели оттуда.
+Ошибки пишутся в журнал (logging, логгер modules.async_sqls), а не в stdout.
+"""
+import logging
+
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event, select, delete, update, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from datetime import datetime, UTC
+
+from modules.sqls import (User, SyncData, Job, GameGeneration, BackupRecord, bump_generation_statement, _set_sqlite_pragmas, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+                          DB_BUSY_TIMEOUT_MS)
+from modules.metrics import instrument_engine
+from modules.token_cache import token_cache
+
+logger = logging.getLogger(__name__)
+
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./users.db",
+    connect_args={"timeout": DB_BUSY_TIMEOUT_MS / 1000},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    echo=False
+)
+event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+instrument_engine(async_engine.sync_engine, "async")
+
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def create_async_session():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
+
+
+async def add_user(username: str, token: str) -> bool|str:
+    try:
+        async with create_async_session() as session:
+            result = await session.execute(
+                insert(User).values(username=username, api_token=token).on_conflict_do_nothing()
+            )
+            await session.commit()
+
+        if result.rowcount == 0:
+            logger.info(f"Пользователь {username} или токен уже существуют")
+            return 'already exists'
+        token_cache.invalidate()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при создании нового пользователя! Текст ошибки: {e}")
+        return False
+
+async def delete_user(username: str) -> bool:
+    try:
+        async with create_async_session() as session:
+            await session.execute(delete(User).where(User.username == username))
+            await session.commit()
+        token_cache.invalidate()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при удалении пользователя! Текст ошибки: {e}")
+        return False
+
+async def get_user(username: str = None, token: str = None, all_users=False):
+    try:
+        async with create_async_session() as session:
+            if all_users:
+                return list((await session.scalars(select(User))).all())
+
+            if username and token:
+                query = select(User).where(User.username == username, User.api_token == token)
+            elif username:
+                query = select(User).where(User.username == username)
+            elif token:
+                query = select(User).where(User.api_token == token)
+            else:
+                query = None
+
+            user = (await session.scalars(query.limit(1))).first() if query is not None else None
+            if user is None:
+                logger.info("Пользователь с заданным именем или токеном не найден")
+                return False
+
+        return user
+    except Exception as e:
+        logger.error(f"Ошибка при получении пользователя! Текст ошибки: {e}")
+        return False
+
+async def add_sync_date(username: str, game_name: str):
+    try:
+        async with create_async_session() as session:
+            result = await session.execute(
+                insert(SyncData)
+                .values(username=username, game_name=game_name, last_sync_date=datetime.now(UTC))
+                .on_conflict_do_nothing(index_elements=[SyncData.username, SyncData.game_name])
+            )
+            await session.commit()
+
+        if result.rowcount == 0:
+            logger.debug(f"Запись для игры {game_name} пользователя {username} уже существует")
+        else:
+            logger.debug(f"Добавлена новая запись для игры {game_name} пользователя {username}")
+    except IntegrityError as e:
+        logger.warning(f"Конфликт при добавлении записи для игры {game_name} пользователя {username}."
+                       f" Возможно, такая игра уже есть. Текст ошибки: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+async def update_sync_date(username: str, game_name: str):
+    try:
+        async with create_async_session() as session:
+            now = datetime.now(UTC)
+            await session.execute(
+                insert(SyncData)
+                .values(username=username, game_name=game_name, last_sync_date=now)
+                .on_conflict_do_update(index_elements=[SyncData.username, SyncData.game_name],
+                                       set_={"last_sync_date": now})
+            )
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+async def check_last_sync_date(username: str, game_name: str, user_date: datetime):
+    import pytz
+    try:
+        async with create_async_session() as session:
+            game = (await session.scalars(
+                select(SyncData).where(SyncData.game_name == game_name, SyncData.username == username).limit(1)
+            )).first()
+
+        if game is None:
+            await add_sync_date(username, game_name)
+            return True
+        local_sync_date = game.last_sync_date
+        logger.debug(f"Server saved time: {local_sync_date.replace(tzinfo=pytz.utc)}, "
+                     f"client saved time: {user_date.astimezone(pytz.utc)}")
+        if local_sync_date.replace(tzinfo=pytz.utc) > user_date.astimezone(pytz.utc):
+            return False
+        else:
+            return True
+
+    except Exception as e:
+        logger.error(
+            f"Ошибка при получении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+async def delete_sync_data(username: str, game_name: str):
+    try:
+        async with create_async_session() as session:
+            await session.execute(delete(SyncData).where(SyncData.username == username, SyncData.game_name == game_name))
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при удалении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+
+async def add_job(job_id: str, kind: str, username: str, game_name: str, payload: str, max_attempts: int) -> bool:
+    try:
+        async with create_async_session() as session:
+            now = datetime.now(UTC)
+            session.add(Job(
+                job_id=job_id,
+                kind=kind,
+                username=username,
+                game_name=game_name,
+                payload=payload,
+                status="pending",
+                attempts=0,
+                max_attempts=max_attempts,
+                created_at=now,
+                updated_at=now,
+                run_after=now,
+            ))
+            await session.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении задачи {kind} для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return False
+
+async def get_job(job_id: str) -> dict | None:
+    try:
+        async with create_async_session() as session:
+            job = (await session.scalars(select(Job).where(Job.job_id == job_id).limit(1))).first()
+            return job.to_dict() if job else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении задачи {job_id}! Текст ошибки: {e}")
+        return None
+
+async def move_pending_jobs(username: str, game_name: str, new_game_name: str) -> int:
+    """Переносит ожидающие задачи игры на новое имя (при переименовании). :returns число перенесённых задач"""
+    try:
+        async with create_async_session() as session:
+            result = await session.execute(update(Job).where(
+                Job.username == username, Job.game_name == game_name, Job.status == "pending"
+            ).values(game_name=new_game_name, updated_at=datetime.now(UTC)))
+            await session.commit()
+            return result.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при переносе задач игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return 0
+
+async def cancel_pending_jobs(username: str, game_name: str, kinds: list[str]) -> int:
+    """Отменяет ожидающие задачи игры указанных видов (при удалении игры). :returns число отменённых задач"""
+    try:
+        async with create_async_session() as session:
+            result = await session.execute(update(Job).where(
+                Job.username == username, Job.game_name == game_name, Job.status == "pending", Job.kind.in_(kinds)
+            ).values(status="cancelled", updated_at=datetime.now(UTC)))
+            await session.commit()
+            return result.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при отмене задач игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return 0
+
+
+async def bump_generation(username: str, game_name: str, saves: bool = True, backups: bool = False):
+    try:
+        async with create_async_session() as session:
+            await session.execute(bump_generation_statement(username, game_name, saves, backups))
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении счётчика изменений игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+async def get_generation(username: str, game_name: str) -> int | None:
+    """Счётчик изменений папки сохранений; None — ошибка базы (условные запросы тогда не обслуживаются)."""
+    try:
+        async with create_async_session() as session:
+            generation = await session.scalar(select(GameGeneration.generation).where(
+                GameGeneration.username == username, GameGeneration.game_name == game_name))
+            return generation or 0
+    except Exception as e:
+        logger.error(f"Ошибка при получении счётчика изменений игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return None
+
+async def get_user_generations(username: str) -> dict[str, tuple[int, int]] | None:
+    """{'game_name': (generation, backups_generation)} для всех игр пользователя; None — ошибка базы."""
+    try:
+        async with create_async_session() as session:
+            rows = (await session.scalars(select(GameGeneration).where(GameGeneration.username == username))).all()
+            return {row.game_name: (row.generation, row.backups_generation) for row in rows}
+    except Exception as e:
+        logger.error(f"Ошибка при получении счётчиков изменений пользователя {username}! Текст ошибки: {e}")
+        return None
+
+
+async def list_backup_records(username: str, game_name: str = None, limit: int = None,
+                              offset: int = 0) -> tuple[list[BackupRecord], int] | None:
+    """Бэкапы пользователя (или одной игры) от новых к старым с пагинацией: (страница, всего). None — ошибка базы."""
+    try:
+        async with create_async_session() as session:
+            conditions = [BackupRecord.username == username]
+            if game_name is not None:
+                conditions.append(BackupRecord.game_name == game_name)
+
+            total = await session.scalar(select(func.count()).select_from(BackupRecord).where(*conditions))
+            query = select(BackupRecord).where(*conditions).order_by(
+                BackupRecord.game_name, BackupRecord.created_at.desc(), BackupRecord.id.desc()
+            ).offset(offset)
+            if limit is not None:
+                query = query.limit(limit)
+            return list((await session.scalars(query)).all()), total
+    except Exception as e:
+        logger.error(f"Ошибка при получении каталога бэкапов пользователя {username}! Текст ошибки: {e}")
+        return None
+
+async def get_backup_totals() -> dict[str, tuple[int, int]] | None:
+    """{'username': (число бэкапов, суммарный размер)} по всему каталогу; None — ошибка базы."""
+    try:
+        async with create_async_session() as session:
+            rows = (await session.execute(
+                select(BackupRecord.username, func.count(), func.coalesce(func.sum(BackupRecord.size_bytes), 0))
+                .group_by(BackupRecord.username)
+            )).all()
+            return {username: (count, size) for username, count, size in rows}
+    except Exception as e:
+        logger.error(f"Ошибка при подсчёте бэкапов! Текст ошибки: {e}")
+        return None
+
+async def rename_backup_records(username: str, game_name: str, new_game_name: str):
+    try:
+        async with create_async_session() as session:
+            await session.execute(update(BackupRecord).where(
+                BackupRecord.username == username, BackupRecord.game_name == game_name
+            ).values(game_name=new_game_name))
+            await session.commit()
+    except Exception as e:
+        logger.error(f"Ошибка при переименовании игры {game_name} в каталоге бэкапов пользователя {username}! Текст ошибки: {e}")
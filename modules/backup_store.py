@@ -0,0 +1,434 @@
+"""
+Дедуплицирующее хранилище бэкапов.
+
+Содержимое файлов хранится один раз на пользователя в backups/<user>/.store/objects/<md5[:2]>/<md5>[.gz|.zst],
+каждый бэкап — небольшой манифест backups/<user>/<game>/<время>.manifest.json со списком файлов и их хэшей.
+Счётчики ссылок лежат в backups/<user>/.store/refcounts.json, блоб удаляется, когда на него не ссылается
+ни один манифест.
+
+Перенос старых tar.gz бэкапов в новый формат:
+    python -m modules.backup_store migrate [username]
+Пересчёт счётчиков и удаление осиротевших блобов:
+    python -m modules.backup_store gc [username]
+Сверка каталога бэкапов (таблица backups) с файлами на диске:
+    python -m modules.backup_store catalog [username]
+"""
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tarfile
+import uuid
+
+from contextlib import contextmanager
+from datetime import datetime, UTC
+
+from modules.compression import (BLOB_EXTENSIONS, get_codec, detect_file_codec, is_tar_backup,
+                                 strip_archive_extension)
+from modules.hash_index import update_hash_index, compute_fingerprint
+
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_FORMAT = "mnemy-manifest"
+MANIFEST_VERSION = 1
+STORE_DIRNAME = ".store"
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_store_dir(username: str) -> str:
+    return f"backups/{username}/{STORE_DIRNAME}"
+
+
+def get_store_dir_for_manifest(manifest_path: str) -> str:
+    """backups/<user>/<game>/<name>.manifest.json -> backups/<user>/.store"""
+    return os.path.join(os.path.dirname(os.path.dirname(manifest_path)), STORE_DIRNAME)
+
+
+def is_manifest(path: str) -> bool:
+    return path.endswith(MANIFEST_SUFFIX)
+
+
+def _blob_path(store_dir: str, md5_hash: str, codec) -> str:
+    return os.path.join(store_dir, "objects", md5_hash[:2], md5_hash + codec.blob_extension)
+
+
+def _find_blob(store_dir: str, md5_hash: str):
+    """Ищет блоб с любым из кодеков. :returns (путь, кодек) или (None, None)"""
+    for codec_name, extension in BLOB_EXTENSIONS.items():
+        blob_path = os.path.join(store_dir, "objects", md5_hash[:2], md5_hash + extension)
+        if os.path.exists(blob_path):
+            return blob_path, get_codec(codec_name)
+    return None, None
+
+
+@contextmanager
+def _store_lock(store_dir: str):
+    """Эксклюзивная блокировка хранилища (работает и между потоками, и между процессами)."""
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, "lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = f"{path}.tmp{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    with open(tmp_path, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(tmp_path, path)
+
+
+def _load_refcounts(store_dir: str) -> dict:
+    try:
+        with open(os.path.join(store_dir, "refcounts.json"), "r") as refs_file:
+            refcounts = json.load(refs_file)
+        if isinstance(refcounts, dict):
+            return refcounts
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Счётчики ссылок {store_dir} повреждены, пересчитываю по манифестам: {e}")
+
+    return _count_references(store_dir)
+
+
+def _save_refcounts(store_dir: str, refcounts: dict):
+    _write_json_atomic(os.path.join(store_dir, "refcounts.json"), refcounts)
+
+
+def load_manifest(manifest_path: str) -> dict:
+    with open(manifest_path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"{manifest_path} is not a backup manifest")
+    return manifest
+
+
+def _iter_manifests(store_dir: str):
+    user_dir = os.path.dirname(store_dir)
+    with os.scandir(user_dir) as games:
+        for game in games:
+            if game.is_dir() and not game.name.startswith("."):
+                with os.scandir(game.path) as files:
+                    for file_entry in files:
+                        if file_entry.is_file() and is_manifest(file_entry.name):
+                            yield file_entry.path
+
+
+def _count_references(store_dir: str) -> dict:
+    refcounts = dict()
+    for manifest_path in _iter_manifests(store_dir):
+        try:
+            manifest = load_manifest(manifest_path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Пропущен повреждённый манифест {manifest_path}: {e}")
+            continue
+        for md5_hash in {file_data["hash"] for file_data in manifest["files"].values()}:
+            refcounts[md5_hash] = refcounts.get(md5_hash, 0) + 1
+    return refcounts
+
+
+def _put_blob(store_dir: str, fileobj, codec, expected_hash: str = None) -> tuple[str, int]:
+    """
+    Кладёт содержимое в хранилище, сжимая его кодеком codec.
+    Если блоб с ожидаемым хэшем уже есть (любым кодеком) — файл не читается вовсе.
+    :returns (md5 фактического содержимого, размер)
+    """
+    if expected_hash is not None and _find_blob(store_dir, expected_hash)[0] is not None:
+        return expected_hash, None
+
+    objects_dir = os.path.join(store_dir, "objects")
+    os.makedirs(objects_dir, exist_ok=True)
+    tmp_path = os.path.join(objects_dir, f"incoming_{uuid.uuid4().hex}")
+
+    md5 = hashlib.md5()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as raw_blob, codec.open_writer(raw_blob) as blob:
+            while chunk := fileobj.read(CHUNK_SIZE):
+                md5.update(chunk)
+                size += len(chunk)
+                blob.write(chunk)
+
+        md5_hash = md5.hexdigest()
+        blob_path = _blob_path(store_dir, md5_hash, codec)
+        if _find_blob(store_dir, md5_hash)[0] is not None:
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        return md5_hash, size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def create_manifest_backup(folder_path: str, manifest_path: str, game_name: str, file_hashes: dict = None,
+                           codec="gzip:6") -> bool:
+    """
+    Создаёт бэкап папки в виде манифеста; в хранилище попадают только новые блобы.
+    :param file_hashes: уже посчитанные {'file_path': 'md5_hash'}, чтобы не сканировать папку повторно
+    :param codec: кодек для новых блобов (уже сохранённые блобы не пережимаются)
+    """
+    try:
+        codec = get_codec(codec)
+        store_dir = get_store_dir_for_manifest(manifest_path)
+        if file_hashes is None:
+            file_hashes = update_hash_index(folder_path)
+        files = dict()
+
+        with _store_lock(store_dir):
+            for relative_path in sorted(file_hashes):
+                full_path = os.path.join(folder_path, relative_path.lstrip("/"))
+                try:
+                    stat = os.stat(full_path)
+                    with open(full_path, "rb") as file:
+                        md5_hash, _ = _put_blob(store_dir, file, codec, expected_hash=file_hashes[relative_path])
+                except (OSError, PermissionError) as e:
+                    print(f"⚠️  Пропущен элемент {full_path}: {e}")
+                    continue
+
+                files[relative_path] = {
+                    "hash": md5_hash,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "mode": stat.st_mode & 0o777,
+                }
+
+            _write_json_atomic(manifest_path, {
+                "format": MANIFEST_FORMAT,
+                "version": MANIFEST_VERSION,
+                "game_name": game_name,
+                "created_at": datetime.now(UTC).isoformat(),
+                "codec": codec.spec,
+                "fingerprint": compute_fingerprint({path: data["hash"] for path, data in files.items()}),
+                "files": files,
+            })
+
+            refcounts = _load_refcounts(store_dir)
+            for md5_hash in {file_data["hash"] for file_data in files.values()}:
+                refcounts[md5_hash] = refcounts.get(md5_hash, 0) + 1
+            _save_refcounts(store_dir, refcounts)
+
+        return True
+    except Exception as e:
+        print(f"❌ Manifest backup error: {e}")
+        import traceback
+        traceback.print_exc()
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return False
+
+
+def delete_manifest_backup(manifest_path: str):
+    """Удаляет манифест и блобы, на которые больше никто не ссылается."""
+    store_dir = get_store_dir_for_manifest(manifest_path)
+
+    with _store_lock(store_dir):
+        try:
+            manifest = load_manifest(manifest_path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Манифест {manifest_path} не прочитан, удаляю без освобождения блобов: {e}")
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            return
+
+        os.remove(manifest_path)
+
+        refcounts = _load_refcounts(store_dir)
+        for md5_hash in {file_data["hash"] for file_data in manifest["files"].values()}:
+            count = refcounts.get(md5_hash, 0) - 1
+            if count > 0:
+                refcounts[md5_hash] = count
+                continue
+
+            refcounts.pop(md5_hash, None)
+            blob_path, _ = _find_blob(store_dir, md5_hash)
+            if blob_path is not None:
+                os.remove(blob_path)
+        _save_refcounts(store_dir, refcounts)
+
+
+def restore_manifest_backup(manifest_path: str, destination_folder: str, paths: list[str] = None) -> bool:
+    """Восстанавливает файлы из манифеста в destination_folder: все или только выбранные paths."""
+    store_dir = get_store_dir_for_manifest(manifest_path)
+    manifest = load_manifest(manifest_path)
+
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+
+    for relative_path in (manifest["files"] if paths is None else paths):
+        file_data = manifest["files"][relative_path]
+        target_path = os.path.normpath(os.path.join(destination_folder, relative_path.lstrip("/")))
+        if not target_path.startswith(os.path.normpath(destination_folder) + os.sep):
+            raise ValueError(f"Unsafe path in manifest: {relative_path}")
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        blob_path, codec = _find_blob(store_dir, file_data["hash"])
+        if blob_path is None:
+            raise FileNotFoundError(f"Blob {file_data['hash']} for {relative_path} is missing in {store_dir}")
+        # Файл может быть жёсткой ссылкой из прошлой версии снимка (modules/snapshots.py): не перезаписываем на месте
+        if os.path.lexists(target_path):
+            os.unlink(target_path)
+        with (open(blob_path, "rb") as raw_blob, codec.open_reader(raw_blob) as blob,
+              open(target_path, "wb") as target):
+            shutil.copyfileobj(blob, target, CHUNK_SIZE)
+        os.chmod(target_path, file_data["mode"])
+        os.utime(target_path, (file_data["mtime"], file_data["mtime"]))
+
+    return True
+
+
+def iter_manifest_file_chunks(manifest_path: str, relative_path: str, chunk_size: int = 65536):
+    """Генератор распакованного содержимого одного файла бэкапа (читается только его блоб)."""
+    store_dir = get_store_dir_for_manifest(manifest_path)
+    file_data = load_manifest(manifest_path)["files"].get(relative_path)
+    if file_data is None:
+        raise FileNotFoundError(f"{relative_path} is not in backup {manifest_path}")
+
+    blob_path, codec = _find_blob(store_dir, file_data["hash"])
+    if blob_path is None:
+        raise FileNotFoundError(f"Blob {file_data['hash']} for {relative_path} is missing in {store_dir}")
+    with open(blob_path, "rb") as raw_blob, codec.open_reader(raw_blob) as blob:
+        while chunk := blob.read(chunk_size):
+            yield chunk
+
+
+def get_manifest_fingerprint(manifest_path: str) -> str:
+    manifest = load_manifest(manifest_path)
+    if "fingerprint" in manifest:
+        return manifest["fingerprint"]
+    return compute_fingerprint({path: data["hash"] for path, data in manifest["files"].items()})
+
+
+def get_manifest_info(manifest_path: str) -> dict:
+    manifest = load_manifest(manifest_path)
+    return {
+        "size_bytes": sum(file_data["size"] for file_data in manifest["files"].values()),
+        "file_count": len(manifest["files"]),
+    }
+
+
+def migrate_tar_backup(tar_path: str, codec="gzip:6") -> str:
+    """Переносит tar-бэкап в хранилище, возвращает путь к новому манифесту. Исходный архив удаляется."""
+    codec = get_codec(codec)
+    manifest_path = strip_archive_extension(tar_path) + MANIFEST_SUFFIX
+    store_dir = get_store_dir_for_manifest(manifest_path)
+    game_name = os.path.basename(os.path.dirname(tar_path))
+    created_at = datetime.fromtimestamp(os.path.getmtime(tar_path), UTC)
+    files = dict()
+
+    with _store_lock(store_dir):
+        with (open(tar_path, "rb") as raw_file,
+              detect_file_codec(raw_file).open_reader(raw_file) as stream,
+              tarfile.open(fileobj=stream, mode="r|") as tar):
+            for member in tar:
+                if not member.isfile():
+                    continue
+                md5_hash, size = _put_blob(store_dir, tar.extractfile(member), codec)
+                files["/" + os.path.normpath(member.name).lstrip("/")] = {
+                    "hash": md5_hash,
+                    "size": size,
+                    "mtime": member.mtime,
+                    "mode": member.mode & 0o777,
+                }
+
+        _write_json_atomic(manifest_path, {
+            "format": MANIFEST_FORMAT,
+            "version": MANIFEST_VERSION,
+            "game_name": game_name,
+            "created_at": created_at.isoformat(),
+            "migrated_from": os.path.basename(tar_path),
+            "codec": codec.spec,
+            "fingerprint": compute_fingerprint({path: data["hash"] for path, data in files.items()}),
+            "files": files,
+        })
+        os.utime(manifest_path, (created_at.timestamp(), created_at.timestamp()))
+
+        refcounts = _load_refcounts(store_dir)
+        for md5_hash in {file_data["hash"] for file_data in files.values()}:
+            refcounts[md5_hash] = refcounts.get(md5_hash, 0) + 1
+        _save_refcounts(store_dir, refcounts)
+
+    os.remove(tar_path)
+    if os.path.exists(f"{tar_path}.meta.json"):
+        os.remove(f"{tar_path}.meta.json")
+    return manifest_path
+
+
+def migrate_user_backups(username: str, codec="gzip:6"):
+    user_dir = f"backups/{username}"
+    with os.scandir(user_dir) as games:
+        game_dirs = [game.path for game in games if game.is_dir() and not game.name.startswith(".")]
+
+    for game_dir in game_dirs:
+        for filename in sorted(os.listdir(game_dir)):
+            if is_tar_backup(filename):
+                tar_path = os.path.join(game_dir, filename)
+                try:
+                    print(f"Переношу {tar_path} -> {migrate_tar_backup(tar_path, codec)}")
+                except Exception as e:
+                    print(f"❌ Не удалось перенести {tar_path}: {e}")
+
+
+def collect_garbage(username: str):
+    """Пересчитывает ссылки по манифестам и удаляет блобы, на которые никто не ссылается."""
+    store_dir = get_store_dir(username)
+    if not os.path.exists(store_dir):
+        return
+
+    with _store_lock(store_dir):
+        refcounts = _count_references(store_dir)
+        removed = 0
+        objects_dir = os.path.join(store_dir, "objects")
+        if os.path.exists(objects_dir):
+            for prefix in os.listdir(objects_dir):
+                prefix_dir = os.path.join(objects_dir, prefix)
+                if not os.path.isdir(prefix_dir):
+                    # Недописанные блобы после падения
+                    os.remove(prefix_dir)
+                    continue
+                for blob_name in os.listdir(prefix_dir):
+                    if blob_name.split(".")[0] not in refcounts:
+                        os.remove(os.path.join(prefix_dir, blob_name))
+                        removed += 1
+        _save_refcounts(store_dir, refcounts)
+
+    print(f"[{username}] Удалено блобов без ссылок: {removed}")
+
+
+def _all_usernames() -> list[str]:
+    if not os.path.exists("backups"):
+        return []
+    return [entry.name for entry in os.scandir("backups") if entry.is_dir()]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "gc", "catalog"):
+        print("Usage: python -m modules.backup_store migrate|gc|catalog [username]")
+        sys.exit(1)
+
+    # file_manager сам импортирует этот модуль, поэтому импорт только здесь
+    from modules.file_manager import reconcile_backup_catalog
+    from modules.async_sqls import async_engine
+
+    with open("settings.json", "r") as settings_file:
+        migrate_codec = json.load(settings_file).get("backup_codec", "gzip:6")
+
+    usernames = sys.argv[2:] or _all_usernames()
+    for name in usernames:
+        if sys.argv[1] == "migrate":
+            migrate_user_backups(name, migrate_codec)
+        if sys.argv[1] != "catalog":
+            collect_garbage(name)
+        # Миграция меняет имена файлов бэкапов: каталог сверяется с диском
+        reconcile_backup_catalog(name)
+
+    # Соединения асинхронного движка (если он успел их открыть) держат процесс живым
+    asyncio.run(async_engine.dispose())
@@ -0,0 +1,264 @@
+"""
+Поблочная дельта-синхронизация больших файлов в стиле rsync.
+
+Сигнатура файла — размер блока и для каждого блока пара (слабая сумма adler32, md5):
+    {"size": 123456789, "block_size": 65536, "blocks": [[adler32, "md5"], ...]}
+Дельта строится по сигнатуре старой версии файла и новой версии: окно размером в блок катится по новому файлу,
+слабая сумма пересчитывается за O(1) на байт, совпадение подтверждается md5 — и блок передаётся ссылкой
+на номер блока старой версии, остальное — как есть.
+
+Двоичный формат дельты (целые числа little-endian):
+    b"MNDL1" + <uint32 block_size>
+    b"C" + <uint32 номер блока> + <uint32 число блоков подряд>   — скопировать блоки из старой версии
+    b"L" + <uint32 длина> + <байты>                               — вставить байты
+    b"E" + <16 байт md5 результата>                               — конец, проверка целостности
+Дельта может быть сжата любым кодеком modules/compression.py: сервер определяет его по первым байтам.
+
+Несовпавшие байты окно проходит по одному, на чистом Python это порядка секунд на мегабайт. Поэтому объём литералов
+ограничивается (max_literal): если дельта выходит больше, строить её дальше нет смысла — DeltaTooLarge,
+и клиент передаёт файл целиком.
+
+Один и тот же код работает в обе стороны: клиент → сервер (сигнатура с сервера, дельта от клиента)
+и сервер → клиент (сигнатура от клиента, дельта с сервера).
+"""
+import hashlib
+import struct
+import zlib
+
+DELTA_MAGIC = b"MNDL1"
+ADLER_MOD = 65521
+READ_SIZE = 4 * 1024 * 1024
+# Литерал сбрасывается в дельту кусками, чтобы буфер не рос на сильно изменённых файлах
+MAX_LITERAL = 1024 * 1024
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class DeltaBaseMismatch(ValueError):
+    """Дельта построена не от той версии файла, что лежит на сервере."""
+
+
+class DeltaTooLarge(ValueError):
+    """Литералов в дельте больше допустимого: файл выгоднее передать целиком."""
+
+
+def roll_adler32(checksum: int, byte_out: int, byte_in: int, block_size: int) -> int:
+    """Сдвигает окно adler32 на один байт: byte_out уходит слева, byte_in приходит справа."""
+    a = checksum & 0xffff
+    b = checksum >> 16
+    a = (a - byte_out + byte_in) % ADLER_MOD
+    b = (b - block_size * byte_out + a - 1) % ADLER_MOD
+    return (b << 16) | a
+
+
+def compute_signature(fileobj, block_size: int) -> dict:
+    size = 0
+    blocks = list()
+    while block := fileobj.read(block_size):
+        size += len(block)
+        blocks.append([zlib.adler32(block), hashlib.md5(block).hexdigest()])
+    return {"size": size, "block_size": block_size, "blocks": blocks}
+
+
+def validate_signature(signature: dict):
+    block_size = signature.get("block_size")
+    if not isinstance(block_size, int) or not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise ValueError(f"block_size must be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}")
+    if len(signature.get("blocks", [])) != -(-signature.get("size", 0) // block_size):
+        raise ValueError("Number of blocks does not match size and block_size")
+
+
+def check_signature_fits(signature: dict, file_size: int, max_literal: int):
+    """
+    Отсекает сигнатуры, с которыми дельта до файла размера file_size заведомо упрётся в max_literal, до того как окно
+    пройдёт по файлу: если файл больше описанного сигнатурой (или она пустая) больше чем на max_literal байт.
+    """
+    if file_size - signature["size"] > max_literal:
+        raise DeltaTooLarge(f"File grew by {file_size - signature['size']} bytes, more than {max_literal}")
+
+
+class _DeltaWriter:
+    def __init__(self, out, block_size: int, max_literal: int | None = None):
+        self._out = out
+        self._copy = None
+        self._max_literal = max_literal
+        self.literal_bytes = 0
+        self._out.write(DELTA_MAGIC + struct.pack("<I", block_size))
+
+    def copy(self, index: int):
+        if self._copy is not None and self._copy[0] + self._copy[1] == index:
+            self._copy[1] += 1
+            return
+        self._flush_copy()
+        self._copy = [index, 1]
+
+    def literal(self, data):
+        if not data:
+            return
+        self.literal_bytes += len(data)
+        if self._max_literal is not None and self.literal_bytes > self._max_literal:
+            raise DeltaTooLarge(f"Delta needs more than {self._max_literal} literal bytes")
+        self._flush_copy()
+        self._out.write(b"L" + struct.pack("<I", len(data)))
+        self._out.write(data)
+
+    def finish(self, digest: bytes):
+        self._flush_copy()
+        self._out.write(b"E" + digest)
+
+    def _flush_copy(self):
+        if self._copy is not None:
+            self._out.write(b"C" + struct.pack("<II", *self._copy))
+            self._copy = None
+
+
+def compute_delta(signature: dict, source, out, max_literal: int | None = None) -> dict:
+    """
+    Пишет в out дельту, превращающую файл с сигнатурой signature в содержимое source.
+    :param max_literal: сколько байт можно передать как есть; больше — DeltaTooLarge, out остаётся недописанным
+    :returns {"hash": md5 результата, "size": размер результата, "literal_bytes": сколько байт передано как есть}
+    """
+    block_size = signature["block_size"]
+    blocks = signature["blocks"]
+    last_block_size = signature["size"] - (len(blocks) - 1) * block_size if blocks else 0
+
+    weak_index = dict()
+    for index, (weak, strong) in enumerate(blocks):
+        weak_index.setdefault(weak, []).append((strong, index))
+
+    def find_block(window, weak) -> int | None:
+        candidates = weak_index.get(weak)
+        if candidates:
+            strong = hashlib.md5(window).hexdigest()
+            for candidate_strong, index in candidates:
+                if candidate_strong == strong and (index < len(blocks) - 1 or len(window) == last_block_size):
+                    return index
+        return None
+
+    writer = _DeltaWriter(out, block_size, max_literal)
+    # Литерал сбрасывается не реже, чем исчерпается лимит: превышение обнаружится сразу, а не через мегабайт
+    flush_literal_at = MAX_LITERAL if max_literal is None else max(1, min(MAX_LITERAL, max_literal + 1))
+    md5 = hashlib.md5()
+    size = 0
+    buffer = bytearray()
+    offset = 0
+    literal_start = 0
+    weak = None
+    eof = False
+
+    while True:
+        while len(buffer) - offset < block_size and not eof:
+            # Уже записанное в дельту больше не нужно
+            del buffer[:literal_start]
+            offset -= literal_start
+            literal_start = 0
+            chunk = source.read(READ_SIZE)
+            if not chunk:
+                eof = True
+            md5.update(chunk)
+            size += len(chunk)
+            buffer += chunk
+
+        window_size = min(block_size, len(buffer) - offset)
+        if window_size == 0:
+            break
+
+        if window_size < block_size:
+            # Хвост файла короче блока: он совпадает только с последним (неполным) блоком старой версии
+            window = bytes(buffer[offset:])
+            index = find_block(window, zlib.adler32(window))
+            if index is not None:
+                writer.literal(buffer[literal_start:offset])
+                writer.copy(index)
+                literal_start = offset = len(buffer)
+            break
+
+        if weak is None:
+            weak = zlib.adler32(buffer[offset:offset + block_size])
+        index = find_block(buffer[offset:offset + block_size], weak) if weak in weak_index else None
+        if index is not None:
+            writer.literal(buffer[literal_start:offset])
+            writer.copy(index)
+            offset += block_size
+            literal_start = offset
+            weak = None
+            continue
+
+        stop = min(len(buffer) - block_size, literal_start + flush_literal_at)
+        if offset < stop:
+            # Горячий цикл: roll_adler32 развёрнут на локальных переменных, окно катится до первого
+            # кандидата в индексе, конца прочитанного или сброса литерала
+            a = weak & 0xffff
+            b = weak >> 16
+            while offset < stop:
+                byte_out = buffer[offset]
+                a = (a - byte_out + buffer[offset + block_size]) % ADLER_MOD
+                b = (b - block_size * byte_out + a - 1) % ADLER_MOD
+                offset += 1
+                if ((b << 16) | a) in weak_index:
+                    break
+            weak = (b << 16) | a
+        elif len(buffer) - offset > block_size:
+            weak = roll_adler32(weak, buffer[offset], buffer[offset + block_size], block_size)
+            offset += 1
+        else:
+            # Следующий байт ещё не прочитан: сумма будет посчитана заново после чтения
+            weak = None
+            offset += 1
+        if offset - literal_start >= flush_literal_at:
+            writer.literal(buffer[literal_start:offset])
+            literal_start = offset
+
+    writer.literal(buffer[literal_start:])
+    writer.finish(md5.digest())
+    return {"hash": md5.hexdigest(), "size": size, "literal_bytes": writer.literal_bytes}
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("Delta is truncated")
+        data += chunk
+    return bytes(data)
+
+
+def apply_delta(basis, delta, out) -> str:
+    """
+    Собирает в out новую версию файла из старой (basis, seekable) и дельты.
+    :returns md5 результата (сверен с md5 из конца дельты)
+    """
+    if _read_exact(delta, len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError("Not a block delta")
+    block_size, = struct.unpack("<I", _read_exact(delta, 4))
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise ValueError(f"Unsupported block size {block_size}")
+
+    basis_blocks = -(-basis.seek(0, 2) // block_size)
+    md5 = hashlib.md5()
+    while True:
+        operation = _read_exact(delta, 1)
+        if operation == b"C":
+            index, count = struct.unpack("<II", _read_exact(delta, 8))
+            if count == 0 or index + count > basis_blocks:
+                raise ValueError(f"Delta copies blocks {index}..{index + count} of {basis_blocks}")
+            basis.seek(index * block_size)
+            remaining = count * block_size
+            while remaining > 0 and (data := basis.read(min(remaining, READ_SIZE))):
+                md5.update(data)
+                out.write(data)
+                remaining -= len(data)
+        elif operation == b"L":
+            length, = struct.unpack("<I", _read_exact(delta, 4))
+            while length > 0:
+                data = _read_exact(delta, min(length, READ_SIZE))
+                md5.update(data)
+                out.write(data)
+                length -= len(data)
+        elif operation == b"E":
+            if _read_exact(delta, 16) != md5.digest():
+                raise ValueError("Result of the delta does not match its checksum")
+            return md5.hexdigest()
+        else:
+            raise ValueError(f"Unknown delta operation {operation!r}")
@@ -0,0 +1,181 @@
+"""
+Кодеки сжатия для архивов скачивания и бэкапов.
+
+Кодек задаётся строкой "имя[:уровень]": "gzip:1", "gzip:9", "zstd:3", "zstd:19", "tar" (без сжатия).
+zstd доступен, только если установлен пакет zstandard.
+gzip сжимается параллельно на нескольких ядрах (modules/pgzip.py), если gzip_threads в settings.json больше 1
+(0 — по числу ядер); результат — обычный gzip, клиентам ничего менять не нужно.
+"""
+import gzip
+import json
+import os
+
+from modules.pgzip import ParallelGzipWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+with open("settings.json", "r") as settings_file:
+    GZIP_THREADS: int = json.load(settings_file).get("gzip_threads", 0) or os.cpu_count() or 1
+
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3, "tar": 0}
+ARCHIVE_EXTENSIONS = {"gzip": ".tar.gz", "zstd": ".tar.zst", "tar": ".tar"}
+BLOB_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "tar": ""}
+MEDIA_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd", "tar": "application/x-tar"}
+
+
+class Codec:
+    def __init__(self, name: str, level: int, threads: int = 1):
+        self.name = name
+        self.level = level
+        self.threads = threads if name == "gzip" else 1
+
+    @property
+    def spec(self) -> str:
+        return self.name if self.name == "tar" else f"{self.name}:{self.level}"
+
+    @property
+    def cache_tag(self) -> str:
+        """Метка для кэша и ETag: параллельный gzip даёт другие (но тоже детерминированные) байты."""
+        return f"{self.name}{self.level}{'p' if self.threads > 1 else ''}"
+
+    @property
+    def archive_extension(self) -> str:
+        return ARCHIVE_EXTENSIONS[self.name]
+
+    @property
+    def blob_extension(self) -> str:
+        return BLOB_EXTENSIONS[self.name]
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.name]
+
+    def open_writer(self, fileobj):
+        """Оборачивает fileobj в поток сжатия. Закрытие обёртки не закрывает fileobj."""
+        if self.name == "gzip" and self.threads > 1:
+            return ParallelGzipWriter(fileobj, level=self.level, threads=self.threads)
+        if self.name == "gzip":
+            return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.level, mtime=0)
+        if self.name == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).stream_writer(fileobj, closefd=False)
+        return _NonClosingWrapper(fileobj)
+
+    def open_reader(self, fileobj):
+        """Оборачивает fileobj в поток распаковки."""
+        if self.name == "gzip":
+            return gzip.GzipFile(fileobj=fileobj, mode="rb")
+        if self.name == "zstd":
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+        return _NonClosingWrapper(fileobj)
+
+    def __repr__(self):
+        return f"Codec({self.spec})"
+
+
+class _NonClosingWrapper:
+    """Поток без сжатия: пропускает данные как есть и не закрывает исходный файл."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data):
+        return self._fileobj.write(data)
+
+    def read(self, size=-1):
+        return self._fileobj.read(size)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def available_codecs() -> list[str]:
+    names = ["gzip", "tar"]
+    if zstandard is not None:
+        names.insert(1, "zstd")
+    return names
+
+
+def get_codec(spec) -> Codec:
+    """Разбирает строку "имя[:уровень]" (или возвращает уже готовый Codec)."""
+    if isinstance(spec, Codec):
+        return spec
+
+    name, _, level = spec.strip().lower().partition(":")
+    if name in ("gz", "tar.gz"):
+        name = "gzip"
+    elif name in ("zst", "tar.zst"):
+        name = "zstd"
+    elif name in ("none", "identity"):
+        name = "tar"
+
+    if name not in DEFAULT_LEVELS:
+        raise ValueError(f"Unknown codec: {spec}")
+    if name not in available_codecs():
+        raise ValueError(f"Codec {name} is not available on this server (install zstandard)")
+
+    return Codec(name, int(level) if level else DEFAULT_LEVELS[name], GZIP_THREADS)
+
+
+def negotiate_codec(accept_header, preferred_spec: str) -> Codec:
+    """
+    Выбирает кодек для скачивания по заголовку X-Archive-Codec (список имён через запятую в порядке предпочтения).
+    Если клиент принимает предпочитаемый сервером кодек — берётся он с настроенным уровнем.
+    Без заголовка отдаётся gzip, который понимают все клиенты.
+    """
+    preferred = get_codec(preferred_spec)
+
+    if not accept_header:
+        return preferred if preferred.name == "gzip" else get_codec("gzip")
+
+    accepted = list()
+    for item in accept_header.split(","):
+        try:
+            accepted.append(get_codec(item.split(";")[0]).name)
+        except ValueError:
+            continue
+
+    if preferred.name in accepted:
+        return preferred
+    if accepted:
+        return get_codec(accepted[0])
+    raise ValueError(f"None of the requested codecs are supported: {accept_header}")
+
+
+def detect_codec(head: bytes) -> Codec:
+    """Определяет кодек по первым байтам потока."""
+    if head.startswith(GZIP_MAGIC):
+        return get_codec("gzip")
+    if head.startswith(ZSTD_MAGIC):
+        return get_codec("zstd")
+    return get_codec("tar")
+
+
+def detect_file_codec(fileobj) -> Codec:
+    """Определяет кодек seekable-файла и возвращает позицию в начало."""
+    position = fileobj.tell()
+    head = fileobj.read(4)
+    fileobj.seek(position)
+    return detect_codec(head)
+
+
+def is_tar_backup(filename: str) -> bool:
+    return any(filename.endswith(extension) for extension in ARCHIVE_EXTENSIONS.values())
+
+
+def strip_archive_extension(filename: str) -> str:
+    for extension in sorted(ARCHIVE_EXTENSIONS.values(), key=len, reverse=True):
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
@@ -1,26 +1,58 @@
+import asyncio
+import hashlib
+import json
 import logging
 import shutil
 import os
+import tarfile
 from pathlib import Path
 
-from fastapi import APIRouter, UploadFile, HTTPException, Form, Depends, Header
+from fastapi import APIRouter, UploadFile, HTTPException, Form, Depends, Header, Request, Query
 from fastapi.responses import StreamingResponse, FileResponse
-from starlette.responses import RedirectResponse
-
-from modules.file_manager import (check_files, delete_files, get_backups_info, unpack_tar_archive,
-                                  create_archive_chunk_generator, get_files, create_backup, read_saves_directory)
-from modules.models import GameFilesData, SavesBackup
-from modules.sqls import get_user, check_last_sync_date, update_sync_date, delete_sync_data
+from starlette.background import BackgroundTask
+from starlette.responses import RedirectResponse, Response
+
+from modules.block_delta import DeltaBaseMismatch, DeltaTooLarge, validate_signature
+from modules.compression import negotiate_codec
+from modules.file_manager import (check_files, delete_files, get_backups_info, get_files, read_saves_directory,
+                                  apply_delta_archive, remove_backup, get_folder_fingerprint,
+                                  get_archive_cache_path, invalidate_archive_cache, build_cached_archive,
+                                  cached_archive_chunk_generator, download_codec, check_batch_concurrency,
+                                  check_batch_max_games, compare_merkle_tree, list_backup_contents,
+                                  select_backup_paths, normalize_backup_path, backup_file_chunk_generator,
+                                  extract_archive_file, get_block_signature, apply_block_delta, build_block_delta)
+from modules.executor import run_io
+from modules.hash_index import drop_index
+from modules.jobs import enqueue_job, move_game_jobs, cancel_game_jobs
+from modules.metrics import (CONTENT_TYPE, render_metrics, backups_count, backups_size, user_backups_count,
+                             user_backups_size)
+from modules.locks import GameLockTimeout, game_lock, game_locks
+from modules.snapshots import (hold_snapshot, async_snapshot_writer, adopt_legacy_folder, repoint_game_link,
+                               move_game_to_trash)
+from modules.models import (GameFilesData, GameFilesBatch, GameTreeDigests, SavesBackup, SavesBackupFiles,
+                            UploadSessionCreate, BlockDeltaRequest)
+from modules.resumable_uploads import (UploadSessionError, UploadSessionNotFound, UploadSessionBusy,
+                                       UploadOffsetMismatch, UploadChecksumMismatch, UploadTooLarge,
+                                       create_session, get_session, append_chunk, take_completed_upload,
+                                       cancel_session)
+from modules.token_cache import token_cache
+from modules.async_sqls import (get_user, check_last_sync_date, update_sync_date, get_job, bump_generation,
+                                get_generation, get_user_generations, rename_backup_records, get_backup_totals)
 
 
 logger = logging.getLogger(__name__)
 
 files_router = APIRouter(prefix='/files', tags=["Files 📂"])
 manage_router = APIRouter(prefix='/manage', tags=["Manager 🛠️"])
+metrics_router = APIRouter(tags=["Metrics 📈"])
+
+with open("settings.json", "r") as settings_file:
+    # Если задан — /metrics требует заголовок Authorization: Bearer <metrics_token>
+    metrics_token = json.load(settings_file).get("metrics_token")
 
-def check_api_token(x_api_token:  str = Header(..., description="API token for authentication")):
+async def check_api_token(x_api_token:  str = Header(..., description="API token for authentication")):
     if x_api_token:
-        user = get_user(token=x_api_token)
+        user = await token_cache.get_async(x_api_token, lambda token: get_user(token=token))
         if user is False:
             raise HTTPException(status_code=403, detail="Invalid or expired token")
         return user
@@ -30,29 +62,68 @@ def check_api_token(x_api_token:  str = Header(..., description="API token for a
         raise HTTPException(status_code=403, detail="Invalid or expired token")
 
 
-@files_router.post('/check_files')
-async def sync_files(files_data: GameFilesData, user = Depends(check_api_token)):
-    username = user.username
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверка If-None-Match (список тегов через запятую, слабые W/-теги сравниваются как сильные)."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def generations_etag(generations: dict[str, tuple[int, int]], field: int, variant: str = "") -> str:
+    """
+    ETag списка игр/бэкапов пользователя: md5 от пар (игра, счётчик), field — 0 (сохранения) или 1 (бэкапы).
+    variant различает представления одного списка (фильтр, страница).
+    """
+    digest = hashlib.md5(variant.encode())
+    for game_name in sorted(generations):
+        digest.update(f"{game_name}\0{generations[game_name][field]}\n".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+async def _check_game(username: str, files_data: GameFilesData):
+    """
+    Проверка одной игры: возвращает (статус, отчёт check_files).
+    Статус False — на сервере сохранения новее, клиенту нужно скачать их; None — ошибка проверки даты.
+    """
     if files_data.last_sync_date is None:
         status = True
     else:
-        status = check_last_sync_date(username, files_data.game_name, files_data.last_sync_date)
+        status = await check_last_sync_date(username, files_data.game_name, files_data.last_sync_date)
 
-    if status is True:
-        if not os.path.exists(f"saves/{username}/{files_data.game_name}"):
-            print(f"Папка 'saves/{username}/{files_data.game_name}' не обнаружена! Создаю новую...")
-            os.makedirs(f"saves/{username}/{files_data.game_name}")
+    if status is not True:
+        return status, None
 
-        if not os.path.exists(f"resources/{username}/{files_data.game_name}"):
-            os.makedirs(f"resources/{username}/{files_data.game_name}")
+    if not os.path.exists(f"saves/{username}/{files_data.game_name}"):
+        async with game_lock(username, files_data.game_name):
+            if not os.path.exists(f"saves/{username}/{files_data.game_name}"):
+                print(f"Папка 'saves/{username}/{files_data.game_name}' не обнаружена! Создаю новую...")
+                async with async_snapshot_writer(username, files_data.game_name, copy_current=False):
+                    pass
+                await bump_generation(username, files_data.game_name)
 
-        check_info = await check_files(username, files_data)
+    if not os.path.exists(f"resources/{username}/{files_data.game_name}"):
+        os.makedirs(f"resources/{username}/{files_data.game_name}", exist_ok=True)
 
-        if check_info['extra_on_server'] is not None:
+    # Чтение без блокировки: хэши считаются по одной версии снимка (modules/snapshots.py)
+    check_info = await check_files(username, files_data)
+
+    if check_info['extra_on_server']:
+        async with game_lock(username, files_data.game_name):
             await delete_files(check_info['extra_on_server'], files_data.game_name, username)
+            invalidate_archive_cache(username, files_data.game_name)
+            await bump_generation(username, files_data.game_name)
+
+    await update_sync_date(username, files_data.game_name)
+    return status, check_info
 
-        update_sync_date(username, files_data.game_name)
 
+@files_router.post('/check_files')
+async def sync_files(files_data: GameFilesData, user = Depends(check_api_token)):
+    status, check_info = await _check_game(user.username, files_data)
+
+    if status is True:
         if check_info == {}:
             return {"files_data": 'OK'}
         else:
@@ -66,36 +137,376 @@ async def sync_files(files_data: GameFilesData, user = Depends(check_api_token))
         )
 
 
+@files_router.post('/check_files_batch')
+async def sync_files_batch(batch: GameFilesBatch, user = Depends(check_api_token)):
+    """
+    Проверка многих игр за один запрос (холодный старт клиента). Игры проверяются параллельно,
+    не больше check_batch_concurrency одновременно. Для каждой игры возвращается:
+    {"status": "ok", "files_data": {...}} — то же, что /files/check_files;
+    {"status": "download"} — на сервере сохранения новее, нужно скачать /files/download_data;
+    {"status": "error", "detail": "..."} — проверка игры не удалась (остальные игры не затрагиваются).
+    """
+    if len(batch.games) > check_batch_max_games:
+        raise HTTPException(413, f"Too many games in one batch (max {check_batch_max_games})")
+
+    game_names = [files_data.game_name for files_data in batch.games]
+    if len(set(game_names)) != len(game_names):
+        raise HTTPException(400, "Duplicate game names in batch")
+
+    semaphore = asyncio.Semaphore(check_batch_concurrency)
+
+    async def check_one(files_data: GameFilesData) -> dict:
+        async with semaphore:
+            try:
+                status, check_info = await _check_game(user.username, files_data)
+            except Exception as e:
+                logger.error(f"Batch check failed for {files_data.game_name}: {str(e)}")
+                return {"status": "error", "detail": str(e)}
+
+        if status is True:
+            return {"status": "ok", "files_data": check_info}
+        elif status is False:
+            return {"status": "download"}
+        return {"status": "error", "detail": "Server check sync time error!"}
+
+    results = await asyncio.gather(*(check_one(files_data) for files_data in batch.games))
+    return {"games": dict(zip(game_names, results))}
+
+
+@files_router.post('/check_tree')
+async def check_tree(tree_data: GameTreeDigests, user = Depends(check_api_token)):
+    """
+    Быстрая проверка синхронизации по дереву Меркла. Клиент присылает {"/": корневой дайджест};
+    если совпал — игра синхронизирована ("in_sync": true). Иначе в "mismatched" приходят прямые потомки
+    отличающихся папок, и клиент присылает дайджесты только тех подпапок, что отличаются, пока не дойдёт до файлов.
+    Дайджесты считаются так же, как в hash_index.compute_directory_digests. Эндпоинт ничего не меняет на сервере.
+    """
+    if not tree_data.digests:
+        raise HTTPException(400, "digests must contain at least the root '/'")
+    if any(not path.startswith("/") or ".." in path.split("/") for path in tree_data.digests):
+        raise HTTPException(400, "Directory paths must be absolute within the game folder, e.g. '/' or '/saves'")
+
+    return await compare_merkle_tree(tree_data.game_name, user.username, tree_data.digests)
+
+
 @files_router.post('/upload_data')
 async def upload_data(file: UploadFile, game_name: str = Form(...), user = Depends(check_api_token)):
     username = user.username
     temp_path = f"tmp_data/{username}/uploaded_archive_{hash(file.filename)}"
 
     try:
-        await get_files(file, game_name, temp_path, username)
-        await create_backup(game_name, username)
+        async with game_lock(username, game_name):
+            await get_files(file, game_name, temp_path, username)
+            invalidate_archive_cache(username, game_name)
+            await bump_generation(username, game_name)
+        job_id = await enqueue_job("create_backup", username, game_name)
 
-        return {"status": "success", "extracted_to": f"saves/{username}/{game_name}"}
+        return {"status": "success", "extracted_to": f"saves/{username}/{game_name}", "backup_job_id": job_id}
 
+    except GameLockTimeout:
+        raise
+    except tarfile.TarError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise HTTPException(400, f"Архив отклонён: {str(e)}")
     except Exception as e:
         if os.path.exists(temp_path):
             os.remove(temp_path)
         raise HTTPException(500, f"Серверу не удалось получить/распаковать данные: {str(e)}")
 
 
+def upload_session_error(e: UploadSessionError) -> HTTPException:
+    if isinstance(e, UploadSessionNotFound):
+        return HTTPException(404, "Upload session not found or expired")
+    if isinstance(e, UploadSessionBusy):
+        return HTTPException(423, str(e), headers={"Retry-After": "1"})
+    if isinstance(e, UploadOffsetMismatch):
+        return HTTPException(409, str(e), headers={"Upload-Offset": str(e.offset)})
+    if isinstance(e, UploadChecksumMismatch):
+        # 460 Checksum Mismatch — код из расширения checksum протокола tus
+        return HTTPException(460, str(e))
+    if isinstance(e, UploadTooLarge):
+        return HTTPException(413, str(e))
+    return HTTPException(409, str(e))
+
+
+@files_router.post('/uploads', status_code=201)
+async def create_upload(upload_data: UploadSessionCreate, response: Response, user = Depends(check_api_token)):
+    """
+    Создаёт сессию докачиваемой загрузки (см. modules/resumable_uploads.py). length — размер архива в байтах,
+    checksum — необязательная сумма всего архива ("md5 <hex>"), проверяется при завершении.
+    """
+    if upload_data.length is not None and upload_data.length <= 0:
+        raise HTTPException(400, "length must be positive")
+    try:
+        session = await run_io(create_session, user.username, upload_data.game_name, upload_data.length,
+                               upload_data.checksum)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    response.headers["Location"] = f"/files/uploads/{session['upload_id']}"
+    return {"upload_id": session["upload_id"], "offset": 0, "expires_at": session["expires_at"]}
+
+
+@files_router.head('/uploads/{upload_id}')
+async def get_upload_offset(upload_id: str, user = Depends(check_api_token)):
+    """Текущее смещение загрузки в заголовке Upload-Offset: с него клиент продолжает после обрыва."""
+    try:
+        session = await run_io(get_session, user.username, upload_id)
+    except UploadSessionError as e:
+        raise upload_session_error(e)
+
+    headers = {"Upload-Offset": str(session["offset"]), "Upload-Expires": str(int(session["expires_at"])),
+               "Cache-Control": "no-store"}
+    if session["length"] is not None:
+        headers["Upload-Length"] = str(session["length"])
+    return Response(status_code=200, headers=headers)
+
+
+@files_router.patch('/uploads/{upload_id}', status_code=204)
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(..., ge=0),
+                       upload_checksum: str | None = Header(None), user = Depends(check_api_token)):
+    """
+    Дописывает тело запроса в загрузку. Upload-Offset должен совпасть с текущим смещением (иначе 409
+    с актуальным смещением), Upload-Checksum: "md5 <base64 или hex>" — сумма куска (иначе 460, кусок отброшен).
+    """
+    try:
+        offset = await append_chunk(user.username, upload_id, upload_offset, request.stream(), upload_checksum)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except UploadSessionError as e:
+        raise upload_session_error(e)
+
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+
+@files_router.post('/uploads/{upload_id}/finalize')
+async def finalize_upload(upload_id: str, user = Depends(check_api_token)):
+    """Распаковывает полностью принятый архив так же, как /files/upload_data, и ставит бэкап в очередь."""
+    username = user.username
+    try:
+        game_name = (await run_io(get_session, username, upload_id))["game_name"]
+    except UploadSessionError as e:
+        raise upload_session_error(e)
+
+    archive_path = None
+    try:
+        # Сессия забирается только под блокировкой игры: при 423 клиент просто повторит finalize
+        async with game_lock(username, game_name):
+            _, archive_path = await run_io(take_completed_upload, username, upload_id)
+            await extract_archive_file(archive_path, game_name, username)
+            invalidate_archive_cache(username, game_name)
+            await bump_generation(username, game_name)
+    except GameLockTimeout:
+        raise
+    except UploadSessionError as e:
+        raise upload_session_error(e)
+    except tarfile.TarError as e:
+        raise HTTPException(400, f"Архив отклонён: {str(e)}")
+    except Exception as e:
+        raise HTTPException(500, f"Серверу не удалось распаковать данные: {str(e)}")
+    finally:
+        if archive_path is not None and os.path.exists(archive_path):
+            os.remove(archive_path)
+
+    job_id = await enqueue_job("create_backup", username, game_name)
+    return {"status": "success", "extracted_to": f"saves/{username}/{game_name}", "backup_job_id": job_id}
+
+
+@files_router.delete('/uploads/{upload_id}', status_code=204)
+async def cancel_upload(upload_id: str, user = Depends(check_api_token)):
+    try:
+        await run_io(cancel_session, user.username, upload_id)
+    except UploadSessionError as e:
+        raise upload_session_error(e)
+    return Response(status_code=204)
+
+
+@files_router.post('/upload_delta')
+async def upload_delta(file: UploadFile, game_name: str = Form(...), files_hashes: str = Form(...),
+                       user = Depends(check_api_token)):
+    """
+    Загрузка только изменённых файлов: архив содержит missing_on_server + mismatched_hashes из check_files,
+    files_hashes — JSON {'/file_path': 'md5_hash'} для каждого файла архива.
+    """
+    import json
+
+    username = user.username
+    try:
+        declared_hashes = json.loads(files_hashes)
+        if not isinstance(declared_hashes, dict):
+            raise ValueError
+    except ValueError:
+        raise HTTPException(400, "files_hashes must be a JSON object {'/file_path': 'md5_hash'}")
+
+    try:
+        async with game_lock(username, game_name):
+            applied_files = await apply_delta_archive(file, game_name, username, declared_hashes)
+            invalidate_archive_cache(username, game_name)
+            await bump_generation(username, game_name)
+    except GameLockTimeout:
+        raise
+    except (ValueError, tarfile.TarError) as e:
+        raise HTTPException(400, f"Delta archive rejected: {str(e)}")
+    except Exception as e:
+        raise HTTPException(500, f"Серверу не удалось применить изменения: {str(e)}")
+
+    job_id = await enqueue_job("create_backup", username, game_name)
+
+    return {"status": "success", "applied_files": applied_files, "extracted_to": f"saves/{username}/{game_name}",
+            "backup_job_id": job_id}
+
+
+@files_router.get('/block_signatures')
+async def block_signatures(game_name: str, path: str, user = Depends(check_api_token)):
+    """
+    Сигнатура серверного файла для поблочной дельты клиент → сервер (см. modules/block_delta.py):
+    клиент строит по ней дельту своей версии и отправляет в /files/upload_block_delta вместе с полученным hash.
+    """
+    try:
+        return await get_block_signature(user.username, game_name, normalize_backup_path(path))
+    except FileNotFoundError:
+        raise HTTPException(404, f"'{path}' doesn't exist in '{game_name}'")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
+@files_router.post('/upload_block_delta')
+async def upload_block_delta(file: UploadFile, game_name: str = Form(...), path: str = Form(...),
+                             base_hash: str = Form(...), target_hash: str = Form(...),
+                             user = Depends(check_api_token)):
+    """
+    Обновление большого файла поблочной дельтой. base_hash — hash из /files/block_signatures,
+    target_hash — md5 файла клиента. Если файл на сервере успел измениться — 409, клиент берёт новую сигнатуру.
+    """
+    username = user.username
+    try:
+        async with game_lock(username, game_name):
+            applied_file = await apply_block_delta(file, game_name, username, normalize_backup_path(path),
+                                                   base_hash, target_hash)
+            invalidate_archive_cache(username, game_name)
+            await bump_generation(username, game_name)
+    except GameLockTimeout:
+        raise
+    except DeltaBaseMismatch as e:
+        raise HTTPException(409, str(e))
+    except ValueError as e:
+        raise HTTPException(400, f"Block delta rejected: {str(e)}")
+    except Exception as e:
+        raise HTTPException(500, f"Серверу не удалось применить изменения: {str(e)}")
+
+    job_id = await enqueue_job("create_backup", username, game_name)
+
+    return {"status": "success", **applied_file, "backup_job_id": job_id}
+
+
+@files_router.post('/block_delta')
+async def download_block_delta(request: Request, delta_request: BlockDeltaRequest, user = Depends(check_api_token)):
+    """
+    Дельта сервер → клиент: по сигнатуре клиентской версии файла отдаёт дельту до серверной версии.
+    Сжатие — по заголовку X-Archive-Codec, как у /files/download_data; md5 и размер результата —
+    в заголовках X-Target-Hash и X-Target-Size. Если файлы различаются слишком сильно — 422,
+    клиенту выгоднее скачать игру через /files/download_data.
+    """
+    try:
+        codec = negotiate_codec(request.headers.get("x-archive-codec"), download_codec)
+    except ValueError as e:
+        raise HTTPException(406, str(e))
+
+    signature = delta_request.signature.model_dump()
+    try:
+        validate_signature(signature)
+        delta_path, delta_info = await build_block_delta(user.username, delta_request.game_name,
+                                                         normalize_backup_path(delta_request.path), signature, codec)
+    except FileNotFoundError:
+        raise HTTPException(404, f"'{delta_request.path}' doesn't exist in '{delta_request.game_name}'")
+    except DeltaTooLarge as e:
+        raise HTTPException(422, f"Block delta is not worth it, download the file in full: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    return FileResponse(
+        delta_path,
+        media_type="application/octet-stream",
+        headers={
+            "X-Archive-Codec": codec.name,
+            "X-Target-Hash": delta_info["hash"],
+            "X-Target-Size": str(delta_info["size"]),
+        },
+        background=BackgroundTask(os.remove, delta_path)
+    )
+
+
 @files_router.get("/download_data")
-async def download_data(game_name: str, user = Depends(check_api_token)):
+async def download_data(request: Request, game_name: str, user = Depends(check_api_token)):
+    """
+    Отдаёт архив сохранений. ETag — счётчик изменений игры (generation) и кодек, If-None-Match → 304
+    без обхода папки. Архив кэшируется на диске по отпечатку содержимого: повторные скачивания
+    и Range-запросы (докачка) отдаются из кэша.
+    Кодек выбирается по заголовку X-Archive-Codec (например "zstd, gzip"), без заголовка — gzip.
+    Блокировка не берётся: отпечаток и архив строятся по одной неизменяемой версии снимка (modules/snapshots.py),
+    которая удерживается до конца отправки, чтобы сборщик снимков не удалил её посреди архива.
+    """
     username = user.username
-    if os.path.exists(f"saves/{username}/{game_name}") and len(os.listdir(f"saves/{username}/{game_name}")) == 0:
-        raise HTTPException(404, f"Saves doesn't exist!")
-    elif not os.path.exists(f"saves/{username}/{game_name}"):
-        raise HTTPException(404, f"Saves doesn't exist!")
-    else:
-        return StreamingResponse(
-            create_archive_chunk_generator(f"saves/{username}/{game_name}"),
-            media_type="application/gzip",
-            headers={"Content-Disposition": f"attachment; filename={game_name.replace(" ", "_")}-saves.tar.gz"}
-        )
+    try:
+        codec = negotiate_codec(request.headers.get("x-archive-codec"), download_codec)
+    except ValueError as e:
+        raise HTTPException(406, str(e))
+
+    # Счётчик читается до разрешения ссылки: если запись случится между ними, ETag окажется старее архива,
+    # и клиент просто скачает его ещё раз
+    generation = await get_generation(username, game_name)
+    if generation is not None:
+        etag = f'"g{generation}-{codec.cache_tag}"'
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "X-Archive-Codec"})
+
+    hold = hold_snapshot(username, game_name)
+    try:
+        snapshot_path = hold.path
+        if snapshot_path is None or not os.path.isdir(snapshot_path) or len(os.listdir(snapshot_path)) == 0:
+            raise HTTPException(404, f"Saves doesn't exist!")
+
+        fingerprint = await get_folder_fingerprint(snapshot_path)
+        if generation is None:
+            # База недоступна: ETag по содержимому папки
+            etag = f'"{fingerprint}-{codec.cache_tag}"'
+        headers = {
+            "Content-Disposition": f"attachment; filename={game_name.replace(" ", "_")}-saves{codec.archive_extension}",
+            "ETag": etag,
+            "X-Archive-Codec": codec.name,
+            "Vary": "X-Archive-Codec",
+        }
+
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "X-Archive-Codec"})
+
+        cache_path = get_archive_cache_path(username, game_name, fingerprint, codec)
+
+        if not os.path.exists(cache_path) and request.headers.get("range") is not None:
+            # Для докачки нужен готовый файл: собираем архив целиком
+            if not await build_cached_archive(snapshot_path, cache_path, codec):
+                raise HTTPException(500, "Failed to build archive")
+
+        if os.path.exists(cache_path):
+            # Готовый архив не зависит от версии снимка
+            return FileResponse(cache_path, media_type=codec.media_type, headers=headers)
+
+        chunks = _stream_holding_snapshot(cached_archive_chunk_generator(snapshot_path, cache_path, codec), hold)
+        # Удержание переходит к генератору и снимается, когда архив отправлен или соединение оборвалось
+        hold = None
+        return StreamingResponse(chunks, media_type=codec.media_type, headers=headers)
+    finally:
+        if hold is not None:
+            hold.release()
+
+
+async def _stream_holding_snapshot(chunks, hold):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        hold.release()
 
 @files_router.get('/get_image/{game_name}')
 async def get_image(game_name: str, user = Depends(check_api_token)):
@@ -133,35 +544,144 @@ async def get_image(game_name: str, user = Depends(check_api_token)):
             detail=f"Internal server error: {str(e)}"
         )
 @files_router.get("/get_backups_data")
-async def get_backups_data(user = Depends(check_api_token)):
-    backups_data = get_backups_info(user.username)
+async def get_backups_data(request: Request, response: Response, game_name: str | None = None,
+                           limit: int | None = Query(None, ge=1, le=500), offset: int = Query(0, ge=0),
+                           user = Depends(check_api_token)):
+    """
+    Бэкапы из каталога: {игра: [бэкапы от новых к старым]}. game_name — только одна игра,
+    limit/offset — пагинация, общее число бэкапов — в заголовке X-Total-Count.
+    """
+    generations = await get_user_generations(user.username)
+    if generations is not None:
+        if game_name is not None:
+            generations = {game_name: generations.get(game_name, (0, 0))}
+        etag = generations_etag(generations, 1, f"{game_name}\0{limit}\0{offset}")
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+    backups_data = await get_backups_info(user.username, game_name, limit, offset)
     if backups_data is False:
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error"
         )
-    return backups_data
+    backups_info, total = backups_data
+    response.headers["X-Total-Count"] = str(total)
+    return backups_info
 
 @files_router.post("/restore_backup")
 async def restore_backup(backup_data: SavesBackup,  user = Depends(check_api_token)):
-    if os.path.exists(f'saves/{user.username}/{backup_data.game_name}'):
-        shutil.rmtree(f'saves/{user.username}/{backup_data.game_name}')
+    """Ставит восстановление в очередь задач игры. Статус: /manage/jobs/{job_id}"""
+    if not os.path.isfile(f"backups/{user.username}/{backup_data.game_name}/{backup_data.backup_name}"):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Backup '{backup_data.backup_name}' for game '{backup_data.game_name}' doesnt exist."
+        )
+
+    try:
+        job_id = await enqueue_job("restore_backup", user.username, backup_data.game_name,
+                             {"backup_name": backup_data.backup_name})
+    except RuntimeError:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal server error"
+        )
 
-    status = await unpack_tar_archive(f"backups/{user.username}/{backup_data.game_name}/{backup_data.backup_name}",
-                                      f"saves/{user.username}/{backup_data.game_name}")
+    return {"msg": f"Backup '{backup_data.backup_name}' for game '{backup_data.game_name}' is being restored!",
+            "job_id": job_id}
 
-    if status is True:
-        return {"msg": f"Backup '{backup_data.backup_name}' for game '{backup_data.game_name}' has been restored!"}
-    else:
+def ensure_backup_exists(username: str, game_name: str, backup_name: str):
+    if any(part in ("", ".", "..") or "/" in part or "\\" in part for part in (game_name, backup_name)):
+        raise HTTPException(400, "Invalid game or backup name")
+    if not os.path.isfile(f"backups/{username}/{game_name}/{backup_name}"):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Backup '{backup_name}' for game '{game_name}' doesnt exist."
+        )
+
+
+@files_router.get("/backup_contents")
+async def backup_contents(game_name: str, backup_name: str, user = Depends(check_api_token)):
+    """
+    Список файлов бэкапа: {"format", "codec", "files": {"/путь": {"size", "hash", "mtime"}}}.
+    Для бэкапов с индексом (.pack) и CAS читается только индекс/манифест, tar-бэкап читается потоком целиком.
+    """
+    ensure_backup_exists(user.username, game_name, backup_name)
+    try:
+        return await list_backup_contents(user.username, game_name, backup_name)
+    except (OSError, ValueError, tarfile.TarError) as e:
+        logger.error(f"Failed to read backup {game_name}/{backup_name}: {str(e)}")
+        raise HTTPException(500, f"Backup '{backup_name}' is unreadable")
+
+
+@files_router.post("/restore_backup_files")
+async def restore_backup_file_paths(backup_data: SavesBackupFiles, user = Depends(check_api_token)):
+    """
+    Ставит в очередь восстановление только выбранных файлов/папок (paths: ["/save1.dat", "/profiles"], "/" — всё).
+    Папка сохранений не удаляется: выбранные файлы перезаписываются версиями из бэкапа, остальные остаются как есть.
+    Статус: /manage/jobs/{job_id}
+    """
+    ensure_backup_exists(user.username, backup_data.game_name, backup_data.backup_name)
+    if not backup_data.paths:
+        raise HTTPException(400, "paths must contain at least one file or directory")
+
+    try:
+        contents = await list_backup_contents(user.username, backup_data.game_name, backup_data.backup_name)
+    except (OSError, ValueError, tarfile.TarError) as e:
+        logger.error(f"Failed to read backup {backup_data.game_name}/{backup_data.backup_name}: {str(e)}")
+        raise HTTPException(500, f"Backup '{backup_data.backup_name}' is unreadable")
+
+    selected, unmatched = select_backup_paths(contents["files"], backup_data.paths)
+    if unmatched:
+        raise HTTPException(404, f"Not found in backup: {', '.join(unmatched)}")
+
+    try:
+        job_id = await enqueue_job("restore_backup", user.username, backup_data.game_name,
+                                   {"backup_name": backup_data.backup_name, "paths": selected})
+    except RuntimeError:
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error"
         )
 
+    return {"msg": f"{len(selected)} file(s) from backup '{backup_data.backup_name}' are being restored!",
+            "paths": selected, "job_id": job_id}
+
+
+@files_router.get("/backup_file")
+async def download_backup_file(game_name: str, backup_name: str, path: str, user = Depends(check_api_token)):
+    """Отдаёт один файл из бэкапа как есть, не распаковывая остальные (для бэкапов с индексом и CAS)."""
+    ensure_backup_exists(user.username, game_name, backup_name)
+    relative_path = normalize_backup_path(path)
+    try:
+        contents = await list_backup_contents(user.username, game_name, backup_name)
+    except (OSError, ValueError, tarfile.TarError) as e:
+        logger.error(f"Failed to read backup {game_name}/{backup_name}: {str(e)}")
+        raise HTTPException(500, f"Backup '{backup_name}' is unreadable")
+
+    file_info = contents["files"].get(relative_path)
+    if file_info is None:
+        raise HTTPException(404, f"'{path}' is not in backup '{backup_name}'")
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={os.path.basename(relative_path).replace(" ", "_")}",
+        "Content-Length": str(file_info["size"]),
+    }
+    if file_info["hash"] is not None:
+        headers["ETag"] = f'"{file_info["hash"]}"'
+    return StreamingResponse(
+        backup_file_chunk_generator(user.username, game_name, backup_name, relative_path),
+        media_type="application/octet-stream",
+        headers=headers
+    )
+
+
 @files_router.delete("/delete_backup")
 async def delete_backup(backup_data: SavesBackup,  user = Depends(check_api_token)):
     if os.path.exists(f"backups/{user.username}/{backup_data.game_name}/{backup_data.backup_name}"):
-        os.remove(f"backups/{user.username}/{backup_data.game_name}/{backup_data.backup_name}")
+        await remove_backup(user.username, backup_data.game_name, backup_data.backup_name)
+        await bump_generation(user.username, backup_data.game_name, saves=False, backups=True)
         return {"msg":f"Backup '{backup_data.backup_name}' for game '{backup_data.game_name}'"}
     else:
         raise HTTPException(
@@ -171,17 +691,30 @@ async def delete_backup(backup_data: SavesBackup,  user = Depends(check_api_toke
 
 @manage_router.delete('/delete/game/{game_name}')
 async def delete_game(game_name: str, delete_backups: bool = False, user = Depends(check_api_token)):
+    """
+    Папка сохранений мгновенно переносится в корзину tmp_data/<user>/, а её удаление
+    (и удаление бэкапов) выполняется фоновой задачей.
+    """
+    import uuid
+
     username = user.username
     try:
-        shutil.rmtree(f'saves/{username}/{game_name}')
-        if delete_backups and os.path.exists(f"backups/{username}/{game_name}"):
-            shutil.rmtree(f"backups/{username}/{game_name}")
-            if os.path.exists(f'resources/{username}/{game_name}'):
-                shutil.rmtree(f'resources/{username}/{game_name}')
-            delete_sync_data(username, game_name)
-            return {'message': 'Game successfully deleted with all backups!'}
+        os.makedirs(f'tmp_data/{username}', exist_ok=True)
+        trash_path = f'tmp_data/{username}/trash_{uuid.uuid4().hex}'
+        async with game_lock(username, game_name):
+            move_game_to_trash(username, game_name, trash_path)
+            drop_index(f'saves/{username}/{game_name}')
+            invalidate_archive_cache(username, game_name)
+            await cancel_game_jobs(username, game_name)
+            await bump_generation(username, game_name)
+
+        delete_backups = delete_backups and os.path.exists(f"backups/{username}/{game_name}")
+        job_id = await enqueue_job("delete_game", username, game_name,
+                             {"trash_path": trash_path, "delete_backups": delete_backups})
+        if delete_backups:
+            return {'message': 'Game successfully deleted with all backups!', 'job_id': job_id}
         else:
-            return {'message': 'Game successfully deleted!'}
+            return {'message': 'Game successfully deleted!', 'job_id': job_id}
     except FileNotFoundError:
         raise HTTPException(
             status_code=204,
@@ -198,7 +731,8 @@ async def change_game_data(game_name: str, new_game_name: str, user=Depends(chec
     base_dirs = [
         f"saves/{username}",
         f"backups/{username}",
-        f"resources/{username}"
+        f"resources/{username}",
+        f"snapshots/{username}"
     ]
 
     old_paths = [
@@ -226,19 +760,33 @@ async def change_game_data(game_name: str, new_game_name: str, user=Depends(chec
 
     moved_paths = []
     try:
-        for old_path, new_path in zip(old_paths, new_paths):
-            shutil.move(str(old_path), str(new_path))
-            moved_paths.append(old_path)
+        async with game_locks(username, [game_name, new_game_name]):
+            # Ссылка saves/<user>/<игра> указывает на версию в snapshots/<user>/<игра>: после переноса
+            # обеих папок её нужно перенаправить
+            adopt_legacy_folder(username, game_name)
+            for old_path, new_path in zip(old_paths, new_paths):
+                shutil.move(str(old_path), str(new_path))
+                moved_paths.append(old_path)
+            repoint_game_link(username, new_game_name)
+            invalidate_archive_cache(username, game_name)
+            await rename_backup_records(username, game_name, new_game_name)
+            await move_game_jobs(username, game_name, new_game_name)
+            await bump_generation(username, game_name, backups=True)
+            await bump_generation(username, new_game_name, backups=True)
 
         return {
             'message': f'Game {game_name} successfully renamed to {new_game_name}!',
             'renamed_paths': [str(path) for path in new_paths]
         }
 
+    except GameLockTimeout:
+        raise
+
     except PermissionError:
         for old_path, new_path in zip(moved_paths, new_paths):
-            if new_path.exists():
+            if new_path.exists() or new_path.is_symlink():
                 shutil.move(str(new_path), str(old_path))
+        repoint_game_link(username, game_name)
         raise HTTPException(
             status_code=403,
             detail="Permission denied during rename operation"
@@ -246,8 +794,9 @@ async def change_game_data(game_name: str, new_game_name: str, user=Depends(chec
 
     except OSError as e:
         for old_path, new_path in zip(moved_paths, new_paths):
-            if new_path.exists():
+            if new_path.exists() or new_path.is_symlink():
                 shutil.move(str(new_path), str(old_path))
+        repoint_game_link(username, game_name)
         print(e)
         raise HTTPException(
             status_code=500,
@@ -256,8 +805,9 @@ async def change_game_data(game_name: str, new_game_name: str, user=Depends(chec
 
     except Exception as e:
         for old_path, new_path in zip(moved_paths, new_paths):
-            if new_path.exists():
+            if new_path.exists() or new_path.is_symlink():
                 shutil.move(str(new_path), str(old_path))
+        repoint_game_link(username, game_name)
         print(e)
         raise HTTPException(
             status_code=500,
@@ -266,7 +816,14 @@ async def change_game_data(game_name: str, new_game_name: str, user=Depends(chec
 
 
 @manage_router.get('/get_games_data')
-async def get_games_data(user = Depends(check_api_token)):
+async def get_games_data(request: Request, response: Response, user = Depends(check_api_token)):
+    generations = await get_user_generations(user.username)
+    if generations is not None:
+        etag = generations_etag(generations, 0)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
     try:
         games_list = await read_saves_directory(user.username)
         if games_list is None:
@@ -294,6 +851,23 @@ async def get_games_data(user = Depends(check_api_token)):
             detail=f"Internal server error: {str(e)}"
         )
 
+@manage_router.get('/jobs/{job_id}')
+async def get_job_status(job_id: str, user = Depends(check_api_token)):
+    job = await get_job(job_id)
+    if job is None or job['username'] != user.username:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'game_name': job['game_name'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
+
 @manage_router.get('/check_x_token')
 async def check_x_token(user = Depends(check_api_token)):
     return {'token_status': True}
@@ -301,3 +875,22 @@ async def check_x_token(user = Depends(check_api_token)):
 @manage_router.get('/health')
 async def check_server_status():
     return {'status': 'server online'}
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics(authorization: str | None = Header(None)):
+    """
+    Метрики в текстовом формате Prometheus (см. modules/metrics.py).
+    Бэкапы по пользователям — только при заданном metrics_token, без него — общие итоги.
+    """
+    if metrics_token and authorization != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+    backup_totals = await get_backup_totals()
+    if backup_totals is not None:
+        backups_count.replace({(): sum(count for count, _ in backup_totals.values())})
+        backups_size.replace({(): sum(size for _, size in backup_totals.values())})
+        if metrics_token:
+            user_backups_count.replace({(username,): count for username, (count, _) in backup_totals.items()})
+            user_backups_size.replace({(username,): size for username, (_, size) in backup_totals.items()})
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+with open("settings.json", "r") as settings_file:
+    _settings = json.load(settings_file)
+
+IO_WORKERS: int = _settings.get("io_workers", min(32, (os.cpu_count() or 1) + 4))
+CPU_WORKERS: int = _settings.get("cpu_workers", os.cpu_count() or 1)
+CPU_USE_PROCESSES: bool = _settings.get("cpu_use_processes", False)
+
+WAIT_SAMPLES = 1024
+
+
+def _timed_call(func, args, kwargs):
+    """Выполняется в воркере: возвращает момент старта задачи и её результат."""
+    return time.time(), func(*args, **kwargs)
+
+
+class WorkerPool:
+    """
+    Ограниченный пул воркеров для блокирующей работы (файловая система, хэширование, сжатие).
+    Считает глубину очереди и время ожидания задач до старта.
+    """
+
+    def __init__(self, name: str, max_workers: int, use_processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._wait_samples = deque(maxlen=WAIT_SAMPLES)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.use_processes:
+                        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                            thread_name_prefix=f"mnemy-{self.name}")
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет func(*args, **kwargs) в пуле и ждёт результат, не блокируя event loop."""
+        loop = asyncio.get_running_loop()
+        submitted_at = time.time()
+
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+
+        try:
+            started_at, result = await loop.run_in_executor(
+                self._get_executor(), partial(_timed_call, func, args, kwargs)
+            )
+        except BaseException:
+            with self._lock:
+                self.in_flight -= 1
+                self.failed += 1
+            raise
+
+        wait_seconds = max(0.0, started_at - submitted_at)
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+            self._wait_samples.append(wait_seconds)
+
+        return result
+
+    @property
+    def queue_depth(self) -> int:
+        """Задачи, которые отправлены в пул, но ещё ждут свободного воркера."""
+        return max(0, self.in_flight - self.max_workers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sorted(self._wait_samples)
+            finished = self.completed + self.failed
+
+            def percentile(p: float) -> float:
+                if not samples:
+                    return 0.0
+                return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+            return {
+                "kind": "processes" if self.use_processes else "threads",
+                "max_workers": self.max_workers,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "in_flight": self.in_flight,
+                "queue_depth": self.queue_depth,
+                "wait_seconds_avg": self.wait_seconds_total / finished if finished else 0.0,
+                "wait_seconds_p50": percentile(0.50),
+                "wait_seconds_p99": percentile(0.99),
+                "wait_seconds_max": self.wait_seconds_max,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+io_pool = WorkerPool("io", IO_WORKERS)
+cpu_pool = WorkerPool("cpu", CPU_WORKERS, use_processes=CPU_USE_PROCESSES)
+
+
+async def run_io(func, *args, **kwargs):
+    """Блокирующий ввод-вывод: распаковка, удаление, чтение pipe."""
+    return await io_pool.run(func, *args, **kwargs)
+
+
+async def run_cpu(func, *args, **kwargs):
+    """Тяжёлые вычисления: хэширование и сжатие. Функция должна быть picklable, если включены процессы."""
+    return await cpu_pool.run(func, *args, **kwargs)
+
+
+def get_executor_stats() -> dict:
+    return {pool.name: pool.stats() for pool in (io_pool, cpu_pool)}
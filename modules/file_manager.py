@@ -1,40 +1,98 @@
-import hashlib
 import json
 import tarfile
 import os
 
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from typing import Optional
 
 from fastapi import UploadFile
+from modules.async_sqls import list_backup_records
+from modules.block_delta import compute_signature, compute_delta, apply_delta, check_signature_fits, DeltaBaseMismatch
+from modules.backup_store import (is_manifest, create_manifest_backup, delete_manifest_backup,
+                                  restore_manifest_backup, get_manifest_info, get_manifest_fingerprint, load_manifest,
+                                  iter_manifest_file_chunks, MANIFEST_SUFFIX)
+from modules.compression import Codec, get_codec, detect_file_codec, is_tar_backup
+from modules.executor import run_io, run_cpu
+from modules.metrics import upload_received_bytes, archive_streamed_bytes, operation_duration
+from modules.indexed_backup import (is_indexed_backup, create_indexed_backup, load_backup_index,
+                                    get_indexed_backup_info, iter_member_chunks, restore_indexed_backup, INDEXED_SUFFIX)
+from modules.hash_index import (update_hash_index, update_merkle_tree, compute_directory_digests,
+                                get_directory_children, invalidate_entries, drop_index, compute_fingerprint)
 from modules.models import GameFilesData
+from modules.snapshots import read_snapshot, snapshot_writer, async_snapshot_writer
+from modules.sqls import (get_backup_records, commit_backup_rotation, delete_backup_records, sync_backup_records)
 import traceback
 
 with open("settings.json", "r") as settings_file:
-    backups_limit = json.load(settings_file)['backups_limit']
+    _settings = json.load(settings_file)
+    backups_limit = _settings['backups_limit']
+    # "cas" — дедуплицирующее хранилище (modules/backup_store.py), "tar" — полный tar.gz на каждый бэкап,
+    # "indexed" — один файл с отдельно сжатыми файлами и таблицей смещений (modules/indexed_backup.py)
+    backup_format = _settings.get('backup_format', 'cas')
+    # True — загрузка распаковывается потоком прямо из UploadFile, False — через временный архив в tmp_data
+    upload_streaming = _settings.get('upload_streaming', True)
+    # Кодеки "имя[:уровень]" (см. modules/compression.py): быстрый для скачивания, плотный для бэкапов
+    download_codec = _settings.get('download_codec', 'gzip:6')
+    backup_codec = _settings.get('backup_codec', 'gzip:6')
+    # Пакетная проверка /files/check_files_batch: сколько игр проверяется одновременно и максимум игр в запросе
+    check_batch_concurrency = _settings.get('check_batch_concurrency', 8)
+    check_batch_max_games = _settings.get('check_batch_max_games', 256)
+    # Поблочная дельта (modules/block_delta.py): с какого размера файла она выгоднее целого файла и размер блока
+    block_delta_min_size = _settings.get('block_delta_min_size', 8 * 1024 * 1024)
+    block_delta_block_size = _settings.get('block_delta_block_size', 64 * 1024)
+    # Сколько байт дельты сервер → клиент может уйти литералами, дальше клиент скачивает файл целиком
+    block_delta_max_literal = _settings.get('block_delta_max_literal', 4 * 1024 * 1024)
 
 async def hash_generator(game_name: str, username: str) -> dict:
-    """Сканирует папку и генерирует словарь {'file_path': 'md5_hash'}"""
+    """Сканирует текущую версию папки и генерирует словарь {'file_path': 'md5_hash'}.
+    Хэши берутся из персистентного индекса, перехэшируются только изменённые файлы."""
 
-    base_dir = f"saves/{username}/{game_name}"
+    with read_snapshot(username, game_name) as base_dir:
+        if base_dir is None:
+            return {}
 
-    if not os.path.exists(base_dir):
-        os.mkdir(base_dir)
+        with operation_duration.time(operation="hash_generator"):
+            return await run_cpu(update_hash_index, base_dir)
 
-    files_data = dict()
+async def compare_merkle_tree(game_name: str, username: str, client_digests: dict[str, str]) -> dict:
+    """
+    Сверяет дайджесты папок клиента {'/dir': digest} с деревом Меркла сервера (см. hash_index.compute_directory_digests).
+    Для каждой отличающейся папки возвращает её прямых потомков с серверными дайджестами,
+    чтобы клиент спускался только в отличающиеся поддеревья.
+    """
+    with read_snapshot(username, game_name) as base_dir:
+        if base_dir is not None and os.path.exists(base_dir):
+            file_hashes, directories = await run_cpu(update_merkle_tree, base_dir)
+        else:
+            # Проверка ничего не меняет на сервере: папку несуществующей игры не создаём
+            file_hashes, directories = {}, compute_directory_digests({})
+
+    mismatched = dict()
+    missing_on_server = list()
+    children = None
+    for directory, client_digest in client_digests.items():
+        server_digest = directories.get(directory)
+        if server_digest is None:
+            missing_on_server.append(directory)
+        elif server_digest != client_digest:
+            if children is None:
+                children = get_directory_children(file_hashes)
+            mismatched[directory] = {
+                name: {"type": kind, "digest": value if kind == "f" else directories[value]}
+                for name, (kind, value) in sorted(children.get(directory, {}).items())
+            }
 
-    def scan_directory(directory):
-        with os.scandir(directory) as entries:
-            for entry in entries:
-                if entry.is_file():
-                    with open(entry.path, "rb") as file:
-                        md5_hash = hashlib.file_digest(file, 'md5')
-                        files_data[(entry.path.split(game_name)[1])] = md5_hash.hexdigest()
-                elif entry.is_dir():
-                    scan_directory(entry.path)
+    return {
+        "root": directories["/"],
+        "in_sync": not mismatched and not missing_on_server and "/" in client_digests,
+        "mismatched": mismatched,
+        "missing_on_server": sorted(missing_on_server),
+    }
 
-    scan_directory(base_dir)
-    return files_data
+async def get_folder_fingerprint(base_dir: str) -> str:
+    """Отпечаток содержимого папки (версии снимка) игры (см. compute_fingerprint)."""
+    return compute_fingerprint(await run_cpu(update_hash_index, base_dir))
 
 async def check_files(username: str, files_data: GameFilesData):
     """Сверяет хэши файлов на сервере с клиентскими (клиентские файлы считаются эталоном)
@@ -90,6 +148,9 @@ async def check_files(username: str, files_data: GameFilesData):
 
     print("==================================")
 
+    # Большие изменённые файлы выгоднее передавать поблочной дельтой (/files/block_signatures)
+    block_delta_files = await run_io(_filter_large_files, username, files_data.game_name, mismatched_hashes)
+
     if missing_on_server is None and extra_on_server is None and mismatched_hashes is None:
         return {}
 
@@ -97,38 +158,64 @@ async def check_files(username: str, files_data: GameFilesData):
         "missing_on_server": missing_on_server,      # нужно получить от клиента
         "extra_on_server": extra_on_server,          # можно удалить
         "mismatched_hashes": mismatched_hashes,      # нужно обновить с клиента
+        "block_delta_files": block_delta_files,      # из них — обновлять поблочной дельтой
         "is_up_to_date": not (missing_on_server or mismatched_hashes),
         "needs_update": len(missing_on_server) + len(mismatched_hashes)
     }
 
 
+def _filter_large_files(username: str, game_name: str, relative_paths: list[str]) -> list[str]:
+    large_files = list()
+    with read_snapshot(username, game_name) as base_dir:
+        for relative_path in relative_paths:
+            try:
+                if os.path.getsize(os.path.join(base_dir, relative_path.lstrip("/"))) >= block_delta_min_size:
+                    large_files.append(relative_path)
+            except (OSError, TypeError):
+                continue
+    return large_files
+
+
 async def delete_files(files_paths: list, game_name: str, username: str):
     """Просто удаляет указанные файлы..."""
 
-    for file in files_paths:
-        file_full_path = f"saves/{username}/{game_name}{file}"
-        if os.path.exists(file_full_path):
-            os.remove(file_full_path)
-            print(f"Удаляю файл {file_full_path}")
-        else:
-            print(f"Не удалось удалить файл {file_full_path}! Файл не найден.")
+    await run_io(_delete_files, files_paths, game_name, username)
+
 
-        print("Лишние файлы были удалены!")
+def _delete_files(files_paths: list, game_name: str, username: str):
+    with snapshot_writer(username, game_name) as staging_path:
+        for file in files_paths:
+            file_full_path = f"{staging_path}{file}"
+            if os.path.exists(file_full_path):
+                os.remove(file_full_path)
+                print(f"Удаляю файл {file_full_path}")
+            else:
+                print(f"Не удалось удалить файл {file_full_path}! Файл не найден.")
 
+            print("Лишние файлы были удалены!")
 
-def writer(folder_path: str, tar_path: Optional[str] = None, use_pipe: bool = False):
+        invalidate_entries(staging_path, files_paths)
+
+
+def writer(folder_path: str, tar_path: Optional[str] = None, use_pipe: bool = False, status: Optional[dict] = None,
+           codec="gzip:6"):
     """
-    Рекурсивно архивирует папку в .tar.gz.
+    Рекурсивно архивирует папку в tar, сжатый кодеком codec (по умолчанию .tar.gz).
 
     - Если use_pipe=True → создаёт pipe, запускает архивацию в фоновом потоке,
-      возвращает read-конец pipe для чтения (int fd).
+      возвращает read-конец pipe для чтения (int fd). Если передан status,
+      в status["success"] записывается результат до закрытия pipe.
     - Если use_pipe=False → архивирует в файл tar_path, возвращает True/False.
     """
+    archive_codec = get_codec(codec)
+
     def _write_tar(folder_path: str, name: Optional[str] = None, fileobj=None) -> bool:
         """Внутренняя функция: непосредственно создаёт tar-архив"""
         try:
-            tar_args = {"fileobj": fileobj} if fileobj else {"name": name}
-            with tarfile.open(mode="w:gz", compresslevel=6, **tar_args) as tar:
+            with (operation_duration.time(operation="writer"),
+                  nullcontext(fileobj) if fileobj else open(name, "wb") as raw_file,
+                  archive_codec.open_writer(raw_file) as compressed,
+                  tarfile.open(fileobj=compressed, mode="w|") as tar):
                 def process_directory(dir_path):
                     with os.scandir(dir_path) as entries:
                         for entry in entries:
@@ -159,24 +246,16 @@ def writer(folder_path: str, tar_path: Optional[str] = None, use_pipe: bool = Fa
 
 
         def writer_worker():
-            """Фоновый поток: пишет архив в write-конец pipe"""
-            success = False
+            """Фоновый поток: пишет архив в write-конец pipe.
+            read-конец принадлежит читателю: повторно закрывать номера fd нельзя, их мог уже занять другой файл."""
             try:
                 with os.fdopen(write_fd, "wb") as wf:
                     success = _write_tar(folder_path, fileobj=wf)
+                    if status is not None:
+                        status["success"] = success
             except Exception as e:
                 print(f"❌ Writer worker error: {e}")
                 traceback.print_exc()
-            finally:
-                try:
-                    os.close(write_fd)
-                except OSError:
-                    pass
-                if not success:
-                    try:
-                        os.close(read_fd)
-                    except OSError:
-                        pass
 
         thread = threading.Thread(target=writer_worker, daemon=True)
         thread.start()
@@ -188,97 +267,702 @@ def writer(folder_path: str, tar_path: Optional[str] = None, use_pipe: bool = Fa
         return _write_tar(folder_path, name=tar_path)
 
 
-async def create_archive_chunk_generator(base_dir: str, CHUNK_SIZE: int = 65536):
+async def create_archive_chunk_generator(base_dir: str, CHUNK_SIZE: int = 65536, status: Optional[dict] = None,
+                                        codec="gzip:6"):
     """
-    Асинхронный генератор чанков .tar.gz архива.
+    Асинхронный генератор чанков архива (по умолчанию .tar.gz).
     Архивация происходит в фоновом потоке, данные читаются через pipe.
     """
-    read_fd = writer(folder_path=base_dir, use_pipe=True)
+    read_fd = writer(folder_path=base_dir, use_pipe=True, status=status, codec=codec)
     if read_fd is None:
         raise RuntimeError("Writer failed to start")
 
     try:
         with os.fdopen(read_fd, "rb") as rf:
             while True:
-                chunk = rf.read(CHUNK_SIZE)
+                chunk = await run_io(rf.read, CHUNK_SIZE)
                 if not chunk:
                     break
+                archive_streamed_bytes.inc(len(chunk))
                 yield chunk
     except BrokenPipeError:
         print("ℹ️  Pipe closed early (likely writer finished or encountered error)")
     except Exception as e:
         print(f"❌ Chunk reader error: {e}")
         raise
+
+
+def get_archive_cache_path(username: str, game_name: str, fingerprint: str, codec: Codec) -> str:
+    return f"cache/{username}/{game_name}/{fingerprint}-{codec.cache_tag}{codec.archive_extension}"
+
+
+def invalidate_archive_cache(username: str, game_name: str):
+    """Удаляет закэшированные архивы игры (после загрузки, восстановления, удаления)."""
+    import shutil
+
+    shutil.rmtree(f"cache/{username}/{game_name}", ignore_errors=True)
+
+
+def _prepare_archive_cache(cache_path: str) -> str:
+    """Удаляет архивы игры с другим отпечатком и возвращает уникальный путь для временного файла."""
+    import uuid
+
+    cache_dir = os.path.dirname(cache_path)
+    fingerprint = os.path.basename(cache_path).split("-")[0]
+    os.makedirs(cache_dir, exist_ok=True)
+    for filename in os.listdir(cache_dir):
+        if is_tar_backup(filename) and not filename.startswith(fingerprint):
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+            except FileNotFoundError:
+                pass
+    return f"{cache_path}.tmp_{uuid.uuid4().hex}"
+
+
+def _build_cached_archive(base_dir: str, cache_path: str, codec: str) -> bool:
+    tmp_path = _prepare_archive_cache(cache_path)
+    if writer(folder_path=base_dir, tar_path=tmp_path, codec=codec):
+        os.replace(tmp_path, cache_path)
+        return True
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return False
+
+
+async def build_cached_archive(base_dir: str, cache_path: str, codec: Codec) -> bool:
+    """Собирает архив целиком в кэш (нужно, чтобы отдать Range-запрос до первой полной отдачи)."""
+    return await run_cpu(_build_cached_archive, base_dir, cache_path, codec.spec)
+
+
+async def cached_archive_chunk_generator(base_dir: str, cache_path: str, codec: Codec, CHUNK_SIZE: int = 65536):
+    """
+    Отдаёт архив потоком и одновременно пишет его в кэш.
+    В кэш архив попадает только если writer завершился успешно и клиент дочитал до конца.
+    """
+    import aiofiles
+
+    tmp_path = _prepare_archive_cache(cache_path)
+    status = dict()
+    completed = False
+
+    try:
+        async with aiofiles.open(tmp_path, "wb") as cache_file:
+            async for chunk in create_archive_chunk_generator(base_dir, CHUNK_SIZE, status=status, codec=codec.spec):
+                await cache_file.write(chunk)
+                yield chunk
+        completed = status.get("success", False)
     finally:
         try:
-            os.close(read_fd)
-        except OSError:
-            pass
+            if completed:
+                os.replace(tmp_path, cache_path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except OSError as e:
+            # Кэш игры мог быть сброшен параллельной загрузкой — просто не кэшируем
+            print(f"ℹ️  Архив не сохранён в кэш: {e}")
 
 
 async def get_files(file: UploadFile, game_name: str, temp_path: str, username: str):
     """
-    Получает архив во временную директорию, распаковывает архив в директорию игры, удаляет временный архив
+    Распаковывает загруженный архив в новую версию папки игры (modules/snapshots.py): текущая версия
+    заменяется только после успешной распаковки, при ошибке не меняется ничего.
+    По умолчанию архив читается потоком прямо из UploadFile, без копии в tmp_data.
+    Кодек архива (gzip, zstd, tar) определяется по первым байтам.
+    При upload_streaming=False архив сначала сохраняется во временную директорию, затем распаковывается и удаляется.
     """
 
     import aiofiles
 
+    if upload_streaming:
+        # Тело запроса уже принято в UploadFile (SpooledTemporaryFile)
+        upload_received_bytes.inc(file.size or 0)
+        async with async_snapshot_writer(username, game_name) as staging_path:
+            await run_io(_stream_extract_upload, file.file, staging_path)
+        return
+
     if not os.path.exists(f'tmp_data/{username}'):
         os.makedirs(f'tmp_data/{username}')
 
     async with aiofiles.open(temp_path, "wb") as f:
         while chunk := await file.read(65536):
+            upload_received_bytes.inc(len(chunk))
             await f.write(chunk)
 
-    with tarfile.open(temp_path, "r:gz") as tar:
-        if not os.path.exists(f"saves/{username}/{game_name}"):
-            os.mkdir(f"saves/{username}/{game_name}")
+    await extract_archive_file(temp_path, game_name, username)
+
+
+async def extract_archive_file(archive_path: str, game_name: str, username: str):
+    """Распаковывает принятый архив (upload_data без потоковой распаковки, докачиваемая загрузка) и удаляет его."""
+    async with async_snapshot_writer(username, game_name) as staging_path:
+        await run_io(_extract_uploaded_archive, archive_path, staging_path)
+
+
+def _safe_extract(tar: tarfile.TarFile, destination_folder: str, extracted_paths: list):
+    """
+    Распаковывает элементы по одному (работает и для потоковых r| архивов).
+    Фильтр 'data' отклоняет абсолютные пути, '..', ссылки за пределы папки и спецфайлы.
+    В extracted_paths добавляются относительные пути (в формате индекса хэшей) всех затронутых элементов,
+    включая тот, на котором произошла ошибка.
+    """
+    with operation_duration.time(operation="extract"):
+        for member in tar:
+            extracted_paths.append("/" + os.path.normpath(member.name).lstrip("/"))
+            _unlink_existing(member, destination_folder)
+            tar.extract(member, path=destination_folder, filter="data")
+
+
+def _unlink_existing(member: tarfile.TarInfo, destination_folder: str):
+    """
+    tarfile перезаписывает существующий файл на месте, а файлы версии снимка — жёсткие ссылки
+    на файлы прошлых версий (modules/snapshots.py). Поэтому старый файл сначала удаляется.
+    """
+    if not member.isfile():
+        return
+    target_path = os.path.join(destination_folder, tarfile.data_filter(member, destination_folder).name)
+    if os.path.lexists(target_path) and not os.path.isdir(target_path):
+        os.unlink(target_path)
+
+
+def _stream_extract_upload(fileobj, destination_folder: str):
+    if not os.path.exists(destination_folder):
+        os.mkdir(destination_folder)
+
+    extracted_paths = list()
+    try:
+        codec = detect_file_codec(fileobj)
+        with codec.open_reader(fileobj) as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            _safe_extract(tar, destination_folder, extracted_paths)
+    finally:
+        # Даже при ошибке часть файлов уже могла быть перезаписана
+        invalidate_entries(destination_folder, extracted_paths)
+
+
+@contextmanager
+def _open_tar_stream(path: str, codec: Optional[str] = None):
+    """Открывает архив на диске на потоковое чтение; кодек берётся из codec или определяется по первым байтам."""
+    with open(path, "rb") as raw_file:
+        archive_codec = get_codec(codec) if codec else detect_file_codec(raw_file)
+        with archive_codec.open_reader(raw_file) as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            yield tar
 
-        tar.extractall(path=f"saves/{username}/{game_name}")
 
+def _extract_uploaded_archive(temp_path: str, destination_folder: str):
+    extracted_paths = list()
+    try:
+        with _open_tar_stream(temp_path) as tar:
+            if not os.path.exists(destination_folder):
+                os.mkdir(destination_folder)
+
+            _safe_extract(tar, destination_folder, extracted_paths)
+    finally:
+        invalidate_entries(destination_folder, extracted_paths)
     os.remove(temp_path)
 
 
-async def unpack_tar_archive(file_path: str, destination_folder: str):
-    with tarfile.open(file_path, "r:gz") as tar:
+async def apply_delta_archive(file: UploadFile, game_name: str, username: str, declared_hashes: dict):
+    """
+    Принимает архив только с изменёнными файлами (missing_on_server + mismatched_hashes),
+    сверяет каждый файл с заявленным клиентом md5 и только после этого кладёт файлы в папку игры.
+    :param declared_hashes: {'/file_path': 'md5_hash'} для каждого файла в архиве
+    :returns список применённых файлов
+    """
+
+    import aiofiles
+    import uuid
+
+    if not os.path.exists(f'tmp_data/{username}'):
+        os.makedirs(f'tmp_data/{username}')
+
+    temp_path = f"tmp_data/{username}/delta_{uuid.uuid4().hex}"
+
+    try:
+        async with aiofiles.open(f"{temp_path}.tar.gz", "wb") as f:
+            while chunk := await file.read(65536):
+                await f.write(chunk)
+
+        async with async_snapshot_writer(username, game_name) as staging_path:
+            return await run_io(_apply_delta_archive, temp_path, staging_path, declared_hashes)
+    finally:
+        if os.path.exists(f"{temp_path}.tar.gz"):
+            os.remove(f"{temp_path}.tar.gz")
+
+
+def _apply_delta_archive(temp_path: str, destination_folder: str, declared_hashes: dict) -> list[str]:
+    import hashlib
+    import shutil
+
+    staging_dir = f"{temp_path}_staging"
+    os.makedirs(staging_dir)
+
+    try:
+        staged_files = dict()
+        with _open_tar_stream(f"{temp_path}.tar.gz") as tar:
+            for member in tar:
+                relative_path = "/" + os.path.normpath(member.name).lstrip("/")
+                if member.isdir():
+                    continue
+                if not member.isfile():
+                    raise ValueError(f"Unsupported archive member type: {member.name}")
+                if relative_path not in declared_hashes:
+                    raise ValueError(f"File {relative_path} is not declared in files_hashes")
+
+                tar.extract(member, path=staging_dir, filter="data")
+                staged_files[relative_path] = os.path.join(staging_dir, relative_path.lstrip("/"))
+
+        missing = sorted(set(declared_hashes) - set(staged_files))
+        if missing:
+            raise ValueError(f"Declared files are missing in archive: {missing}")
+
+        mismatched = list()
+        for relative_path, staged_path in staged_files.items():
+            with open(staged_path, "rb") as staged_file:
+                if hashlib.file_digest(staged_file, 'md5').hexdigest() != declared_hashes[relative_path]:
+                    mismatched.append(relative_path)
+        if mismatched:
+            raise ValueError(f"Hash mismatch for files: {sorted(mismatched)}")
+
+        # Все файлы проверены — переносим их в папку игры (os.replace атомарен для каждого файла)
         if not os.path.exists(destination_folder):
-            os.mkdir(destination_folder)
+            os.makedirs(destination_folder)
 
-        tar.extractall(path=destination_folder)
+        for relative_path, staged_path in staged_files.items():
+            target_path = os.path.join(destination_folder, relative_path.lstrip("/"))
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(staged_path, target_path)
+            print(f"Применён файл {target_path}")
 
-        return True
+        invalidate_entries(destination_folder, staged_files.keys())
+        return sorted(staged_files)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def get_signature_cache_dir(username: str, game_name: str) -> str:
+    return f"resources/{username}/{game_name}/signatures"
+
+
+def _game_file_path(base_dir: str, relative_path: str) -> str:
+    target_path = os.path.normpath(os.path.join(base_dir, relative_path.lstrip("/")))
+    if not target_path.startswith(os.path.normpath(base_dir) + os.sep):
+        raise ValueError(f"Unsafe file path: {relative_path}")
+    return target_path
+
+
+async def get_block_signature(username: str, game_name: str, relative_path: str) -> dict:
+    """
+    Сигнатура файла текущей версии для дельты клиент → сервер (см. modules/block_delta.py).
+    Кэшируется по md5 файла, поэтому повторные запросы не перечитывают файл.
+    :returns {"path", "hash", "size", "block_size", "blocks"}; hash клиент возвращает в /files/upload_block_delta
+    """
+    with read_snapshot(username, game_name) as base_dir:
+        if base_dir is None:
+            raise FileNotFoundError(f"Game {game_name} doesn't exist")
+        return await run_cpu(_get_block_signature, base_dir, get_signature_cache_dir(username, game_name),
+                             relative_path)
+
+
+def _get_block_signature(base_dir: str, cache_dir: str, relative_path: str) -> dict:
+    file_hash = update_hash_index(base_dir).get(relative_path)
+    if file_hash is None:
+        raise FileNotFoundError(f"{relative_path} doesn't exist")
+
+    cache_path = f"{cache_dir}/{file_hash}-{block_delta_block_size}.json"
+    try:
+        with open(cache_path, "r") as cache_file:
+            return {**json.load(cache_file), "path": relative_path}
+    except (FileNotFoundError, ValueError):
+        pass
+
+    with open(_game_file_path(base_dir, relative_path), "rb") as file:
+        signature = {"hash": file_hash, **compute_signature(file, block_delta_block_size)}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as cache_file:
+        json.dump(signature, cache_file)
+    os.replace(tmp_path, cache_path)
+    _prune_signature_cache(cache_dir)
+    return {**signature, "path": relative_path}
+
+
+SIGNATURE_CACHE_LIMIT = 64
+
+
+def _prune_signature_cache(cache_dir: str):
+    """Оставляет SIGNATURE_CACHE_LIMIT последних сигнатур игры: старые версии файлов больше не нужны."""
+    entries = sorted(os.scandir(cache_dir), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[SIGNATURE_CACHE_LIMIT:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+
+
+async def apply_block_delta(file: UploadFile, game_name: str, username: str, relative_path: str,
+                            base_hash: str, target_hash: str) -> dict:
+    """
+    Применяет поблочную дельту клиента к файлу игры в новой версии снимка.
+    :param base_hash: md5 серверного файла, от сигнатуры которого построена дельта (иначе DeltaBaseMismatch)
+    :param target_hash: md5 файла после применения, как у клиента
+    :returns {"path", "hash", "size"}
+    """
+
+    import aiofiles
+    import uuid
+
+    if not os.path.exists(f'tmp_data/{username}'):
+        os.makedirs(f'tmp_data/{username}')
+
+    temp_path = f"tmp_data/{username}/block_delta_{uuid.uuid4().hex}"
+
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            while chunk := await file.read(65536):
+                await f.write(chunk)
+
+        async with async_snapshot_writer(username, game_name) as staging_path:
+            return await run_io(_apply_block_delta, temp_path, staging_path, relative_path, base_hash, target_hash)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _apply_block_delta(delta_path: str, destination_folder: str, relative_path: str,
+                       base_hash: str, target_hash: str) -> dict:
+    import shutil
+    import uuid
+
+    target_path = _game_file_path(destination_folder, relative_path)
+    current_hash = update_hash_index(destination_folder).get(relative_path)
+    if current_hash != base_hash:
+        raise DeltaBaseMismatch(f"{relative_path} on the server is {current_hash}, delta is built against {base_hash}")
+
+    # Файл — жёсткая ссылка на прошлые версии снимка: собираем новый рядом и подменяем
+    new_path = f"{target_path}.delta-{uuid.uuid4().hex[:8]}"
+    try:
+        with (open(target_path, "rb") as basis, open(delta_path, "rb") as raw_delta,
+              detect_file_codec(raw_delta).open_reader(raw_delta) as delta, open(new_path, "wb") as new_file):
+            result_hash = apply_delta(basis, delta, new_file)
+        if result_hash != target_hash:
+            raise ValueError(f"Hash mismatch for {relative_path}: got {result_hash}, expected {target_hash}")
+        shutil.copymode(target_path, new_path)
+        os.replace(new_path, target_path)
+    finally:
+        if os.path.exists(new_path):
+            os.remove(new_path)
+
+    invalidate_entries(destination_folder, [relative_path])
+    print(f"Применена поблочная дельта {target_path}")
+    return {"path": relative_path, "hash": result_hash, "size": os.path.getsize(target_path)}
+
+
+async def build_block_delta(username: str, game_name: str, relative_path: str, signature: dict,
+                            codec: Codec) -> tuple[str, dict]:
+    """
+    Дельта сервер → клиент: строит по сигнатуре клиентской версии файла дельту до текущей серверной.
+    Если литералов выходит больше block_delta_max_literal — DeltaTooLarge.
+    :returns (путь к временному файлу дельты, сжатой codec, {"hash", "size", "literal_bytes"}) — файл удаляет вызывающий
+    """
+    import uuid
+
+    os.makedirs(f"tmp_data/{username}", exist_ok=True)
+    delta_path = f"tmp_data/{username}/block_delta_{uuid.uuid4().hex}"
+    try:
+        with read_snapshot(username, game_name) as base_dir:
+            if base_dir is None:
+                raise FileNotFoundError(f"Game {game_name} doesn't exist")
+            info = await run_cpu(_build_block_delta, _game_file_path(base_dir, relative_path), signature, delta_path,
+                                 codec.spec)
+    except BaseException:
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+        raise
+    return delta_path, info
+
+
+def _build_block_delta(source_path: str, signature: dict, delta_path: str, codec: str) -> dict:
+    check_signature_fits(signature, os.path.getsize(source_path), block_delta_max_literal)
+    with (open(source_path, "rb") as source, open(delta_path, "wb") as raw_delta,
+          get_codec(codec).open_writer(raw_delta) as delta):
+        return compute_delta(signature, source, delta, block_delta_max_literal)
+
+
+async def unpack_tar_archive(file_path: str, destination_folder: str):
+    return await run_io(_unpack_tar_archive, file_path, destination_folder)
+
+
+def _unpack_tar_archive(file_path: str, destination_folder: str):
+    if is_manifest(file_path):
+        restore_manifest_backup(file_path, destination_folder)
+    elif is_indexed_backup(file_path):
+        restore_indexed_backup(file_path, destination_folder)
+    else:
+        with _open_tar_stream(file_path, _read_backup_meta(file_path).get("codec")) as tar:
+            if not os.path.exists(destination_folder):
+                os.mkdir(destination_folder)
+
+            with operation_duration.time(operation="extract"):
+                tar.extractall(path=destination_folder, filter="data")
+
+    # Папка заменена целиком: inode и mtime могли совпасть со старыми, индекс строим заново
+    drop_index(destination_folder)
+    return True
+
+
+def normalize_backup_path(path: str) -> str:
+    """Путь внутри бэкапа в формате индекса хэшей: "/папка/файл" ("/" — корень)."""
+    return "/" + os.path.normpath("/" + path).lstrip("/") if path.strip("/") else "/"
+
+
+async def list_backup_contents(username: str, game_name: str, backup_name: str) -> dict:
+    """
+    Содержимое бэкапа без распаковки (для tar-бэкапов архив читается потоком до конца):
+    {"format": "indexed" | "cas" | "tar", "codec": "gzip:9",
+     "files": {"/путь": {"size": 123, "hash": "md5 или None для tar", "mtime": 1700000000.0}}}
+    """
+    return await run_io(_list_backup_contents, f"backups/{username}/{game_name}/{backup_name}")
+
+
+def _list_backup_contents(backup_path: str) -> dict:
+    if is_indexed_backup(backup_path) or is_manifest(backup_path):
+        if is_indexed_backup(backup_path):
+            backup_format, data = "indexed", load_backup_index(backup_path)
+        else:
+            backup_format, data = "cas", load_manifest(backup_path)
+        files = {path: {"size": file_data["size"], "hash": file_data["hash"], "mtime": file_data["mtime"]}
+                 for path, file_data in data["files"].items()}
+        return {"format": backup_format, "codec": data.get("codec", "gzip:6"), "files": files}
+
+    codec = _read_backup_meta(backup_path).get("codec")
+    files = dict()
+    with open(backup_path, "rb") as raw_file:
+        archive_codec = get_codec(codec) if codec else detect_file_codec(raw_file)
+    with _open_tar_stream(backup_path, archive_codec.spec) as tar:
+        for member in tar:
+            if member.isfile():
+                files["/" + os.path.normpath(member.name).lstrip("/")] = {
+                    "size": member.size, "hash": None, "mtime": float(member.mtime)}
+    return {"format": "tar", "codec": archive_codec.spec, "files": files}
+
+
+def select_backup_paths(backup_paths, requested: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Отбирает файлы бэкапа по запрошенным путям: путь файла выбирает файл, путь папки — все файлы в ней,
+    "/" — весь бэкап. :returns (отсортированные выбранные пути, запрошенные пути без совпадений)
+    """
+    selected = set()
+    unmatched = list()
+    for path in requested:
+        normalized = normalize_backup_path(path)
+        prefix = normalized.rstrip("/") + "/"
+        matched = [backup_path for backup_path in backup_paths
+                   if backup_path == normalized or backup_path.startswith(prefix)]
+        if matched:
+            selected.update(matched)
+        else:
+            unmatched.append(path)
+    return sorted(selected), unmatched
+
+
+async def restore_backup_files(username: str, game_name: str, backup_name: str, paths: list[str]) -> list[str]:
+    """
+    Восстанавливает из бэкапа только выбранные файлы (пути в формате индекса), не удаляя папку сохранений.
+    Остальные файлы сохранения не трогаются, из бэкапа с индексом и из CAS читаются только нужные элементы.
+    """
+    async with async_snapshot_writer(username, game_name) as staging_path:
+        return await run_io(_restore_backup_files, f"backups/{username}/{game_name}/{backup_name}",
+                            staging_path, paths)
+
+
+def _restore_backup_files(backup_path: str, destination_folder: str, paths: list[str]) -> list[str]:
+    try:
+        if is_indexed_backup(backup_path):
+            restore_indexed_backup(backup_path, destination_folder, paths)
+        elif is_manifest(backup_path):
+            restore_manifest_backup(backup_path, destination_folder, paths)
+        else:
+            wanted = set(paths)
+            with _open_tar_stream(backup_path, _read_backup_meta(backup_path).get("codec")) as tar:
+                os.makedirs(destination_folder, exist_ok=True)
+                for member in tar:
+                    if member.isfile() and "/" + os.path.normpath(member.name).lstrip("/") in wanted:
+                        _unlink_existing(member, destination_folder)
+                        tar.extract(member, path=destination_folder, filter="data")
+    finally:
+        # mtime восстанавливается из бэкапа, поэтому записи индекса удаляются явно
+        invalidate_entries(destination_folder, paths)
+    return paths
+
+
+def _iter_backup_file_chunks(backup_path: str, relative_path: str, chunk_size: int):
+    if is_indexed_backup(backup_path):
+        yield from iter_member_chunks(backup_path, relative_path, chunk_size=chunk_size)
+        return
+    if is_manifest(backup_path):
+        yield from iter_manifest_file_chunks(backup_path, relative_path, chunk_size)
+        return
+
+    with _open_tar_stream(backup_path, _read_backup_meta(backup_path).get("codec")) as tar:
+        for member in tar:
+            if member.isfile() and "/" + os.path.normpath(member.name).lstrip("/") == relative_path:
+                member_file = tar.extractfile(member)
+                while chunk := member_file.read(chunk_size):
+                    yield chunk
+                return
+    raise FileNotFoundError(f"{relative_path} is not in backup {backup_path}")
+
+
+async def backup_file_chunk_generator(username: str, game_name: str, backup_name: str, relative_path: str,
+                                      CHUNK_SIZE: int = 65536):
+    """Асинхронный генератор содержимого одного файла из бэкапа (распаковывается только этот файл)."""
+    chunks = _iter_backup_file_chunks(f"backups/{username}/{game_name}/{backup_name}", relative_path, CHUNK_SIZE)
+    try:
+        while (chunk := await run_io(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        chunks.close()
 
 
 async def create_backup(game_name: str, username: str):
     """
-    Создает backup сохранения в виде tar архива.
+    Создает backup сохранения в виде tar архива (или манифеста в хранилище) и записывает его в каталог бэкапов.
+    Если отпечаток содержимого совпадает с последним бэкапом — новый не создаётся.
+    :returns True — бэкап есть, False — ошибка, None — папки сохранений нет (игру удалили или переименовали)
     """
 
+    return await run_cpu(_create_backup, game_name, username)
+
+
+BACKUP_NAME_FORMAT = "%Y-%d-%m_%H:%M:%S"
+
+
+def _backup_filename(game_backups_dir: str, created_at, extension: str) -> str:
+    """Имя бэкапа в прежнем формате; при совпадении (два бэкапа за секунду) добавляется суффикс."""
+    base_name = created_at.strftime(BACKUP_NAME_FORMAT)
+    filename = f"{base_name}{extension}"
+    suffix = 1
+    while os.path.exists(f"{game_backups_dir}/{filename}"):
+        filename = f"{base_name}_{suffix}{extension}"
+        suffix += 1
+    return filename
+
+
+def _create_backup(game_name: str, username: str):
+    # Бэкап снимается с одной версии снимка: параллельная загрузка создаёт новую версию, а эту не меняет.
+    # Версия удерживается до конца записи, чтобы сборщик снимков не удалил её файлы
+    with read_snapshot(username, game_name) as folder_path:
+        if folder_path is None:
+            print(f"⚠️  Папка сохранений {game_name} не найдена (игру удалили или переименовали), бэкап не создан")
+            return None
+        return _create_snapshot_backup(game_name, username, folder_path)
+
+
+def _create_snapshot_backup(game_name: str, username: str, folder_path: str):
     from datetime import datetime, UTC
-    import os
 
-    time_now_utc = datetime.now(UTC).strftime("%Y-%d-%m_%H:%M:%S")
+    created_at = datetime.now(UTC)
+
+    file_hashes = update_hash_index(folder_path)
+    fingerprint = compute_fingerprint(file_hashes)
+
+    game_backups_dir = f"backups/{username}/{game_name}"
+    os.makedirs(game_backups_dir, exist_ok=True)
 
-    if not os.path.exists(f"backups/{username}/{game_name}"):
-        os.makedirs(f"backups/{username}/{game_name}")
+    records = get_backup_records(username, game_name)
+    if records is None:
+        return False
+
+    if records and records[-1].fingerprint == fingerprint:
+        print(f"Содержимое {game_name} не изменилось с бэкапа {records[-1].filename}, новый бэкап не создаётся")
+        return True
+
+    # Ротация по реальному времени создания из каталога: имя файла (%Y-%d-%m) не сортируется хронологически.
+    # Старые бэкапы удаляются только после успешного создания нового.
+    excess_records = records[:max(0, len(records) - backups_limit + 1)]
+
+    if backup_format == 'cas':
+        filename = _backup_filename(game_backups_dir, created_at, MANIFEST_SUFFIX)
+        backup_path = f"{game_backups_dir}/{filename}"
+        if not create_manifest_backup(folder_path, backup_path, game_name,
+                                      file_hashes=file_hashes, codec=backup_codec):
+            return False
+        record = {"codec": get_codec(backup_codec).spec, **get_manifest_info(backup_path)}
+    elif backup_format == 'indexed':
+        filename = _backup_filename(game_backups_dir, created_at, INDEXED_SUFFIX)
+        backup_path = f"{game_backups_dir}/{filename}"
+        if not create_indexed_backup(folder_path, backup_path, game_name,
+                                     file_hashes=file_hashes, codec=backup_codec):
+            return False
+        record = {"codec": get_codec(backup_codec).spec, **get_indexed_backup_info(backup_path)}
     else:
-        backup_files = [f for f in os.listdir(f"backups/{username}/{game_name}") if f.endswith('.tar.gz')]
-        i = len(backup_files)
+        codec = get_codec(backup_codec)
+        filename = _backup_filename(game_backups_dir, created_at, codec.archive_extension)
+        backup_path = f"{game_backups_dir}/{filename}"
+        if not writer(folder_path=folder_path, tar_path=backup_path, codec=codec):
+            return False
+        _write_backup_meta(backup_path, {"fingerprint": fingerprint, "file_count": len(file_hashes), "codec": codec.spec})
+        record = {"codec": codec.spec, "size_bytes": os.path.getsize(backup_path), "file_count": len(file_hashes)}
 
-        if i >= backups_limit:
-            backup_files.sort()
+    record.update(filename=filename, created_at=created_at, fingerprint=fingerprint)
+    if not commit_backup_rotation(username, game_name, record, [old.filename for old in excess_records]):
+        _delete_backup_file(backup_path)
+        return False
 
-            excess_count = i - backups_limit + 1
-            for j in range(min(excess_count, len(backup_files))):
-                try:
-                    os.remove(f"backups/{username}/{game_name}/{backup_files[j]}")
-                    print(f"Удален старый бэкап: {backup_files[j]}")
-                except Exception as e:
-                    print(f"Ошибка при удалении бэкапа {backup_files[j]}: {e}")
+    for old in excess_records:
+        try:
+            _delete_backup_file(f"{game_backups_dir}/{old.filename}")
+            print(f"Удален старый бэкап: {old.filename}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ошибка при удалении бэкапа {old.filename}: {e}")
+
+    return True
 
-    writer_status = writer(folder_path=f"saves/{username}/{game_name}", tar_path=f"backups/{username}/{game_name}/{time_now_utc}.tar.gz")
 
-    return writer_status
+def _write_backup_meta(tar_path: str, meta: dict):
+    """Метаданные tar-бэкапа (отпечаток, кодек) хранятся рядом с ним: <архив>.meta.json"""
+    with open(f"{tar_path}.meta.json", "w") as meta_file:
+        json.dump(meta, meta_file)
+
+
+def _read_backup_meta(tar_path: str) -> dict:
+    try:
+        with open(f"{tar_path}.meta.json", "r") as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _delete_backup_file(backup_path: str):
+    if is_manifest(backup_path):
+        delete_manifest_backup(backup_path)
+    else:
+        os.remove(backup_path)
+        if os.path.exists(f"{backup_path}.meta.json"):
+            os.remove(f"{backup_path}.meta.json")
+
+
+async def remove_backup(username: str, game_name: str, backup_name: str):
+    """Удаляет один бэкап (манифест освобождает блобы в хранилище) и его запись в каталоге."""
+    await run_io(delete_backup_records, username, game_name, [backup_name])
+    await run_io(_delete_backup_file, f"backups/{username}/{game_name}/{backup_name}")
+
+
+async def delete_game_backups(username: str, game_name: str):
+    """Удаляет все бэкапы игры вместе с блобами, на которые ссылались только они."""
+    await run_io(_delete_game_backups, username, game_name)
+
+
+def _delete_game_backups(username: str, game_name: str):
+    import shutil
+
+    delete_backup_records(username, game_name)
+    game_backups_dir = f"backups/{username}/{game_name}"
+    for filename in os.listdir(game_backups_dir):
+        if is_manifest(filename):
+            delete_manifest_backup(f"{game_backups_dir}/{filename}")
+    shutil.rmtree(game_backups_dir)
 
 async def read_saves_directory(username: str):
     list_of_games = list()
@@ -295,51 +979,107 @@ def create_all_folders():
         os.mkdir('saves')
     if not os.path.exists('resources'):
         os.mkdir('resources')
-
-def get_backups_info(username):
+    if not os.path.exists('cache'):
+        os.mkdir('cache')
+    if not os.path.exists('locks'):
+        os.mkdir('locks')
+    if not os.path.exists('snapshots'):
+        os.mkdir('snapshots')
+
+async def get_backups_info(username: str, game_name: Optional[str] = None, limit: Optional[int] = None,
+                           offset: int = 0):
     """
-    Возвращает информацию о бэкапах для указанного пользователя.
+    Возвращает информацию о бэкапах пользователя из каталога (без обхода диска) и общее число бэкапов.
+    Внутри игры бэкапы идут от новых к старым; limit/offset — пагинация по всему списку.
     Формат результата:
-    {
+    ({
         "test": [
             {
-                "filename": "2025-29-09_09:01:11.tar.gz",
-                "size_bytes": 123456
+                "filename": "2025-30-09_10:00:00.manifest.json",
+                "created_at": "2025-09-30T10:00:00+00:00",
+                "size_bytes": 123456,  # для манифеста — суммарный размер файлов бэкапа
+                "codec": "gzip:9",
+                "fingerprint": "...",
+                "file_count": 12
             },
             ...
         ],
         ...
-    }
+    }, total)
     """
-    base_path = f"backups/{username}"
+    result = await list_backup_records(username, game_name, limit, offset)
+    if result is None:
+        return False
+
+    records, total = result
     backups_info = {}
+    for record in records:
+        backups_info.setdefault(record.game_name, []).append(record.to_dict())
+    return backups_info, total
 
-    if not os.path.exists(base_path):
-        return backups_info
 
-    try:
-        with os.scandir(base_path) as entries:
-            for entry in entries:
-                if entry.is_dir():
-                    game_name = entry.name
-                    game_backups = []
-                    game_path = entry.path
-
-                    with os.scandir(game_path) as files:
-                        for file_entry in files:
-                            if file_entry.is_file() and file_entry.name.endswith(".tar.gz"):
-                                filename = file_entry.name
-
-                                file_stat = file_entry.stat()
-                                game_backups.append({
-                                    "filename": filename,
-                                    "size_bytes": file_stat.st_size,
-                                })
-
-                    backups_info[game_name] = game_backups
+def _scan_backup_file(path: str, filename: str) -> Optional[dict]:
+    """Запись каталога для бэкапа на диске (для заполнения каталога по существующим файлам)."""
+    from datetime import datetime, UTC
 
-    except Exception as e:
-        print(f"Ошибка при чтении бэкапов для {username}: {e}")
-        return False
+    if is_manifest(filename):
+        manifest = load_manifest(path)
+        created_at = datetime.fromisoformat(manifest["created_at"]) if "created_at" in manifest else None
+        record = {"codec": manifest.get("codec", "gzip:6"), "fingerprint": get_manifest_fingerprint(path),
+                  **get_manifest_info(path)}
+    elif is_indexed_backup(filename):
+        index = load_backup_index(path)
+        created_at = datetime.fromisoformat(index["created_at"])
+        record = {"codec": index["codec"], "fingerprint": index["fingerprint"], **get_indexed_backup_info(path)}
+    elif is_tar_backup(filename):
+        meta = _read_backup_meta(path)
+        created_at = None
+        if "codec" not in meta:
+            with open(path, "rb") as raw_file:
+                meta["codec"] = detect_file_codec(raw_file).spec
+        record = {"codec": meta["codec"], "fingerprint": meta.get("fingerprint"),
+                  "size_bytes": os.path.getsize(path), "file_count": meta.get("file_count")}
+    else:
+        return None
 
-    return backups_info
+    if created_at is None:
+        try:
+            name = filename.split(".")[0]
+            created_at = datetime.strptime(name[:19], BACKUP_NAME_FORMAT).replace(tzinfo=UTC)
+        except ValueError:
+            created_at = datetime.fromtimestamp(os.path.getmtime(path), UTC)
+    record["created_at"] = created_at.astimezone(UTC).replace(tzinfo=None)
+    return record
+
+
+def reconcile_backup_catalog(username: Optional[str] = None):
+    """
+    Сверяет каталог бэкапов с диском: добавляет записи о бэкапах, которых в каталоге нет
+    (например, созданных до появления каталога), и удаляет записи без файлов.
+    Вызывается при запуске сервера и из CLI (python -m modules.backup_store catalog).
+    """
+    if not os.path.exists("backups"):
+        return
+
+    usernames = [username] if username else [entry.name for entry in os.scandir("backups") if entry.is_dir()]
+    for name in usernames:
+        records_on_disk = dict()
+        user_dir = f"backups/{name}"
+        if os.path.exists(user_dir):
+            for game_entry in os.scandir(user_dir):
+                if not game_entry.is_dir() or game_entry.name.startswith("."):
+                    continue
+                for file_entry in os.scandir(game_entry.path):
+                    if not file_entry.is_file():
+                        continue
+                    try:
+                        record = _scan_backup_file(file_entry.path, file_entry.name)
+                    except (OSError, ValueError, KeyError) as e:
+                        print(f"⚠️  Не удалось прочитать бэкап {file_entry.path}: {e}")
+                        continue
+                    if record is not None:
+                        records_on_disk[(game_entry.name, file_entry.name)] = record
+
+        added, removed = sync_backup_records(name, records_on_disk)
+        if added or removed:
+            print(f"[{name}] Каталог бэкапов: добавлено {added}, удалено {removed}")
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+INDEX_VERSION = 1
+INDEX_FILENAME = "hash_index.json"
+
+# Файлы, изменённые менее чем за это время до сканирования, не кэшируются:
+# при грубой точности mtime файл может измениться повторно с тем же stat.
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def get_index_path(base_dir: str) -> str:
+    """
+    Возвращает путь к индексу для папки сохранений.
+    saves/<user>/<game> -> resources/<user>/<game>/hash_index.json
+    Версии снимков (snapshots/<user>/<game>/<версия>, см. modules/snapshots.py) делят индекс игры:
+    записи сверяются по (size, mtime, inode), а неизменённые файлы версий — жёсткие ссылки на одни и те же inode.
+    """
+    parts = os.path.normpath(base_dir).split(os.sep)
+    if len(parts) >= 3 and parts[0] == "snapshots":
+        return os.path.join("resources", parts[1], parts[2], INDEX_FILENAME)
+    relative_dir = os.path.relpath(base_dir, "saves")
+    return os.path.join("resources", relative_dir, INDEX_FILENAME)
+
+
+def _load_index_data(index_path: str) -> tuple[dict, dict]:
+    """Читает индекс с диска: (записи файлов, дайджесты папок). Потерянный или повреждённый индекс считается пустым."""
+    try:
+        with open(index_path, "r") as index_file:
+            data = json.load(index_file)
+    except FileNotFoundError:
+        return {}, {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Индекс хэшей {index_path} повреждён, будет перестроен: {e}")
+        return {}, {}
+
+    if not isinstance(data, dict) or data.get("version") != INDEX_VERSION or not isinstance(data.get("files"), dict):
+        print(f"⚠️  Индекс хэшей {index_path} имеет неизвестный формат, будет перестроен")
+        return {}, {}
+
+    entries = dict()
+    for relative_path, entry in data["files"].items():
+        if isinstance(entry, list) and len(entry) == 4:
+            entries[relative_path] = entry
+
+    directories = data.get("dirs")
+    return entries, directories if isinstance(directories, dict) else {}
+
+
+def load_index(index_path: str) -> dict:
+    return _load_index_data(index_path)[0]
+
+
+def save_index(index_path: str, entries: dict, directories: dict = None):
+    """Атомарно записывает индекс (через временный файл и os.replace)."""
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = f"{index_path}.tmp{os.getpid()}_{threading.get_ident()}"
+    with open(tmp_path, "w") as index_file:
+        json.dump({"version": INDEX_VERSION, "files": entries, "dirs": directories or {}}, index_file)
+    os.replace(tmp_path, index_path)
+
+
+def scan_files(base_dir: str):
+    """Рекурсивно обходит папку, отдаёт (относительный путь, полный путь, stat) для каждого файла."""
+
+    def scan_directory(directory):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.path[len(base_dir):], entry.path, entry.stat()
+                elif entry.is_dir():
+                    yield from scan_directory(entry.path)
+
+    yield from scan_directory(base_dir)
+
+
+def file_md5(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, 'md5').hexdigest()
+
+
+def update_hash_index(base_dir: str) -> dict:
+    """
+    Сканирует папку и возвращает {'file_path': 'md5_hash'}.
+    Перехэширует только файлы, у которых изменился (size, mtime_ns, inode), индекс сохраняется на диск.
+    """
+    return update_merkle_tree(base_dir)[0]
+
+
+def update_merkle_tree(base_dir: str) -> tuple[dict, dict]:
+    """
+    То же, что update_hash_index, но дополнительно возвращает дерево Меркла папки {'/dir': digest} (см. compute_directory_digests).
+    Дайджесты папок хранятся в индексе и пересчитываются только вдоль путей изменённых файлов.
+    """
+    index_path = get_index_path(base_dir)
+    old_entries, old_directories = _load_index_data(index_path)
+    new_entries = dict()
+    changed = False
+    scan_started_ns = time.time_ns()
+
+    for relative_path, full_path, stat in scan_files(base_dir):
+        key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        cached = old_entries.get(relative_path)
+
+        if cached is not None and cached[:3] == key:
+            new_entries[relative_path] = cached
+            continue
+
+        md5_hash = file_md5(full_path)
+        if scan_started_ns - stat.st_mtime_ns > RACY_WINDOW_NS:
+            new_entries[relative_path] = key + [md5_hash]
+        else:
+            # «Свежий» файл: хэш отдаём, но в индекс с таким stat не кладём
+            new_entries[relative_path] = [None, None, None, md5_hash]
+        changed = True
+
+    file_hashes = {relative_path: entry[3] for relative_path, entry in new_entries.items()}
+
+    changed_paths = old_entries.keys() ^ new_entries.keys()
+    changed_paths.update(relative_path for relative_path in old_entries.keys() & new_entries.keys()
+                         if old_entries[relative_path][3] != new_entries[relative_path][3])
+    directories = compute_directory_digests(file_hashes, old_directories, changed_paths)
+
+    if changed or changed_paths or directories != old_directories:
+        save_index(index_path, new_entries, directories)
+
+    return file_hashes, directories
+
+
+def _parent_directory(path: str) -> str:
+    parent = path.rsplit("/", 1)[0]
+    return parent or "/"
+
+
+def _ancestors(path: str):
+    while path != "/":
+        path = _parent_directory(path)
+        yield path
+
+
+def compute_directory_digests(file_hashes: dict, old_directories: dict = None, changed_paths=None) -> dict:
+    """
+    Дерево Меркла папки: {'/': корень, '/dir': ..., '/dir/sub': ...} (только папки, в которых есть файлы).
+    Дайджест папки — md5 от отсортированных по имени строк "имя\0тип\0дайджест\n" её прямых потомков,
+    где тип "f" (дайджест — md5 файла) или "d" (дайджест вложенной папки). Пустая папка игры — md5 от пустой строки.
+
+    Если переданы старые дайджесты и изменённые пути, пересчитываются только папки вдоль этих путей
+    и папки без сохранённого дайджеста.
+    """
+    children = get_directory_children(file_hashes)
+    children.setdefault("/", dict())
+
+    dirty = set(children) if old_directories is None or changed_paths is None else set()
+    if not dirty:
+        for relative_path in changed_paths:
+            dirty.update(_ancestors(relative_path))
+        dirty.update(directory for directory in children if directory not in old_directories)
+
+    directories = {directory: old_directories[directory] for directory in children if directory not in dirty}
+    # Снизу вверх: вложенные папки считаются раньше родителей
+    for directory in sorted(dirty & children.keys(), key=lambda path: path.count("/") if path != "/" else 0,
+                            reverse=True):
+        digest = hashlib.md5()
+        for name, (kind, child_digest) in sorted(children[directory].items()):
+            if kind == "d":
+                child_digest = directories[child_digest]
+            digest.update(f"{name}\0{kind}\0{child_digest}\n".encode())
+        directories[directory] = digest.hexdigest()
+    return directories
+
+
+def get_directory_children(file_hashes: dict) -> dict:
+    """{'/dir': {'имя': ('f', md5) | ('d', '/dir/имя')}} — прямые потомки каждой папки."""
+    children = dict()
+    for relative_path, md5_hash in file_hashes.items():
+        path, kind, value = relative_path, "f", md5_hash
+        while path != "/":
+            parent = _parent_directory(path)
+            siblings = children.setdefault(parent, dict())
+            name = path[len(parent):].lstrip("/")
+            if name in siblings:
+                break
+            siblings[name] = (kind, value)
+            path, kind, value = parent, "d", parent
+    return children
+
+
+def compute_fingerprint(file_hashes: dict) -> str:
+    """Отпечаток содержимого папки: md5 от отсортированных пар (путь, md5 файла)."""
+    fingerprint = hashlib.md5()
+    for relative_path in sorted(file_hashes):
+        fingerprint.update(f"{relative_path}\0{file_hashes[relative_path]}\n".encode())
+    return fingerprint.hexdigest()
+
+
+def invalidate_entries(base_dir: str, relative_paths):
+    """Удаляет записи для перезаписанных/удалённых файлов, чтобы они были перехэшированы."""
+    index_path = get_index_path(base_dir)
+    entries, directories = _load_index_data(index_path)
+    if not entries:
+        return
+
+    removed = False
+    for relative_path in relative_paths:
+        if entries.pop(relative_path, None) is not None:
+            removed = True
+            # Дайджесты папок на пути к файлу устарели: без них они будут пересчитаны
+            for directory in _ancestors(relative_path):
+                directories.pop(directory, None)
+
+    if removed:
+        save_index(index_path, entries, directories)
+
+
+def drop_index(base_dir: str):
+    """Полностью сбрасывает индекс (например, после замены всей папки)."""
+    try:
+        os.remove(get_index_path(base_dir))
+    except FileNotFoundError:
+        pass
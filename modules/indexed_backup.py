@@ -0,0 +1,190 @@
+"""
+Бэкап с индексом: один файл, в котором каждый файл сохранения сжат отдельно, а в конце лежит таблица смещений.
+
+Формат <время>.pack:
+    b"MNEMYPK1"                              — заголовок
+    <сжатый файл 1><сжатый файл 2>...        — каждый элемент — самостоятельный поток кодека (gzip/zstd/без сжатия)
+    <индекс JSON>                            — format, version, game_name, created_at, codec, fingerprint и
+                                               files: {путь: {offset, length, size, hash, mtime, mode}}
+    b"MNEMYIDX" + <смещение индекса> + <длина индекса>  — хвост фиксированной длины (little-endian uint64)
+
+Список файлов читается по хвосту и индексу, не трогая данные; отдельный файл восстанавливается
+чтением только его элемента (seek по offset), остальные не распаковываются.
+"""
+import hashlib
+import json
+import os
+import shutil
+import struct
+
+from datetime import datetime, UTC
+
+from modules.compression import get_codec
+from modules.hash_index import update_hash_index, compute_fingerprint
+
+INDEXED_SUFFIX = ".pack"
+INDEXED_FORMAT = "mnemy-pack"
+INDEXED_VERSION = 1
+HEADER_MAGIC = b"MNEMYPK1"
+FOOTER_MAGIC = b"MNEMYIDX"
+FOOTER = struct.Struct("<8sQQ")
+CHUNK_SIZE = 1024 * 1024
+
+
+def is_indexed_backup(path: str) -> bool:
+    return path.endswith(INDEXED_SUFFIX)
+
+
+class _MemberReader:
+    """Чтение только length байт начиная с offset: распаковщик не выходит за границы своего элемента."""
+
+    def __init__(self, fileobj, offset: int, length: int):
+        self._fileobj = fileobj
+        self._remaining = length
+        self._fileobj.seek(offset)
+
+    def read(self, size=-1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fileobj.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def create_indexed_backup(folder_path: str, backup_path: str, game_name: str, file_hashes: dict = None,
+                          codec="gzip:6") -> bool:
+    """
+    Создаёт бэкап папки в формате с индексом.
+    :param file_hashes: уже посчитанные {'file_path': 'md5_hash'}, чтобы не сканировать папку повторно
+    """
+    try:
+        codec = get_codec(codec)
+        if file_hashes is None:
+            file_hashes = update_hash_index(folder_path)
+        files = dict()
+
+        with open(backup_path, "wb") as backup_file:
+            backup_file.write(HEADER_MAGIC)
+            for relative_path in sorted(file_hashes):
+                full_path = os.path.join(folder_path, relative_path.lstrip("/"))
+                offset = backup_file.tell()
+                md5 = hashlib.md5()
+                size = 0
+                try:
+                    stat = os.stat(full_path)
+                    with open(full_path, "rb") as file, codec.open_writer(backup_file) as member:
+                        while chunk := file.read(CHUNK_SIZE):
+                            md5.update(chunk)
+                            size += len(chunk)
+                            member.write(chunk)
+                except (OSError, PermissionError) as e:
+                    print(f"⚠️  Пропущен элемент {full_path}: {e}")
+                    # Недописанный элемент обрезается, следующий начнётся с того же смещения
+                    backup_file.seek(offset)
+                    backup_file.truncate()
+                    continue
+
+                files[relative_path] = {
+                    "offset": offset,
+                    "length": backup_file.tell() - offset,
+                    "size": size,
+                    "hash": md5.hexdigest(),
+                    "mtime": stat.st_mtime,
+                    "mode": stat.st_mode & 0o777,
+                }
+
+            index_offset = backup_file.tell()
+            index_data = json.dumps({
+                "format": INDEXED_FORMAT,
+                "version": INDEXED_VERSION,
+                "game_name": game_name,
+                "created_at": datetime.now(UTC).isoformat(),
+                "codec": codec.spec,
+                "fingerprint": compute_fingerprint({path: data["hash"] for path, data in files.items()}),
+                "files": files,
+            }).encode()
+            backup_file.write(index_data)
+            backup_file.write(FOOTER.pack(FOOTER_MAGIC, index_offset, len(index_data)))
+
+        return True
+    except Exception as e:
+        print(f"❌ Indexed backup error: {e}")
+        import traceback
+        traceback.print_exc()
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        return False
+
+
+def load_backup_index(backup_path: str) -> dict:
+    """Читает индекс по хвосту файла (данные элементов не читаются)."""
+    with open(backup_path, "rb") as backup_file:
+        if backup_file.read(len(HEADER_MAGIC)) != HEADER_MAGIC:
+            raise ValueError(f"{backup_path} is not an indexed backup")
+        backup_file.seek(-FOOTER.size, os.SEEK_END)
+        magic, index_offset, index_length = FOOTER.unpack(backup_file.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError(f"{backup_path} has no index (incomplete backup?)")
+        backup_file.seek(index_offset)
+        index = json.loads(backup_file.read(index_length))
+
+    if index.get("format") != INDEXED_FORMAT:
+        raise ValueError(f"{backup_path} has an unknown index format")
+    return index
+
+
+def get_indexed_backup_info(backup_path: str) -> dict:
+    index = load_backup_index(backup_path)
+    return {
+        "size_bytes": os.path.getsize(backup_path),
+        "file_count": len(index["files"]),
+    }
+
+
+def iter_member_chunks(backup_path: str, relative_path: str, index: dict = None, chunk_size: int = 65536):
+    """Генератор распакованного содержимого одного файла бэкапа."""
+    if index is None:
+        index = load_backup_index(backup_path)
+    file_data = index["files"].get(relative_path)
+    if file_data is None:
+        raise FileNotFoundError(f"{relative_path} is not in backup {backup_path}")
+
+    codec = get_codec(index["codec"])
+    with (open(backup_path, "rb") as backup_file,
+          codec.open_reader(_MemberReader(backup_file, file_data["offset"], file_data["length"])) as member):
+        while chunk := member.read(chunk_size):
+            yield chunk
+
+
+def restore_indexed_backup(backup_path: str, destination_folder: str, paths: list[str] = None) -> list[str]:
+    """
+    Восстанавливает файлы из бэкапа в destination_folder: все или только выбранные paths
+    (относительные пути файлов в формате индекса). :returns список восстановленных путей
+    """
+    index = load_backup_index(backup_path)
+    codec = get_codec(index["codec"])
+    selected = sorted(index["files"]) if paths is None else paths
+
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+
+    with open(backup_path, "rb") as backup_file:
+        for relative_path in selected:
+            file_data = index["files"][relative_path]
+            target_path = os.path.normpath(os.path.join(destination_folder, relative_path.lstrip("/")))
+            if not target_path.startswith(os.path.normpath(destination_folder) + os.sep):
+                raise ValueError(f"Unsafe path in backup index: {relative_path}")
+
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            # Файл может быть жёсткой ссылкой из прошлой версии снимка (modules/snapshots.py): не перезаписываем на месте
+            if os.path.lexists(target_path):
+                os.unlink(target_path)
+            with (codec.open_reader(_MemberReader(backup_file, file_data["offset"], file_data["length"])) as member,
+                  open(target_path, "wb") as target):
+                shutil.copyfileobj(member, target, CHUNK_SIZE)
+            os.chmod(target_path, file_data["mode"])
+            os.utime(target_path, (file_data["mtime"], file_data["mtime"]))
+
+    return selected
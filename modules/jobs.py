@@ -0,0 +1,186 @@
+"""
+Фоновые задачи для тяжёлых операций: создание бэкапа, восстановление из бэкапа, удаление игры.
+
+Задачи хранятся в таблице jobs (modules/sqls.py), поэтому переживают перезапуск сервера,
+а их статус виден из любого воркера. Задачи одной пары (пользователь, игра) выполняются строго по порядку.
+
+Режимы (settings.json -> jobs_mode):
+    "inprocess" — задачи выполняются в том же процессе, что и API (по умолчанию);
+    "external"  — API только ставит задачи в очередь, выполняет их отдельный воркер:
+                  python -m modules.jobs [--concurrency N]
+"""
+import asyncio
+import json
+import os
+import shutil
+import sys
+import uuid
+
+from modules.file_manager import (create_backup, unpack_tar_archive, delete_game_backups, invalidate_archive_cache,
+                                  restore_backup_files)
+from modules.executor import run_io
+from modules.locks import game_lock
+from modules.snapshots import async_snapshot_writer
+from modules.async_sqls import (add_job, delete_sync_data, bump_generation, move_pending_jobs, cancel_pending_jobs,
+                                async_engine)
+from modules.sqls import claim_job, finish_job, has_pending_jobs, get_pending_job_keys
+
+with open("settings.json", "r") as settings_file:
+    _settings = json.load(settings_file)
+
+JOBS_MODE: str = _settings.get("jobs_mode", "inprocess")
+JOBS_MAX_ATTEMPTS: int = _settings.get("jobs_max_attempts", 3)
+JOBS_STALE_SECONDS: int = _settings.get("jobs_stale_seconds", 3600)
+JOBS_POLL_SECONDS: float = 1.0
+
+_drainers: dict[tuple[str, str], asyncio.Task] = dict()
+
+
+async def _run_create_backup(username: str, game_name: str, payload: dict):
+    # Блокировка не нужна: бэкап читает неизменяемую версию снимка (modules/snapshots.py)
+    backup_status = await create_backup(game_name, username)
+    if backup_status is None:
+        # Игру удалили или переименовали, пока задача ждала очереди: бэкапить нечего
+        return
+    if backup_status is False:
+        raise RuntimeError("Backup writer failed")
+    await bump_generation(username, game_name, saves=False, backups=True)
+
+
+async def _run_restore_backup(username: str, game_name: str, payload: dict):
+    if payload.get("paths") is not None:
+        # Восстановление отдельных файлов: папка сохранений не удаляется
+        async with game_lock(username, game_name):
+            await restore_backup_files(username, game_name, payload['backup_name'], payload['paths'])
+            invalidate_archive_cache(username, game_name)
+            await bump_generation(username, game_name)
+        return
+
+    async with game_lock(username, game_name):
+        # Бэкап распаковывается в новую пустую версию; текущая заменяется только после успешной распаковки
+        async with async_snapshot_writer(username, game_name, copy_current=False) as staging_path:
+            status = await unpack_tar_archive(f"backups/{username}/{game_name}/{payload['backup_name']}",
+                                              staging_path)
+            if status is not True:
+                raise RuntimeError(f"Failed to unpack backup {payload['backup_name']}")
+        invalidate_archive_cache(username, game_name)
+        await bump_generation(username, game_name)
+
+
+async def _run_delete_game(username: str, game_name: str, payload: dict):
+    # Папка сохранений уже перенесена в корзину обработчиком запроса, здесь только долгое удаление
+    if os.path.exists(payload['trash_path']):
+        await run_io(shutil.rmtree, payload['trash_path'])
+
+    if payload['delete_backups'] and os.path.exists(f"backups/{username}/{game_name}"):
+        await delete_game_backups(username, game_name)
+        if os.path.exists(f'resources/{username}/{game_name}'):
+            await run_io(shutil.rmtree, f'resources/{username}/{game_name}')
+        await delete_sync_data(username, game_name)
+        await bump_generation(username, game_name, saves=False, backups=True)
+
+
+JOB_HANDLERS = {
+    "create_backup": _run_create_backup,
+    "restore_backup": _run_restore_backup,
+    "delete_game": _run_delete_game,
+}
+
+
+async def enqueue_job(kind: str, username: str, game_name: str, payload: dict = None) -> str:
+    """Сохраняет задачу в очередь и (в режиме inprocess) запускает её обработку. Возвращает job_id."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job_id = uuid.uuid4().hex
+    if not await add_job(job_id, kind, username, game_name, json.dumps(payload or {}), JOBS_MAX_ATTEMPTS):
+        raise RuntimeError(f"Failed to enqueue job {kind}")
+
+    if JOBS_MODE == "inprocess":
+        _schedule(username, game_name)
+    return job_id
+
+
+async def _execute(job: dict):
+    handler = JOB_HANDLERS.get(job["kind"])
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job['kind']}")
+        await handler(job["username"], job["game_name"], json.loads(job["payload"]))
+    except Exception as e:
+        if job["attempts"] < job["max_attempts"]:
+            retry_after = 2 ** job["attempts"]
+            print(f"⚠️  Задача {job['kind']} {job['job_id']} упала (попытка {job['attempts']}), повтор через {retry_after} с: {e}")
+            await run_io(finish_job, job["job_id"], error=str(e), retry_after=retry_after)
+        else:
+            print(f"❌ Задача {job['kind']} {job['job_id']} окончательно упала: {e}")
+            await run_io(finish_job, job["job_id"], status="failed", error=str(e))
+        return
+
+    await run_io(finish_job, job["job_id"])
+
+
+async def move_game_jobs(username: str, game_name: str, new_game_name: str):
+    """Переименование игры: ожидающие задачи переходят на новое имя. Вызывать под блокировкой обеих игр."""
+    if await move_pending_jobs(username, game_name, new_game_name) and JOBS_MODE == "inprocess":
+        _schedule(username, new_game_name)
+
+
+async def cancel_game_jobs(username: str, game_name: str):
+    """Удаление игры: ожидающие бэкап и восстановление больше не нужны. Вызывать под блокировкой игры."""
+    await cancel_pending_jobs(username, game_name, ["create_backup", "restore_backup"])
+
+
+def _schedule(username: str, game_name: str):
+    key = (username, game_name)
+    task = _drainers.get(key)
+    if task is None or task.done():
+        _drainers[key] = asyncio.create_task(_drain(username, game_name))
+
+
+async def _drain(username: str, game_name: str):
+    """Выполняет задачи одной игры по очереди, пока они есть."""
+    while True:
+        job = await run_io(claim_job, username, game_name, stale_after=JOBS_STALE_SECONDS)
+        if job is not None:
+            await _execute(job)
+            continue
+
+        # Ничего не взяли: задача ждёт повтора или выполняется другим процессом
+        if not await run_io(has_pending_jobs, username, game_name):
+            _drainers.pop((username, game_name), None)
+            return
+        await asyncio.sleep(JOBS_POLL_SECONDS)
+
+
+def start_jobs():
+    """Подхватывает задачи, оставшиеся в очереди после перезапуска (вызывается при старте приложения)."""
+    if JOBS_MODE != "inprocess":
+        return
+    for username, game_name in get_pending_job_keys():
+        _schedule(username, game_name)
+
+
+async def run_worker(concurrency: int = 1):
+    """Отдельный воркер для режима external."""
+
+    async def worker_loop():
+        while True:
+            job = await run_io(claim_job, stale_after=JOBS_STALE_SECONDS)
+            if job is None:
+                await asyncio.sleep(JOBS_POLL_SECONDS)
+                continue
+            await _execute(job)
+
+    print(f"🛠️  Воркер задач запущен, параллельность: {concurrency}")
+    try:
+        await asyncio.gather(*(worker_loop() for _ in range(concurrency)))
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    worker_concurrency = 1
+    if "--concurrency" in sys.argv:
+        worker_concurrency = int(sys.argv[sys.argv.index("--concurrency") + 1])
+    asyncio.run(run_worker(worker_concurrency))
@@ -0,0 +1,80 @@
+"""
+Блокировки папок игр (пользователь, игра), общие для всех процессов сервера.
+
+Эксклюзивную блокировку берут все писатели (modules/controllers.py и modules/jobs.py):
+    - /files/upload_data, /files/uploads/{upload_id}/finalize, /files/upload_delta, /files/upload_block_delta;
+    - проверка файлов (/files/check_files, /files/check_files_batch) — только при создании папки новой игры
+      и удалении лишних файлов;
+    - задача restore_backup, /manage/delete/game/{game_name}, /manage/update_game/{game_name} (обе игры, game_locks).
+Разделяемый режим (exclusive=False) сейчас никем не используется: читатели (скачивание, проверка хэшей, бэкап,
+дельты) работают с неизменяемой версией снимка и удерживают её через hold_snapshot (modules/snapshots.py),
+а не через эту блокировку. Основа — flock на файле locks/<user>/<game>.lock:
+flock действует на открытый файл, поэтому конфликтуют и разные процессы, и разные запросы внутри одного процесса.
+Файлы блокировок никогда не удаляются: удаление файла под чужой блокировкой сломало бы взаимное исключение.
+
+Ожидание неблокирующее (LOCK_NB + asyncio.sleep), чтобы ждущие запросы не занимали потоки io-пула,
+которые нужны держателю блокировки для завершения работы.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import time
+
+from contextlib import asynccontextmanager, AsyncExitStack
+
+with open("settings.json", "r") as settings_file:
+    _settings = json.load(settings_file)
+
+LOCK_TIMEOUT: float = _settings.get("game_lock_timeout", 30)
+LOCK_POLL_MIN: float = 0.005
+LOCK_POLL_MAX: float = 0.1
+
+
+class GameLockTimeout(TimeoutError):
+    def __init__(self, username: str, game_name: str):
+        super().__init__(f"Game '{game_name}' of user '{username}' is busy")
+        self.username = username
+        self.game_name = game_name
+
+
+def get_lock_path(username: str, game_name: str) -> str:
+    return f"locks/{username}/{game_name}.lock"
+
+
+@asynccontextmanager
+async def game_lock(username: str, game_name: str, exclusive: bool = True, timeout: float = LOCK_TIMEOUT):
+    """Берёт блокировку игры; если за timeout секунд не удалось — GameLockTimeout."""
+    lock_path = get_lock_path(username, game_name)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        operation = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB
+        deadline = time.monotonic() + timeout
+        delay = LOCK_POLL_MIN
+        while True:
+            try:
+                fcntl.flock(lock_fd, operation)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise GameLockTimeout(username, game_name)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL_MAX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+    finally:
+        os.close(lock_fd)
+
+
+@asynccontextmanager
+async def game_locks(username: str, game_names, exclusive: bool = True, timeout: float = LOCK_TIMEOUT):
+    """Блокирует несколько игр сразу (например, при переименовании) в едином порядке, чтобы не было взаимоблокировок."""
+    async with AsyncExitStack() as stack:
+        for game_name in sorted(set(game_names)):
+            await stack.enter_async_context(game_lock(username, game_name, exclusive, timeout))
+        yield
+
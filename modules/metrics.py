@@ -0,0 +1,250 @@
+"""
+Метрики сервера в текстовом формате Prometheus (GET /metrics, см. modules/controllers.py).
+
+Значения хранятся в памяти процесса: обновление — сложение в словаре под блокировкой, без внешних зависимостей.
+Очереди пулов (modules/executor.py) и каталог бэкапов не считаются на горячем пути, а читаются в момент опроса.
+При нескольких воркерах uvicorn каждый процесс считает своё, и запрос /metrics попадает в один из них;
+для точных цифр сервер с метриками стоит запускать с одним воркером или опрашивать воркеры по отдельности.
+Время операций, выполненных в пуле процессов (cpu_use_processes), в метрики не попадает.
+"""
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from modules.executor import io_pool, cpu_pool
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+REGISTRY = list()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Базовая метрика с метками. callback — функция без аргументов, возвращающая {(значения меток): значение}:
+    такие метрики вычисляются при опросе, а не обновляются по ходу работы.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = dict()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def replace(self, values: dict):
+        """Заменяет все значения сразу: исчезнувшие наборы меток пропадают из вывода."""
+        with self._lock:
+            self._values = dict(values)
+
+    def samples(self):
+        values = self.callback() if self.callback is not None else self._snapshot()
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Накопительные суммы по корзинам считаются при выводе, здесь — одно сложение
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][position] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with histogram.time(operation="..."): — время выполнения блока, в том числе завершившегося ошибкой."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# === HTTP ===
+
+http_requests = Counter("mnemy_http_requests_total", "HTTP requests by route template and status",
+                        ("method", "route", "status"))
+http_request_duration = Histogram("mnemy_http_request_duration_seconds",
+                                  "Time until the response body is fully sent", ("method", "route"))
+
+
+class MetricsMiddleware:
+    """
+    ASGI-прослойка: число и длительность запросов. Маршрут берётся шаблоном (/files/uploads/{upload_id}),
+    чтобы число рядов не зависело от параметров; запросы мимо маршрутов считаются как "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, method=scope["method"], route=route_path)
+            http_requests.inc(method=scope["method"], route=route_path, status=status)
+
+
+# === Файлы ===
+
+upload_received_bytes = Counter("mnemy_upload_received_bytes_total", "Archive bytes received by get_files")
+archive_streamed_bytes = Counter("mnemy_archive_streamed_bytes_total",
+                                 "Archive bytes streamed by create_archive_chunk_generator")
+operation_duration = Histogram("mnemy_operation_duration_seconds",
+                               "Time spent in hash_generator, writer and archive extraction", ("operation",))
+
+# === Бэкапы (обновляются из каталога при каждом опросе /metrics) ===
+# Имена пользователей попадают в вывод только при заданном metrics_token: открытый /metrics отдаёт лишь итоги
+
+backups_count = Gauge("mnemy_backups", "Backups in the catalog")
+backups_size = Gauge("mnemy_backups_size_bytes", "Size of backup files in the catalog")
+user_backups_count = Gauge("mnemy_user_backups", "Backups in the catalog per user (only with metrics_token)",
+                           ("username",))
+user_backups_size = Gauge("mnemy_user_backups_size_bytes",
+                          "Size of backup files in the catalog per user (only with metrics_token)", ("username",))
+
+# === База данных ===
+
+db_query_duration = Histogram("mnemy_db_query_duration_seconds", "SQL statement execution time",
+                              ("engine", "statement"), buckets=DB_BUCKETS)
+
+
+def instrument_engine(engine, engine_name: str):
+    """Подписывает синхронный движок SQLAlchemy (для async — engine.sync_engine) на замер времени запросов."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("mnemy_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["mnemy_query_started"].pop()
+        db_query_duration.observe(time.perf_counter() - started, engine=engine_name,
+                                  statement=statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        connection = context.connection
+        if connection is not None and connection.info.get("mnemy_query_started"):
+            connection.info["mnemy_query_started"].pop()
+
+
+# === Пулы воркеров (modules/executor.py) ===
+
+def _pool_values(field: str) -> dict:
+    return {(pool.name,): pool.stats()[field] for pool in (io_pool, cpu_pool)}
+
+
+Gauge("mnemy_executor_queue_depth", "Tasks waiting for a free worker", ("pool",),
+      callback=lambda: _pool_values("queue_depth"))
+Gauge("mnemy_executor_in_flight", "Tasks submitted and not finished yet", ("pool",),
+      callback=lambda: _pool_values("in_flight"))
+Gauge("mnemy_executor_workers", "Maximum number of workers", ("pool",),
+      callback=lambda: _pool_values("max_workers"))
+Counter("mnemy_executor_tasks_completed_total", "Tasks finished successfully", ("pool",),
+        callback=lambda: _pool_values("completed"))
+Counter("mnemy_executor_tasks_failed_total", "Tasks finished with an exception", ("pool",),
+        callback=lambda: _pool_values("failed"))
+Gauge("mnemy_executor_wait_seconds_p99", "99th percentile of queue wait over recent tasks", ("pool",),
+      callback=lambda: _pool_values("wait_seconds_p99"))
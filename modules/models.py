@@ -10,6 +10,13 @@ class GameFilesData(BaseModel):
     files_data: dict
     last_sync_date: datetime | None
 
+class GameFilesBatch(BaseModel):
+    games: list[GameFilesData]
+
+class GameTreeDigests(BaseModel):
+    game_name: str
+    digests: dict[str, str]
+
 class AdminUser(BaseModel):
     username: str
     password: str
@@ -20,4 +27,22 @@ class Settings(BaseModel):
 
 class SavesBackup(BaseModel):
     game_name: str
-    backup_name: str
\ No newline at end of file
+    backup_name: str
+
+class SavesBackupFiles(SavesBackup):
+    paths: list[str]
+
+class UploadSessionCreate(BaseModel):
+    game_name: str
+    length: int | None = None
+    checksum: str | None = None
+
+class BlockSignature(BaseModel):
+    size: int
+    block_size: int
+    blocks: list[tuple[int, str]]
+
+class BlockDeltaRequest(BaseModel):
+    game_name: str
+    path: str
+    signature: BlockSignature
\ No newline at end of file
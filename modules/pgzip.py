@@ -0,0 +1,108 @@
+"""
+Параллельное gzip-сжатие в стиле pigz.
+
+Поток режется на блоки, каждый блок сжимается независимо в отдельном потоке (zlib отпускает GIL)
+в «сырой» deflate с Z_SYNC_FLUSH; последний блок завершается Z_FINISH. Словарём для блока служат
+последние 32 КБ предыдущего, поэтому степень сжатия почти как у обычного gzip. Блоки склеиваются
+по порядку в один gzip member с общими CRC32 и размером — результат читает любой gunzip.
+"""
+import os
+import struct
+import threading
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BLOCK_SIZE = 128 * 1024
+DICTIONARY_SIZE = 32 * 1024
+# Заголовок gzip: deflate, без флагов, mtime=0 (архив детерминирован), OS=unknown
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+_pools: dict[int, ThreadPoolExecutor] = dict()
+_pools_lock = threading.Lock()
+
+
+def _get_pool(threads: int) -> ThreadPoolExecutor:
+    """Общий для всех писателей пул: суммарное число потоков сжатия ограничено."""
+    with _pools_lock:
+        if threads not in _pools:
+            _pools[threads] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="mnemy-pgzip")
+        return _pools[threads]
+
+
+def _compress_block(block: bytes, level: int, dictionary: bytes, last: bool) -> bytes:
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter:
+    """
+    Файлоподобный объект только на запись. Закрытие дописывает хвост gzip, но не закрывает fileobj.
+    В памяти одновременно держится не больше threads * 2 блоков.
+    """
+
+    def __init__(self, fileobj, level: int = 6, threads: int = 0, block_size: int = BLOCK_SIZE):
+        self._fileobj = fileobj
+        self._level = level
+        self._threads = threads or os.cpu_count() or 1
+        self._block_size = block_size
+        self._pool = _get_pool(self._threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+        self.closed = False
+
+        self._fileobj.write(GZIP_HEADER)
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed ParallelGzipWriter")
+
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block: bytes, last: bool):
+        self._crc = zlib.crc32(block, self._crc)
+        self._size += len(block)
+        self._pending.append(self._pool.submit(_compress_block, block, self._level, self._dictionary, last))
+        self._dictionary = block[-DICTIONARY_SIZE:]
+
+        while len(self._pending) > self._threads * 2:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self._submit(bytes(self._buffer), last=True)
+        self._buffer.clear()
+        while self._pending:
+            self._fileobj.write(self._pending.popleft().result())
+        self._fileobj.write(struct.pack("<II", self._crc & 0xffffffff, self._size & 0xffffffff))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # При ошибке не ждём оставшиеся блоки: архив всё равно будет отброшен
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self.closed = True
+        return False
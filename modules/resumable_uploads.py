@@ -0,0 +1,289 @@
+"""
+Докачиваемые загрузки архивов сохранений (по мотивам протокола tus).
+
+    POST   /files/uploads                      — создать сессию {game_name, length?, checksum?} → upload_id
+    PATCH  /files/uploads/{id}                 — дописать кусок: заголовок Upload-Offset обязан совпасть с текущим
+                                                 смещением, Upload-Checksum: "<md5|sha1|sha256> <base64 или hex>"
+    HEAD   /files/uploads/{id}                 — текущее смещение (Upload-Offset), с него клиент продолжает
+    POST   /files/uploads/{id}/finalize        — распаковать архив тем же путём, что /files/upload_data, и поставить бэкап
+    DELETE /files/uploads/{id}                 — отменить загрузку
+
+Сессия — два файла в tmp_data/<user>/uploads/: <id>.json (метаданные) и <id>.part (принятые байты);
+текущее смещение — размер .part, поэтому сессия переживает перезапуск сервера и видна всем воркерам.
+Кусок без контрольной суммы при обрыве соединения сохраняется частично, кусок с суммой — целиком или никак.
+Сессия живёт upload_session_ttl секунд (settings.json) с последнего куска, просроченные удаляются
+при создании новых сессий и при запуске сервера.
+"""
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+
+from typing import Optional
+
+from modules.executor import run_io
+
+with open("settings.json", "r") as settings_file:
+    UPLOAD_SESSION_TTL: int = json.load(settings_file).get("upload_session_ttl", 86400)
+
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+
+
+class UploadSessionError(Exception):
+    pass
+
+
+class UploadSessionNotFound(UploadSessionError):
+    pass
+
+
+class UploadSessionBusy(UploadSessionError):
+    pass
+
+
+class UploadOffsetMismatch(UploadSessionError):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload-Offset does not match, current offset is {offset}")
+        self.offset = offset
+
+
+class UploadChecksumMismatch(UploadSessionError):
+    pass
+
+
+class UploadTooLarge(UploadSessionError):
+    pass
+
+
+class UploadIncomplete(UploadSessionError):
+    pass
+
+
+def get_uploads_dir(username: str) -> str:
+    return f"tmp_data/{username}/uploads"
+
+
+def _session_paths(username: str, upload_id: str) -> tuple[str, str]:
+    # upload_id приходит из URL: допускаем только то, что выдаёт create_session
+    if len(upload_id) != 32 or any(char not in "0123456789abcdef" for char in upload_id):
+        raise UploadSessionNotFound(upload_id)
+    uploads_dir = get_uploads_dir(username)
+    return f"{uploads_dir}/{upload_id}.json", f"{uploads_dir}/{upload_id}.part"
+
+
+def parse_checksum(header: str) -> tuple[str, bytes]:
+    """'md5 <base64>' (как в tus) или 'md5 <hex>' → (алгоритм, ожидаемый дайджест)."""
+    algorithm, _, value = header.strip().partition(" ")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ValueError(f"Unsupported checksum algorithm: {algorithm} (use {', '.join(CHECKSUM_ALGORITHMS)})")
+
+    digest_size = hashlib.new(algorithm).digest_size
+    value = value.strip()
+    try:
+        digest = bytes.fromhex(value) if len(value) == digest_size * 2 else base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ValueError(f"Malformed checksum value: {value}")
+    if len(digest) != digest_size:
+        raise ValueError(f"Malformed checksum value: {value}")
+    return algorithm, digest
+
+
+def _write_session(meta_path: str, session: dict):
+    tmp_path = f"{meta_path}.tmp{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    with open(tmp_path, "w") as meta_file:
+        json.dump(session, meta_file)
+    os.replace(tmp_path, meta_path)
+
+
+def create_session(username: str, game_name: str, length: Optional[int] = None, checksum: Optional[str] = None) -> dict:
+    """Создаёт пустую сессию загрузки. checksum — сумма всего архива, проверяется при finalize."""
+    if checksum is not None:
+        parse_checksum(checksum)
+
+    collect_stale_uploads(username)
+    uploads_dir = get_uploads_dir(username)
+    os.makedirs(uploads_dir, exist_ok=True)
+
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _session_paths(username, upload_id)
+    session = {
+        "upload_id": upload_id,
+        "game_name": game_name,
+        "length": length,
+        "checksum": checksum,
+        "created_at": time.time(),
+        "expires_at": time.time() + UPLOAD_SESSION_TTL,
+    }
+    open(part_path, "wb").close()
+    _write_session(meta_path, session)
+    return {**session, "offset": 0}
+
+
+def get_session(username: str, upload_id: str) -> dict:
+    """Метаданные сессии и текущее смещение. Просроченная сессия удаляется и считается отсутствующей."""
+    meta_path, part_path = _session_paths(username, upload_id)
+    try:
+        with open(meta_path, "r") as meta_file:
+            session = json.load(meta_file)
+        offset = os.path.getsize(part_path)
+    except (FileNotFoundError, ValueError):
+        raise UploadSessionNotFound(upload_id)
+
+    if session["expires_at"] < time.time():
+        delete_session(username, upload_id)
+        raise UploadSessionNotFound(upload_id)
+    return {**session, "offset": offset}
+
+
+def delete_session(username: str, upload_id: str):
+    for path in _session_paths(username, upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def cancel_session(username: str, upload_id: str):
+    """Отмена загрузки клиентом (не во время записи куска)."""
+    meta_path, part_path = _session_paths(username, upload_id)
+    with _open_locked_part(part_path, meta_path):
+        delete_session(username, upload_id)
+
+
+def _open_locked_part(part_path: str, meta_path: str):
+    """Открывает .part под эксклюзивной блокировкой: один кусок одной сессии за раз, без ожидания."""
+    try:
+        part_file = open(part_path, "r+b")
+    except FileNotFoundError:
+        raise UploadSessionNotFound(os.path.basename(part_path))
+
+    try:
+        try:
+            fcntl.flock(part_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadSessionBusy("Another request is writing to this upload")
+        # Пока ждали открытия, сессию могли завершить или отменить
+        if not os.path.exists(meta_path):
+            raise UploadSessionNotFound(os.path.basename(meta_path))
+    except BaseException:
+        part_file.close()
+        raise
+    return part_file
+
+
+def _finish_chunk(part_file, meta_path: str, session: dict):
+    part_file.flush()
+    session["expires_at"] = time.time() + UPLOAD_SESSION_TTL
+    _write_session(meta_path, {key: value for key, value in session.items() if key != "offset"})
+
+
+async def append_chunk(username: str, upload_id: str, offset: int, chunks, checksum: Optional[str] = None) -> int:
+    """
+    Дописывает кусок из асинхронного итератора chunks начиная с offset. :returns новое смещение
+    Кусок с checksum при ошибке или несовпадении суммы отбрасывается целиком,
+    без суммы — при обрыве сохраняется принятая часть.
+    Файловые операции и метаданные сессии — в пуле ввода-вывода, цикл событий только принимает тело запроса.
+    """
+    session = await run_io(get_session, username, upload_id)
+    expected = parse_checksum(checksum) if checksum is not None else None
+    meta_path, part_path = _session_paths(username, upload_id)
+
+    part_file = await run_io(_open_locked_part, part_path, meta_path)
+    try:
+        current_offset = part_file.seek(0, os.SEEK_END)
+        if current_offset != offset:
+            raise UploadOffsetMismatch(current_offset)
+
+        hasher = hashlib.new(expected[0]) if expected else None
+        try:
+            async for data in chunks:
+                if session["length"] is not None and part_file.tell() + len(data) > session["length"]:
+                    raise UploadTooLarge(f"Upload exceeds declared length {session['length']}")
+                await run_io(part_file.write, data)
+                if hasher is not None:
+                    hasher.update(data)
+            if hasher is not None and hasher.digest() != expected[1]:
+                raise UploadChecksumMismatch(f"{expected[0]} checksum of the chunk does not match")
+        except BaseException as e:
+            if expected is not None or isinstance(e, UploadSessionError):
+                await run_io(part_file.truncate, offset)
+            raise
+        finally:
+            await run_io(_finish_chunk, part_file, meta_path, session)
+
+        return part_file.tell()
+    finally:
+        part_file.close()
+
+
+def _file_digest(path: str, algorithm: str) -> bytes:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, algorithm).digest()
+
+
+def take_completed_upload(username: str, upload_id: str) -> tuple[dict, str]:
+    """
+    Забирает полностью принятый архив из сессии: сессия удаляется, файл переименовывается,
+    чтобы параллельный PATCH не дописал в него. :returns (метаданные сессии, путь к архиву)
+    """
+    session = get_session(username, upload_id)
+    meta_path, part_path = _session_paths(username, upload_id)
+
+    with _open_locked_part(part_path, meta_path) as part_file:
+        offset = part_file.seek(0, os.SEEK_END)
+        if session["length"] is not None and offset != session["length"]:
+            raise UploadIncomplete(f"Received {offset} of {session['length']} bytes")
+        if offset == 0:
+            raise UploadIncomplete("Nothing was uploaded")
+
+        if session["checksum"] is not None:
+            algorithm, digest = parse_checksum(session["checksum"])
+            if _file_digest(part_path, algorithm) != digest:
+                raise UploadChecksumMismatch(f"{algorithm} checksum of the upload does not match")
+
+        archive_path = f"{part_path}.finalizing"
+        os.rename(part_path, archive_path)
+        os.remove(meta_path)
+
+    return session, archive_path
+
+
+def collect_stale_uploads(username: Optional[str] = None) -> int:
+    """Удаляет просроченные сессии и брошенные файлы загрузок. :returns число удалённых сессий"""
+    if username is None:
+        if not os.path.exists("tmp_data"):
+            return 0
+        return sum(collect_stale_uploads(entry.name) for entry in os.scandir("tmp_data") if entry.is_dir())
+
+    uploads_dir = get_uploads_dir(username)
+    if not os.path.exists(uploads_dir):
+        return 0
+
+    now = time.time()
+    removed = 0
+    for entry in os.scandir(uploads_dir):
+        name, extension = os.path.splitext(entry.name)
+        try:
+            if extension == ".json":
+                try:
+                    with open(entry.path, "r") as meta_file:
+                        expired = json.load(meta_file)["expires_at"] < now
+                except (ValueError, KeyError):
+                    expired = entry.stat().st_mtime + UPLOAD_SESSION_TTL < now
+                if expired:
+                    try:
+                        delete_session(username, name)
+                    except UploadSessionNotFound:
+                        os.remove(entry.path)
+                    removed += 1
+            elif entry.stat().st_mtime + UPLOAD_SESSION_TTL < now and not os.path.exists(f"{uploads_dir}/{name}.json"):
+                # .part без метаданных и .finalizing, оставшиеся после падения сервера
+                os.remove(entry.path)
+        except FileNotFoundError:
+            # Уже удалён вместе со своей сессией
+            continue
+    return removed
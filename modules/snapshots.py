@@ -0,0 +1,306 @@
+"""
+Версионированные снимки папок сохранений.
+
+Файлы игры лежат в snapshots/<user>/<game>/<версия>/, а saves/<user>/<game> — символическая ссылка на текущую версию.
+Запись (загрузка, дельта, удаление лишних файлов, восстановление) идёт в staging-папку — копию текущей версии
+на жёстких ссылках, — после чего ссылка атомарно переключается на новую версию (os.replace поверх старой ссылки).
+Читатели (скачивание, проверка, бэкапы) один раз разрешают ссылку и дальше работают с неизменяемой версией,
+удерживая её (read_snapshot / hold_snapshot — разделяемый flock на дескриптор папки версии).
+Неудачная запись удаляет только свою staging-папку.
+
+Файлы версии общие со старыми версиями (жёсткие ссылки), поэтому на месте их менять нельзя: перед перезаписью
+файл удаляется (tarfile и open(..., "wb") усекают существующий inode, и изменение попало бы во все версии).
+
+Старая версия удаляется при следующей записи в игру (или при запуске сервера), если её никто не удерживает:
+сборщик берёт на неё эксклюзивный flock без ожидания, и занятые версии пропускает до следующего раза.
+Брошенные после падения staging-папки и временные ссылки удаляются спустя snapshot_grace_seconds (settings.json).
+"""
+import fcntl
+import json
+import os
+import shutil
+import time
+import uuid
+import weakref
+
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from modules.executor import run_io
+
+with open("settings.json", "r") as settings_file:
+    SNAPSHOT_GRACE_SECONDS: int = json.load(settings_file).get("snapshot_grace_seconds", 300)
+
+SNAPSHOTS_DIR = "snapshots"
+STAGING_PREFIX = ".staging-"
+LINK_PREFIX = ".link-"
+
+
+def get_saves_path(username: str, game_name: str) -> str:
+    return f"saves/{username}/{game_name}"
+
+
+def get_snapshots_dir(username: str, game_name: str) -> str:
+    return f"{SNAPSHOTS_DIR}/{username}/{game_name}"
+
+
+def _new_name(prefix: str = "") -> str:
+    """Время создания в нс (имена сортируются хронологически) и случайный суффикс."""
+    return f"{prefix}{time.time_ns()}-{uuid.uuid4().hex[:6]}"
+
+
+def _created_ns(name: str) -> Optional[int]:
+    try:
+        return int(name.removeprefix(STAGING_PREFIX).removeprefix(LINK_PREFIX).split("-")[0])
+    except ValueError:
+        return None
+
+
+def resolve_snapshot(username: str, game_name: str) -> Optional[str]:
+    """
+    Путь к текущей версии папки игры или None, если игры нет.
+    Читатель разрешает ссылку один раз: последующие записи в игру не меняют уже полученную версию.
+    Папка в старом формате (не ссылка) возвращается как есть.
+    """
+    saves_path = get_saves_path(username, game_name)
+    try:
+        target = os.readlink(saves_path)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        return saves_path if os.path.isdir(saves_path) else None
+    return os.path.normpath(os.path.join(os.path.dirname(saves_path), target))
+
+
+class SnapshotHold:
+    """
+    Удержание версии снимка: пока оно не снято, collect_snapshots версию не удалит.
+    Снимается release() или при сборке объекта мусором — например, если потоковый ответ так и не начали отправлять.
+    """
+
+    def __init__(self, path: Optional[str], fd: Optional[int] = None):
+        self.path = path
+        self._finalizer = weakref.finalize(self, os.close, fd) if fd is not None else None
+
+    def release(self):
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+def hold_snapshot(username: str, game_name: str) -> SnapshotHold:
+    """
+    Разрешает текущую версию (как resolve_snapshot) и удерживает её; hold.path — None, если игры нет.
+    Блокировка берётся без ожидания: занятая сборщиком версия уже не текущая, ссылка разрешается заново.
+    """
+    previous = None
+    while True:
+        path = resolve_snapshot(username, game_name)
+        if path is None or path == previous:
+            # Ссылка ведёт в никуда и не меняется — игры нет
+            return SnapshotHold(None)
+        previous = path
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        # Сборщик мог удалить версию между open и flock
+        if os.path.isdir(path):
+            return SnapshotHold(path, fd)
+        os.close(fd)
+
+
+@contextmanager
+def read_snapshot(username: str, game_name: str):
+    """with read_snapshot(...) as path: чтение версии (path — None, если игры нет); версия не будет удалена до выхода."""
+    hold = hold_snapshot(username, game_name)
+    try:
+        yield hold.path
+    finally:
+        hold.release()
+
+
+def _remove_unheld_version(version_path: str) -> bool:
+    """Удаляет версию, если её никто не читает. :returns удалена ли"""
+    try:
+        fd = os.open(version_path, os.O_RDONLY | os.O_DIRECTORY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    else:
+        # Блокировка держится до конца удаления: новый читатель её не получит и разрешит ссылку заново
+        shutil.rmtree(version_path, ignore_errors=True)
+        return True
+    finally:
+        os.close(fd)
+
+
+def _point_link(username: str, game_name: str, version_path: str):
+    """Атомарно направляет saves/<user>/<game> на version_path: временная ссылка и os.replace поверх старой."""
+    saves_path = get_saves_path(username, game_name)
+    os.makedirs(os.path.dirname(saves_path), exist_ok=True)
+    # Временная ссылка создаётся не в saves/<user>, чтобы не попасть в список игр
+    tmp_link = os.path.join(get_snapshots_dir(username, game_name), _new_name(LINK_PREFIX))
+    os.symlink(os.path.relpath(version_path, os.path.dirname(saves_path)), tmp_link)
+    try:
+        os.replace(tmp_link, saves_path)
+    except BaseException:
+        os.unlink(tmp_link)
+        raise
+
+
+def adopt_legacy_folder(username: str, game_name: str) -> Optional[str]:
+    """Переносит обычную папку saves/<user>/<game> в первую версию снимков. :returns путь текущей версии"""
+    saves_path = get_saves_path(username, game_name)
+    if os.path.islink(saves_path) or not os.path.isdir(saves_path):
+        return resolve_snapshot(username, game_name)
+
+    snapshots_dir = get_snapshots_dir(username, game_name)
+    os.makedirs(snapshots_dir, exist_ok=True)
+    version_path = f"{snapshots_dir}/{_new_name()}"
+    os.rename(saves_path, version_path)
+    _point_link(username, game_name, version_path)
+    return version_path
+
+
+def _link_or_copy(source: str, destination: str):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def begin_snapshot(username: str, game_name: str, copy_current: bool = True) -> str:
+    """
+    Создаёт staging-папку для записи: копию текущей версии на жёстких ссылках (copy_current) или пустую.
+    Вызывать под эксклюзивной блокировкой игры (modules/locks.py).
+    """
+    current = adopt_legacy_folder(username, game_name)
+    snapshots_dir = get_snapshots_dir(username, game_name)
+    os.makedirs(snapshots_dir, exist_ok=True)
+
+    staging_path = f"{snapshots_dir}/{_new_name(STAGING_PREFIX)}"
+    if copy_current and current is not None and os.path.isdir(current):
+        shutil.copytree(current, staging_path, symlinks=True, copy_function=_link_or_copy)
+    else:
+        os.mkdir(staging_path)
+    return staging_path
+
+
+def commit_snapshot(username: str, game_name: str, staging_path: str) -> str:
+    """Делает staging-папку новой версией и переключает на неё ссылку. :returns путь новой версии"""
+    version_path = f"{get_snapshots_dir(username, game_name)}/{_new_name()}"
+    os.rename(staging_path, version_path)
+    _point_link(username, game_name, version_path)
+    collect_snapshots(username, game_name)
+    return version_path
+
+
+def abort_snapshot(staging_path: str):
+    shutil.rmtree(staging_path, ignore_errors=True)
+
+
+@contextmanager
+def snapshot_writer(username: str, game_name: str, copy_current: bool = True):
+    """with snapshot_writer(...) as staging_path: запись в staging_path; при исключении версия не меняется."""
+    staging_path = begin_snapshot(username, game_name, copy_current)
+    try:
+        yield staging_path
+        commit_snapshot(username, game_name, staging_path)
+    except BaseException:
+        abort_snapshot(staging_path)
+        raise
+
+
+@asynccontextmanager
+async def async_snapshot_writer(username: str, game_name: str, copy_current: bool = True):
+    """То же, что snapshot_writer, для async-обработчиков (файловые операции — в пуле ввода-вывода)."""
+    staging_path = await run_io(begin_snapshot, username, game_name, copy_current)
+    try:
+        yield staging_path
+        await run_io(commit_snapshot, username, game_name, staging_path)
+    except BaseException:
+        abort_snapshot(staging_path)
+        raise
+
+
+def collect_snapshots(username: str, game_name: str, grace_seconds: int = SNAPSHOT_GRACE_SECONDS) -> int:
+    """
+    Удаляет нетекущие версии, которые никто не удерживает (см. hold_snapshot),
+    и брошенные staging-папки и временные ссылки старше grace_seconds (после падения процесса).
+    :returns число удалённых версий
+    """
+    snapshots_dir = get_snapshots_dir(username, game_name)
+    try:
+        names = os.listdir(snapshots_dir)
+    except FileNotFoundError:
+        return 0
+
+    current = resolve_snapshot(username, game_name)
+    current_name = os.path.basename(current) if current is not None else None
+    deadline_ns = time.time_ns() - grace_seconds * 1_000_000_000
+
+    removed = 0
+    for name in names:
+        if name.startswith(".") or name == current_name or _created_ns(name) is None:
+            continue
+        if _remove_unheld_version(os.path.join(snapshots_dir, name)):
+            removed += 1
+
+    for name in names:
+        if name.startswith((STAGING_PREFIX, LINK_PREFIX)) and (_created_ns(name) or 0) < deadline_ns:
+            path = os.path.join(snapshots_dir, name)
+            if os.path.islink(path):
+                os.unlink(path)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+def repoint_game_link(username: str, game_name: str):
+    """После переноса папок игры под новое имя направляет ссылку на ту же версию в snapshots/<user>/<game_name>."""
+    saves_path = get_saves_path(username, game_name)
+    if os.path.islink(saves_path):
+        version = os.path.basename(os.readlink(saves_path))
+        _point_link(username, game_name, f"{get_snapshots_dir(username, game_name)}/{version}")
+
+
+def move_game_to_trash(username: str, game_name: str, trash_path: str):
+    """
+    Убирает игру из saves одной операцией (удаление ссылки), все версии переносятся в trash_path.
+    Корзина — обычная папка: shutil.rmtree не работает со ссылками.
+    """
+    saves_path = get_saves_path(username, game_name)
+    if not os.path.islink(saves_path):
+        os.rename(saves_path, trash_path)
+        return
+
+    os.unlink(saves_path)
+    os.makedirs(trash_path)
+    snapshots_dir = get_snapshots_dir(username, game_name)
+    if os.path.exists(snapshots_dir):
+        os.rename(snapshots_dir, os.path.join(trash_path, "snapshots"))
+
+
+def prepare_snapshots():
+    """При запуске сервера: переводит папки старого формата в снимки и удаляет устаревшие версии."""
+    if not os.path.exists("saves"):
+        return
+
+    for user_entry in os.scandir("saves"):
+        if not user_entry.is_dir():
+            continue
+        for game_entry in os.scandir(user_entry.path):
+            if game_entry.is_dir():
+                try:
+                    adopt_legacy_folder(user_entry.name, game_entry.name)
+                    collect_snapshots(user_entry.name, game_entry.name)
+                except OSError as e:
+                    print(f"⚠️  Не удалось подготовить снимки {game_entry.path}: {e}")
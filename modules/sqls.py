@@ -1,19 +1,52 @@
+import json
+
 from contextlib import contextmanager
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import create_engine, Column, String, Integer, DateTime
-from sqlalchemy.pool import StaticPool
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, Column, String, Integer, DateTime, Text, Index, exists, and_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker, declarative_base, aliased
+
+from datetime import datetime, UTC, timedelta
+
+from modules.metrics import instrument_engine
+from modules.token_cache import token_cache
+
+with open("settings.json", "r") as settings_file:
+    _settings = json.load(settings_file)
 
-from datetime import datetime, UTC
+DB_POOL_SIZE: int = _settings.get("db_pool_size", 8)
+DB_MAX_OVERFLOW: int = _settings.get("db_max_overflow", 8)
+DB_BUSY_TIMEOUT_MS: int = _settings.get("db_busy_timeout_ms", 5000)
 
 engine = create_engine(
     "sqlite:///./users.db",
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT_MS / 1000},
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     pool_pre_ping=True,
     echo=False
 )
+instrument_engine(engine, "sync")
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL: читатели не блокируют писателя и наоборот, запись — одна на всю базу.
+    synchronous=NORMAL в режиме WAL не теряет целостность, только последние транзакции при отключении питания.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.execute("PRAGMA mmap_size=134217728")
+    cursor.close()
 
 Base = declarative_base()
 
@@ -38,7 +71,125 @@ class SyncData(Base):
     game_name = Column(String)
     last_sync_date = Column(DateTime)
 
+    __table_args__ = (
+        Index("ix_sync_data_username_game_name", "username", "game_name", unique=True),
+    )
+
+class GameGeneration(Base):
+    """
+    Монотонные счётчики изменений игры: generation — папка сохранений, backups_generation — список бэкапов.
+    Строки не удаляются (и при удалении игры счётчик только растёт), чтобы ETag никогда не повторился.
+    """
+    __tablename__ = "game_generations"
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String)
+    game_name = Column(String)
+    generation = Column(Integer, default=0)
+    backups_generation = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index("ix_game_generations_username_game_name", "username", "game_name", unique=True),
+    )
+
+class BackupRecord(Base):
+    """Каталог бэкапов: строка на каждый файл в backups/<user>/<game>/ (манифест или tar-архив)."""
+    __tablename__ = "backups"
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String)
+    game_name = Column(String)
+    filename = Column(String)
+    created_at = Column(DateTime)
+    size_bytes = Column(Integer)
+    codec = Column(String)
+    fingerprint = Column(String, nullable=True)
+    file_count = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_backups_username_game_name_filename", "username", "game_name", "filename", unique=True),
+        Index("ix_backups_username_game_name_created_at", "username", "game_name", "created_at"),
+    )
+
+    def to_dict(self) -> dict:
+        return {
+            "filename": self.filename,
+            "created_at": self.created_at.replace(tzinfo=UTC).isoformat(),
+            "size_bytes": self.size_bytes,
+            "codec": self.codec,
+            "fingerprint": self.fingerprint,
+            "file_count": self.file_count,
+        }
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String, unique=True)
+    kind = Column(String)
+    username = Column(String)
+    game_name = Column(String)
+    payload = Column(Text)
+    status = Column(String, default="pending")
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    run_after = Column(DateTime)
+    claimed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_username_game_name_status", "username", "game_name", "status"),
+    )
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "username": self.username,
+            "game_name": self.game_name,
+            "payload": self.payload,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+# Миграции схемы для уже существующих users.db. Версия хранится в PRAGMA user_version.
+# Новые базы получают индексы сразу из create_all, поэтому все миграции идемпотентны (IF NOT EXISTS).
+MIGRATIONS = [
+    (1, [
+        # Дубликаты, накопившиеся из-за гонки select -> insert: оставляем самую свежую запись
+        """DELETE FROM sync_data WHERE id NOT IN (
+               SELECT id FROM (
+                   SELECT id, ROW_NUMBER() OVER (
+                       PARTITION BY username, game_name ORDER BY last_sync_date DESC, id DESC
+                   ) AS row_number FROM sync_data
+               ) WHERE row_number = 1
+           )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_sync_data_username_game_name ON sync_data (username, game_name)",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_username_game_name_status ON jobs (username, game_name, status)",
+    ]),
+]
+
+
+def migrate_schema():
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        for target_version, statements in MIGRATIONS:
+            if target_version <= version:
+                continue
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(f"PRAGMA user_version={target_version}")
+            print(f"[БД] Схема обновлена до версии {target_version}")
+
+
 Base.metadata.create_all(engine)
+migrate_schema()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -57,17 +208,15 @@ def create_session():
 def add_user(username: str, token: str) -> bool|str:
     try:
         with create_session() as session:
-            existing = session.query(User).filter(
-                (User.username == username) | (User.api_token == token)
-            ).first()
-
-            if existing:
-                print(f"[БД] Пользователь {username} или токен уже существуют")
-                return 'already exists'
-
-            new_user = User(username=username, api_token=token)
-            session.add(new_user)
+            inserted = session.execute(
+                insert(User).values(username=username, api_token=token).on_conflict_do_nothing()
+            ).rowcount
             session.commit()
+
+        if inserted == 0:
+            print(f"[БД] Пользователь {username} или токен уже существуют")
+            return 'already exists'
+        token_cache.invalidate()
         return True
     except Exception as e:
         print("[БД] Ошибка при создании нового пользователя! ", e)
@@ -78,6 +227,7 @@ def delete_user(username: str) -> bool:
         with create_session() as session:
             session.query(User).filter(User.username==username).delete()
             session.commit()
+        token_cache.invalidate()
         return True
     except Exception as e:
         print("[БД] Ошибка при удалении пользователя! ", e)
@@ -109,22 +259,16 @@ def get_user(username: str = None, token: str = None, all_users=False):
 def add_sync_date(username: str, game_name: str):
     try:
         with create_session() as session:
-            existing = session.query(SyncData).filter(
-                SyncData.game_name == game_name,
-                SyncData.username == username
-            ).first()
-
-            if existing:
-                print(f"[БД] Запись для игры {game_name} пользователя {username} уже существует.")
-                return
-
-            new_sync = SyncData(
-                username=username,
-                game_name=game_name,
-                last_sync_date=datetime.now(UTC)
-            )
-            session.add(new_sync)
+            inserted = session.execute(
+                insert(SyncData)
+                .values(username=username, game_name=game_name, last_sync_date=datetime.now(UTC))
+                .on_conflict_do_nothing(index_elements=[SyncData.username, SyncData.game_name])
+            ).rowcount
             session.commit()
+
+        if inserted == 0:
+            print(f"[БД] Запись для игры {game_name} пользователя {username} уже существует.")
+        else:
             print(f"[БД] Добавлена новая запись для игры {game_name} пользователя {username}.")
     except IntegrityError as e:
         print(f"[БД] Конфликт при добавлении записи для игры {game_name} пользователя {username}."
@@ -136,12 +280,14 @@ def add_sync_date(username: str, game_name: str):
 def update_sync_date(username: str, game_name: str):
     try:
         with create_session() as session:
-            game = session.query(SyncData).filter(SyncData.game_name == game_name, SyncData.username == username).first()
-            if game is None:
-                add_sync_date(username, game_name)
-            else:
-                game.last_sync_date = datetime.now(UTC)
-                session.commit()
+            now = datetime.now(UTC)
+            session.execute(
+                insert(SyncData)
+                .values(username=username, game_name=game_name, last_sync_date=now)
+                .on_conflict_do_update(index_elements=[SyncData.username, SyncData.game_name],
+                                       set_={"last_sync_date": now})
+            )
+            session.commit()
     except Exception as e:
         print(f"[БД] Ошибка при обновлении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
 
@@ -172,4 +318,225 @@ def delete_sync_data(username: str, game_name: str):
             session.query(SyncData).filter(SyncData.username == username, SyncData.game_name == game_name).delete()
             session.commit()
     except Exception as e:
-        print(f"[БД] Ошибка при удалении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
\ No newline at end of file
+        print(f"[БД] Ошибка при удалении даты сохранения для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+
+def add_job(job_id: str, kind: str, username: str, game_name: str, payload: str, max_attempts: int) -> bool:
+    try:
+        with create_session() as session:
+            now = datetime.now(UTC)
+            session.add(Job(
+                job_id=job_id,
+                kind=kind,
+                username=username,
+                game_name=game_name,
+                payload=payload,
+                status="pending",
+                attempts=0,
+                max_attempts=max_attempts,
+                created_at=now,
+                updated_at=now,
+                run_after=now,
+            ))
+            session.commit()
+        return True
+    except Exception as e:
+        print(f"[БД] Ошибка при добавлении задачи {kind} для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return False
+
+def claim_job(username: str = None, game_name: str = None, stale_after: int = 3600) -> dict | None:
+    """
+    Забирает следующую задачу в работу. Задачи одной пары (username, game_name) выполняются строго по порядку:
+    берётся только самая старая ожидающая задача пары и только если по этой паре ничего не выполняется.
+    Задачи в статусе running дольше stale_after секунд считаются брошенными (упавший воркер) и возвращаются в очередь.
+    """
+    try:
+        with create_session() as session:
+            now = datetime.now(UTC)
+            session.query(Job).filter(
+                Job.status == "running", Job.claimed_at < now - timedelta(seconds=stale_after)
+            ).update({Job.status: "pending"}, synchronize_session=False)
+
+            older = aliased(Job)
+            running = aliased(Job)
+            query = session.query(Job).filter(
+                Job.status == "pending",
+                Job.run_after <= now,
+                ~exists().where(and_(older.username == Job.username, older.game_name == Job.game_name,
+                                     older.status == "pending", older.id < Job.id)),
+                ~exists().where(and_(running.username == Job.username, running.game_name == Job.game_name,
+                                     running.status == "running")),
+            )
+            if username is not None:
+                query = query.filter(Job.username == username, Job.game_name == game_name)
+
+            job = query.order_by(Job.id).first()
+            if job is None:
+                session.commit()
+                return None
+
+            claimed = session.query(Job).filter(Job.id == job.id, Job.status == "pending").update({
+                Job.status: "running",
+                Job.attempts: Job.attempts + 1,
+                Job.claimed_at: now,
+                Job.updated_at: now,
+            }, synchronize_session=False)
+            session.commit()
+
+            if claimed != 1:
+                return None
+            session.refresh(job)
+            return job.to_dict()
+    except Exception as e:
+        print(f"[БД] Ошибка при получении задачи из очереди! Текст ошибки: {e}")
+        return None
+
+def finish_job(job_id: str, status: str = "done", error: str = None, retry_after: int = None):
+    """Завершает задачу. Если передан retry_after — задача возвращается в очередь через указанное число секунд."""
+    try:
+        with create_session() as session:
+            now = datetime.now(UTC)
+            values = {Job.status: status, Job.error: error, Job.updated_at: now}
+            if retry_after is not None:
+                values[Job.status] = "pending"
+                values[Job.run_after] = now + timedelta(seconds=retry_after)
+            session.query(Job).filter(Job.job_id == job_id).update(values, synchronize_session=False)
+            session.commit()
+    except Exception as e:
+        print(f"[БД] Ошибка при обновлении статуса задачи {job_id}! Текст ошибки: {e}")
+
+def get_job(job_id: str) -> dict | None:
+    try:
+        with create_session() as session:
+            job = session.query(Job).filter(Job.job_id == job_id).first()
+            return job.to_dict() if job else None
+    except Exception as e:
+        print(f"[БД] Ошибка при получении задачи {job_id}! Текст ошибки: {e}")
+        return None
+
+def has_pending_jobs(username: str, game_name: str) -> bool:
+    try:
+        with create_session() as session:
+            return session.query(Job).filter(
+                Job.username == username, Job.game_name == game_name, Job.status.in_(["pending", "running"])
+            ).first() is not None
+    except Exception as e:
+        print(f"[БД] Ошибка при проверке очереди задач для игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return False
+
+def get_pending_job_keys() -> list[tuple[str, str]]:
+    try:
+        with create_session() as session:
+            rows = session.query(Job.username, Job.game_name).filter(
+                Job.status.in_(["pending", "running"])
+            ).distinct().all()
+            return [(row.username, row.game_name) for row in rows]
+    except Exception as e:
+        print(f"[БД] Ошибка при получении очереди задач! Текст ошибки: {e}")
+        return []
+
+
+def bump_generation_statement(username: str, game_name: str, saves: bool = True, backups: bool = False):
+    """Один INSERT ... ON CONFLICT, увеличивающий счётчики игры (общий для синхронного и асинхронного API)."""
+    return (
+        insert(GameGeneration)
+        .values(username=username, game_name=game_name, generation=int(saves), backups_generation=int(backups))
+        .on_conflict_do_update(
+            index_elements=[GameGeneration.username, GameGeneration.game_name],
+            set_={"generation": GameGeneration.generation + int(saves),
+                  "backups_generation": GameGeneration.backups_generation + int(backups)},
+        )
+    )
+
+def bump_generation(username: str, game_name: str, saves: bool = True, backups: bool = False):
+    try:
+        with create_session() as session:
+            session.execute(bump_generation_statement(username, game_name, saves, backups))
+            session.commit()
+    except Exception as e:
+        print(f"[БД] Ошибка при обновлении счётчика изменений игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+def get_user_generations(username: str) -> dict[str, tuple[int, int]]:
+    """{'game_name': (generation, backups_generation)} для всех игр пользователя."""
+    try:
+        with create_session() as session:
+            rows = session.query(GameGeneration).filter(GameGeneration.username == username).all()
+            return {row.game_name: (row.generation, row.backups_generation) for row in rows}
+    except Exception as e:
+        print(f"[БД] Ошибка при получении счётчиков изменений пользователя {username}! Текст ошибки: {e}")
+        return {}
+
+
+def get_backup_records(username: str, game_name: str) -> list[BackupRecord] | None:
+    """Бэкапы игры от старых к новым; None — ошибка базы."""
+    try:
+        with create_session() as session:
+            return session.query(BackupRecord).filter(
+                BackupRecord.username == username, BackupRecord.game_name == game_name
+            ).order_by(BackupRecord.created_at, BackupRecord.id).all()
+    except Exception as e:
+        print(f"[БД] Ошибка при получении каталога бэкапов игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return None
+
+def commit_backup_rotation(username: str, game_name: str, new_record: dict, removed_filenames: list[str]) -> bool:
+    """Одной транзакцией добавляет запись о новом бэкапе и удаляет записи о вытесненных ротацией."""
+    try:
+        with create_session() as session:
+            session.add(BackupRecord(username=username, game_name=game_name, **new_record))
+            if removed_filenames:
+                session.query(BackupRecord).filter(
+                    BackupRecord.username == username, BackupRecord.game_name == game_name,
+                    BackupRecord.filename.in_(removed_filenames)
+                ).delete(synchronize_session=False)
+            session.commit()
+        return True
+    except Exception as e:
+        print(f"[БД] Ошибка при обновлении каталога бэкапов игры {game_name} пользователя {username}! Текст ошибки: {e}")
+        return False
+
+def delete_backup_records(username: str, game_name: str, filenames: list[str] = None):
+    """Удаляет записи о бэкапах (filenames=None — все бэкапы игры)."""
+    try:
+        with create_session() as session:
+            query = session.query(BackupRecord).filter(BackupRecord.username == username,
+                                                       BackupRecord.game_name == game_name)
+            if filenames is not None:
+                query = query.filter(BackupRecord.filename.in_(filenames))
+            query.delete(synchronize_session=False)
+            session.commit()
+    except Exception as e:
+        print(f"[БД] Ошибка при удалении из каталога бэкапов игры {game_name} пользователя {username}! Текст ошибки: {e}")
+
+def rename_backup_records(username: str, game_name: str, new_game_name: str):
+    try:
+        with create_session() as session:
+            session.query(BackupRecord).filter(
+                BackupRecord.username == username, BackupRecord.game_name == game_name
+            ).update({BackupRecord.game_name: new_game_name}, synchronize_session=False)
+            session.commit()
+    except Exception as e:
+        print(f"[БД] Ошибка при переименовании игры {game_name} в каталоге бэкапов пользователя {username}! Текст ошибки: {e}")
+
+def sync_backup_records(username: str, records_on_disk: dict[tuple[str, str], dict]) -> tuple[int, int]:
+    """
+    Сверяет каталог пользователя с бэкапами на диске {(game_name, filename): запись}:
+    добавляет недостающие записи и удаляет записи без файлов. Возвращает (добавлено, удалено).
+    Счётчик бэкапов (backups_generation) изменённых игр увеличивается в той же транзакции.
+    """
+    with create_session() as session:
+        existing = {(row.game_name, row.filename): row.id
+                    for row in session.query(BackupRecord.id, BackupRecord.game_name, BackupRecord.filename)
+                    .filter(BackupRecord.username == username)}
+
+        missing = records_on_disk.keys() - existing.keys()
+        stale = existing.keys() - records_on_disk.keys()
+        for game_name, filename in missing:
+            session.add(BackupRecord(username=username, game_name=game_name, filename=filename,
+                                     **records_on_disk[(game_name, filename)]))
+        if stale:
+            session.query(BackupRecord).filter(BackupRecord.id.in_([existing[key] for key in stale])) \
+                .delete(synchronize_session=False)
+        for game_name in sorted({game_name for game_name, _ in missing | stale}):
+            session.execute(bump_generation_statement(username, game_name, saves=False, backups=True))
+        session.commit()
+    return len(missing), len(stale)
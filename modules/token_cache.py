@@ -0,0 +1,127 @@
+"""
+Кэш аутентификации по API-токену: LRU с TTL перед запросом в SQLite.
+
+Токены почти не меняются, поэтому проверка токена на каждом запросе не должна ходить в базу.
+Сброс между процессами: add_user/delete_user перезаписывают файл-эпоху (resources/.token_cache_epoch),
+каждый процесс при обращении сверяет его stat и очищает свой кэш, если эпоха сменилась.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+with open("settings.json", "r") as settings_file:
+    _settings = json.load(settings_file)
+
+TOKEN_CACHE_SIZE: int = _settings.get("token_cache_size", 1024)
+TOKEN_CACHE_TTL: float = _settings.get("token_cache_ttl", 60)
+# Неизвестные токены тоже кэшируются, но недолго: ошибка базы не должна надолго запирать пользователя
+TOKEN_CACHE_NEGATIVE_TTL: float = 5
+
+EPOCH_PATH = "resources/.token_cache_epoch"
+
+
+class TokenCache:
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float, epoch_path: str):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.epoch_path = epoch_path
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = self._read_epoch()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _read_epoch(self):
+        try:
+            stat = os.stat(self.epoch_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _check_epoch(self):
+        """Вызывается под блокировкой: очищает кэш, если другой процесс объявил новую эпоху."""
+        epoch = self._read_epoch()
+        if epoch != self._epoch:
+            self._entries.clear()
+            self._epoch = epoch
+
+    def _lookup(self, token: str) -> tuple[bool, object, object]:
+        """Возвращает (найдено, пользователь, эпоха на момент промаха)."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_epoch()
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return True, entry[1], self._epoch
+            self.misses += 1
+            return False, None, self._epoch
+
+    def _store(self, token: str, user, epoch):
+        with self._lock:
+            # Пока шёл запрос в базу, кэш могли сбросить: такой результат не сохраняем
+            if epoch == self._epoch:
+                expires_at = time.monotonic() + (self.ttl if user else self.negative_ttl)
+                self._entries[token] = (expires_at, user)
+                self._entries.move_to_end(token)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def get(self, token: str, loader):
+        """Возвращает пользователя по токену из кэша или через loader(token) (False — токен не найден)."""
+        found, user, epoch = self._lookup(token)
+        if found:
+            return user
+        user = loader(token)
+        self._store(token, user, epoch)
+        return user
+
+    async def get_async(self, token: str, loader):
+        """То же, что get, но loader — корутина (асинхронный доступ к базе)."""
+        found, user, epoch = self._lookup(token)
+        if found:
+            return user
+        user = await loader(token)
+        self._store(token, user, epoch)
+        return user
+
+    def invalidate(self):
+        """Очищает кэш в этом процессе и объявляет новую эпоху для остальных."""
+        os.makedirs(os.path.dirname(self.epoch_path), exist_ok=True)
+        tmp_path = f"{self.epoch_path}.tmp{os.getpid()}_{threading.get_ident()}"
+        with open(tmp_path, "w") as epoch_file:
+            epoch_file.write(uuid.uuid4().hex)
+        os.replace(tmp_path, self.epoch_path)
+
+        with self._lock:
+            self._entries.clear()
+            self._epoch = self._read_epoch()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, TOKEN_CACHE_NEGATIVE_TTL, EPOCH_PATH)
+
+
+def get_token_cache_stats() -> dict:
+    return token_cache.stats()
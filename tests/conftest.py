@@ -0,0 +1,50 @@
+"""
+Модули сервера читают settings.json и открывают users.db относительно текущей папки в момент импорта,
+поэтому тесты до любого импорта modules переходят во временную рабочую папку с копией settings.json.
+Запуск из корня репозитория: python -m pytest tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="mnemy-tests-")
+
+with open(os.path.join(REPO_ROOT, "settings.json"), "r") as settings_file:
+    _settings = json.load(settings_file)
+_settings.update(jobs_mode="inprocess", cpu_use_processes=False)
+with open(os.path.join(WORKDIR, "settings.json"), "w") as settings_file:
+    json.dump(_settings, settings_file)
+
+os.chdir(WORKDIR)
+sys.path.insert(0, REPO_ROOT)
+for folder in ("saves", "snapshots", "resources", "backups", "cache", "locks", "tmp_data"):
+    os.makedirs(folder, exist_ok=True)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    os.chdir(REPO_ROOT)
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def game_name() -> str:
+    """Уникальное имя игры: тесты делят одну рабочую папку и базу."""
+    return f"game-{uuid.uuid4().hex[:8]}"
+
+
+def write_file(path: str, data: bytes, age_seconds: float = 3600):
+    """Пишет файл и сдвигает mtime в прошлое, чтобы индекс хэшей не считал его «свежим» (RACY_WINDOW_NS)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        # Файлы версий снимков — жёсткие ссылки: на месте не перезаписываем
+        os.remove(path)
+    with open(path, "wb") as file:
+        file.write(data)
+    mtime = os.path.getmtime(path) - age_seconds
+    os.utime(path, (mtime, mtime))
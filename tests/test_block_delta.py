@@ -0,0 +1,130 @@
+import hashlib
+import io
+import random
+import struct
+
+import pytest
+
+from modules.block_delta import (DELTA_MAGIC, DeltaTooLarge, apply_delta, check_signature_fits, compute_delta,
+                                 compute_signature, validate_signature)
+
+BLOCK_SIZE = 1024
+
+
+def signature_of(data: bytes, block_size: int = BLOCK_SIZE) -> dict:
+    return compute_signature(io.BytesIO(data), block_size)
+
+
+def round_trip(basis: bytes, target: bytes, block_size: int = BLOCK_SIZE, max_literal: int = None):
+    delta = io.BytesIO()
+    info = compute_delta(signature_of(basis, block_size), io.BytesIO(target), delta, max_literal)
+    result = io.BytesIO()
+    result_hash = apply_delta(io.BytesIO(basis), io.BytesIO(delta.getvalue()), result)
+    return info, result.getvalue(), result_hash
+
+
+def mutate(data: bytes, rng: random.Random) -> bytes:
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 6)):
+        position = rng.randint(0, len(data))
+        operation = rng.choice(("insert", "delete", "replace"))
+        if operation == "insert":
+            data[position:position] = rng.randbytes(rng.randint(1, 3000))
+        elif operation == "delete":
+            del data[position:position + rng.randint(1, 3000)]
+        else:
+            data[position:position + 16] = rng.randbytes(16)
+    return bytes(data)
+
+
+def test_signature_blocks():
+    data = random.Random(1).randbytes(BLOCK_SIZE * 3 + 100)
+    signature = signature_of(data)
+
+    assert signature["size"] == len(data)
+    assert signature["block_size"] == BLOCK_SIZE
+    assert len(signature["blocks"]) == 4
+    assert signature["blocks"][-1][1] == hashlib.md5(data[BLOCK_SIZE * 3:]).hexdigest()
+    validate_signature(signature)
+
+
+@pytest.mark.parametrize("signature", [
+    {"size": 10, "block_size": 16, "blocks": [[1, "x"]]},
+    {"size": 5000, "block_size": BLOCK_SIZE, "blocks": [[1, "x"]]},
+    {"size": 0, "block_size": BLOCK_SIZE, "blocks": [[1, "x"]]},
+])
+def test_validate_signature_rejects_inconsistent(signature):
+    with pytest.raises(ValueError):
+        validate_signature(signature)
+
+
+def test_identical_file_has_no_literals():
+    data = random.Random(2).randbytes(BLOCK_SIZE * 20 + 7)
+    info, result, result_hash = round_trip(data, data)
+
+    assert info["literal_bytes"] == 0
+    assert result == data
+    assert result_hash == info["hash"] == hashlib.md5(data).hexdigest()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_round_trip_after_edits(seed):
+    rng = random.Random(seed)
+    basis = rng.randbytes(rng.randint(0, 60_000))
+    if seed % 4 == 0:
+        # Повторяющиеся блоки: одинаковые слабые и сильные суммы у разных номеров
+        basis = b"\0" * len(basis)
+    target = mutate(basis, rng)
+
+    info, result, result_hash = round_trip(basis, target, block_size=rng.choice((1024, 2048, 4096)))
+
+    assert result == target
+    assert result_hash == hashlib.md5(target).hexdigest()
+    assert info["size"] == len(target)
+
+
+def test_small_edit_sends_little_literal_data():
+    data = random.Random(3).randbytes(BLOCK_SIZE * 50)
+    target = data[:10_000] + b"changed" + data[10_000:]
+
+    info, result, _ = round_trip(data, target)
+
+    assert result == target
+    assert info["literal_bytes"] < 2 * BLOCK_SIZE
+
+
+def test_delta_too_large_on_unrelated_data():
+    rng = random.Random(4)
+    with pytest.raises(DeltaTooLarge):
+        round_trip(rng.randbytes(50_000), rng.randbytes(50_000), max_literal=10_000)
+
+
+def test_delta_within_literal_limit():
+    data = random.Random(5).randbytes(50_000)
+    target = data + b"tail" * 100
+
+    info, result, _ = round_trip(data, target, max_literal=10_000)
+
+    assert result == target
+    assert info["literal_bytes"] <= 10_000
+
+
+def test_check_signature_fits():
+    signature = signature_of(b"x" * 5000)
+    check_signature_fits(signature, 12_000, max_literal=10_000)
+    with pytest.raises(DeltaTooLarge):
+        check_signature_fits(signature, 20_000, max_literal=10_000)
+    with pytest.raises(DeltaTooLarge):
+        check_signature_fits(signature_of(b""), 20_000, max_literal=10_000)
+
+
+def test_apply_rejects_copy_past_basis():
+    delta = DELTA_MAGIC + struct.pack("<I", BLOCK_SIZE) + b"C" + struct.pack("<II", 0, 1000)
+    with pytest.raises(ValueError):
+        apply_delta(io.BytesIO(b"x" * BLOCK_SIZE), io.BytesIO(delta), io.BytesIO())
+
+
+def test_apply_rejects_wrong_checksum():
+    delta = DELTA_MAGIC + struct.pack("<I", BLOCK_SIZE) + b"L" + struct.pack("<I", 3) + b"abc" + b"E" + b"\0" * 16
+    with pytest.raises(ValueError):
+        apply_delta(io.BytesIO(b""), io.BytesIO(delta), io.BytesIO())
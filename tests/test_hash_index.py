@@ -0,0 +1,109 @@
+import hashlib
+import os
+
+from conftest import write_file
+
+from modules import hash_index
+from modules.hash_index import (compute_directory_digests, drop_index, invalidate_entries, update_hash_index,
+                                update_merkle_tree)
+
+
+def make_tree(base_dir: str, files: dict[str, bytes]):
+    for relative_path, data in files.items():
+        write_file(os.path.join(base_dir, relative_path.lstrip("/")), data)
+
+
+def full_recompute(base_dir: str) -> tuple[dict, dict]:
+    drop_index(base_dir)
+    file_hashes, directories = update_merkle_tree(base_dir)
+    assert directories == compute_directory_digests(file_hashes)
+    return file_hashes, directories
+
+
+def count_hashing(monkeypatch) -> list:
+    hashed = list()
+    original = hash_index.file_md5
+
+    def counting_md5(path):
+        hashed.append(path)
+        return original(path)
+
+    monkeypatch.setattr(hash_index, "file_md5", counting_md5)
+    return hashed
+
+
+def test_hashes_match_content(game_name):
+    base_dir = f"saves/tests/{game_name}"
+    make_tree(base_dir, {"/a.sav": b"alpha", "/slot/b.sav": b"beta"})
+
+    assert update_hash_index(base_dir) == {
+        "/a.sav": hashlib.md5(b"alpha").hexdigest(),
+        "/slot/b.sav": hashlib.md5(b"beta").hexdigest(),
+    }
+
+
+def test_incremental_merkle_matches_full_recompute(game_name, monkeypatch):
+    base_dir = f"saves/tests/{game_name}"
+    make_tree(base_dir, {
+        "/root.sav": b"root",
+        "/slot1/a.sav": b"a",
+        "/slot1/deep/b.sav": b"b",
+        "/slot2/c.sav": b"c",
+        "/slot3/d.sav": b"d",
+    })
+    update_merkle_tree(base_dir)
+
+    write_file(f"{base_dir}/slot1/deep/b.sav", b"b changed")
+    write_file(f"{base_dir}/slot2/new.sav", b"new")
+    os.remove(f"{base_dir}/slot3/d.sav")
+    os.rmdir(f"{base_dir}/slot3")
+    hashed = count_hashing(monkeypatch)
+
+    incremental = update_merkle_tree(base_dir)
+
+    # Перехэшированы только изменённый и новый файлы
+    assert sorted(os.path.relpath(path, base_dir) for path in hashed) == ["slot1/deep/b.sav", "slot2/new.sav"]
+    assert incremental == full_recompute(base_dir)
+    assert "/slot3" not in incremental[1]
+
+
+def test_unchanged_tree_is_not_rehashed(game_name, monkeypatch):
+    base_dir = f"saves/tests/{game_name}"
+    make_tree(base_dir, {"/a.sav": b"a", "/dir/b.sav": b"b"})
+    first = update_merkle_tree(base_dir)
+    hashed = count_hashing(monkeypatch)
+
+    assert update_merkle_tree(base_dir) == first
+    assert hashed == []
+
+
+def test_invalidated_entries_are_rehashed(game_name, monkeypatch):
+    base_dir = f"saves/tests/{game_name}"
+    make_tree(base_dir, {"/a.sav": b"a", "/dir/b.sav": b"b"})
+    first = update_merkle_tree(base_dir)
+    invalidate_entries(base_dir, ["/dir/b.sav"])
+    hashed = count_hashing(monkeypatch)
+
+    assert update_merkle_tree(base_dir) == first
+    assert [os.path.relpath(path, base_dir) for path in hashed] == ["dir/b.sav"]
+
+
+def test_fresh_files_are_not_cached(game_name, monkeypatch):
+    base_dir = f"saves/tests/{game_name}"
+    write_file(f"{base_dir}/fresh.sav", b"fresh", age_seconds=0)
+    update_hash_index(base_dir)
+    hashed = count_hashing(monkeypatch)
+
+    update_hash_index(base_dir)
+
+    assert len(hashed) == 1
+
+
+def test_empty_folder_digest(game_name):
+    base_dir = f"saves/tests/{game_name}"
+    os.makedirs(base_dir)
+
+    file_hashes, directories = update_merkle_tree(base_dir)
+
+    assert file_hashes == {}
+    assert directories == {"/": hashlib.md5(b"").hexdigest()}
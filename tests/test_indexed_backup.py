@@ -0,0 +1,76 @@
+import os
+import random
+
+import pytest
+
+from conftest import write_file
+
+from modules.compression import available_codecs
+from modules.indexed_backup import (create_indexed_backup, get_indexed_backup_info, is_indexed_backup,
+                                    iter_member_chunks, load_backup_index, restore_indexed_backup)
+
+CODECS = ["gzip:6", "tar"] + (["zstd:3"] if "zstd" in available_codecs() else [])
+
+
+@pytest.fixture
+def game_folder(game_name) -> tuple[str, dict[str, bytes]]:
+    rng = random.Random(7)
+    files = {
+        "/save1.dat": rng.randbytes(300_000),
+        "/profile/settings.ini": b"volume=10\n" * 100,
+        "/profile/empty.sav": b"",
+    }
+    folder = f"saves/tests/{game_name}"
+    for relative_path, data in files.items():
+        write_file(f"{folder}{relative_path}", data)
+    return folder, files
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_read_single_member(game_folder, game_name, codec):
+    folder, files = game_folder
+    backup_path = f"backups/{game_name}.pack"
+
+    assert create_indexed_backup(folder, backup_path, game_name, codec=codec)
+    assert is_indexed_backup(backup_path)
+
+    index = load_backup_index(backup_path)
+    assert sorted(index["files"]) == sorted(files)
+    for relative_path, data in files.items():
+        assert b"".join(iter_member_chunks(backup_path, relative_path, index, chunk_size=4096)) == data
+        assert index["files"][relative_path]["size"] == len(data)
+    assert get_indexed_backup_info(backup_path) == {"size_bytes": os.path.getsize(backup_path), "file_count": 3}
+
+
+def test_missing_member(game_folder, game_name):
+    folder, _ = game_folder
+    backup_path = f"backups/{game_name}.pack"
+    create_indexed_backup(folder, backup_path, game_name)
+
+    with pytest.raises(FileNotFoundError):
+        list(iter_member_chunks(backup_path, "/nope.sav"))
+
+
+def test_restore_selected_paths(game_folder, game_name):
+    folder, files = game_folder
+    backup_path = f"backups/{game_name}.pack"
+    create_indexed_backup(folder, backup_path, game_name)
+    destination = f"tmp_data/{game_name}-restore"
+
+    restored = restore_indexed_backup(backup_path, destination, ["/profile/settings.ini"])
+
+    assert restored == ["/profile/settings.ini"]
+    assert os.listdir(destination) == ["profile"]
+    with open(f"{destination}/profile/settings.ini", "rb") as file:
+        assert file.read() == files["/profile/settings.ini"]
+
+
+def test_truncated_backup_has_no_index(game_folder, game_name):
+    folder, _ = game_folder
+    backup_path = f"backups/{game_name}.pack"
+    create_indexed_backup(folder, backup_path, game_name)
+    with open(backup_path, "r+b") as file:
+        file.truncate(os.path.getsize(backup_path) - 10)
+
+    with pytest.raises(ValueError):
+        load_backup_index(backup_path)
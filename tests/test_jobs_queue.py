@@ -0,0 +1,83 @@
+import uuid
+
+import pytest
+
+from modules.sqls import Job, add_job, claim_job, create_session, finish_job, get_job, has_pending_jobs
+
+
+@pytest.fixture(autouse=True)
+def empty_queue():
+    with create_session() as session:
+        session.query(Job).delete()
+        session.commit()
+
+
+def enqueue(username: str, game_name: str, kind: str = "create_backup") -> str:
+    job_id = uuid.uuid4().hex
+    assert add_job(job_id, kind, username, game_name, "{}", 3)
+    return job_id
+
+
+def test_jobs_of_one_game_run_in_order():
+    first = enqueue("user", "game")
+    second = enqueue("user", "game")
+    other_game = enqueue("user", "other")
+
+    assert claim_job()["job_id"] == first
+    # Вторая задача игры ждёт, пока выполняется первая; другая игра не ждёт
+    assert claim_job()["job_id"] == other_game
+    assert claim_job() is None
+
+    finish_job(first)
+    claimed = claim_job()
+    assert claimed["job_id"] == second
+    assert claimed["attempts"] == 1
+    finish_job(second)
+    assert get_job(first)["status"] == get_job(second)["status"] == "done"
+
+
+def test_claim_for_one_game():
+    enqueue("user", "game")
+    other_user = enqueue("other_user", "game")
+
+    assert claim_job("other_user", "game")["job_id"] == other_user
+    assert claim_job("other_user", "game") is None
+
+
+def test_retry_keeps_order():
+    first = enqueue("user", "game")
+    second = enqueue("user", "game")
+
+    assert claim_job()["job_id"] == first
+    finish_job(first, error="boom", retry_after=3600)
+
+    # Отложенная задача остаётся первой в очереди игры: вторая не обгоняет её
+    assert get_job(first)["status"] == "pending"
+    assert claim_job() is None
+    assert has_pending_jobs("user", "game")
+
+    with create_session() as session:
+        session.query(Job).filter(Job.job_id == first).update({Job.run_after: Job.created_at})
+        session.commit()
+    assert claim_job()["job_id"] == first
+    finish_job(first)
+    assert claim_job()["job_id"] == second
+
+
+def test_stale_running_job_is_reclaimed():
+    job_id = enqueue("user", "game")
+    assert claim_job()["job_id"] == job_id
+
+    # Воркер упал: задача в running дольше stale_after возвращается в очередь
+    reclaimed = claim_job(stale_after=-1)
+    assert reclaimed["job_id"] == job_id
+    assert reclaimed["attempts"] == 2
+
+
+def test_failed_job_does_not_block_queue():
+    first = enqueue("user", "game")
+    second = enqueue("user", "game")
+    claim_job()
+    finish_job(first, status="failed", error="boom")
+
+    assert claim_job()["job_id"] == second
@@ -0,0 +1,56 @@
+import gzip
+import io
+import random
+
+import pytest
+
+from modules.pgzip import BLOCK_SIZE, ParallelGzipWriter
+
+
+def compress(data: bytes, write_size: int, **kwargs) -> bytes:
+    output = io.BytesIO()
+    with ParallelGzipWriter(output, **kwargs) as writer:
+        for position in range(0, len(data), write_size):
+            writer.write(data[position:position + write_size])
+    return output.getvalue()
+
+
+def sample(size: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    text = b"".join(rng.choice((b"player_position=", b"inventory:", b"0123456789", b"\n")) for _ in range(size // 8))
+    return (text + rng.randbytes(size))[:size]
+
+
+@pytest.mark.parametrize("size", [0, 1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE * 5 + 123])
+@pytest.mark.parametrize("threads", [1, 4])
+def test_decompresses_to_same_bytes(size, threads):
+    data = sample(size)
+    compressed = compress(data, write_size=7919, threads=threads)
+
+    assert gzip.decompress(compressed) == data
+
+
+def test_small_blocks_and_large_writes():
+    data = sample(300_000, seed=1)
+    compressed = compress(data, write_size=len(data), threads=3, block_size=4096, level=1)
+
+    assert gzip.decompress(compressed) == data
+
+
+def test_ratio_close_to_gzip():
+    data = sample(BLOCK_SIZE * 8, seed=2)
+    parallel = compress(data, write_size=65536, threads=4, level=6)
+
+    assert len(parallel) <= len(gzip.compress(data, compresslevel=6)) * 1.05
+
+
+def test_output_is_deterministic():
+    data = sample(BLOCK_SIZE * 3, seed=3)
+    assert compress(data, write_size=1000, threads=2) == compress(data, write_size=50_000, threads=4)
+
+
+def test_write_after_close_fails():
+    writer = ParallelGzipWriter(io.BytesIO(), threads=1)
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write(b"data")
@@ -0,0 +1,97 @@
+import gc
+import os
+
+import pytest
+
+from modules.snapshots import (collect_snapshots, get_saves_path, get_snapshots_dir, hold_snapshot, read_snapshot,
+                               resolve_snapshot, snapshot_writer)
+
+USERNAME = "snapshots-user"
+
+
+def write_version(game_name: str, files: dict[str, bytes]) -> str:
+    """Записывает новую версию игры: перечисленные файлы поверх текущих. :returns путь новой версии"""
+    with snapshot_writer(USERNAME, game_name) as staging_path:
+        for relative_path, data in files.items():
+            path = os.path.join(staging_path, relative_path)
+            if os.path.exists(path):
+                os.remove(path)
+            with open(path, "wb") as file:
+                file.write(data)
+    return resolve_snapshot(USERNAME, game_name)
+
+
+def read(version_path: str, relative_path: str) -> bytes:
+    with open(os.path.join(version_path, relative_path), "rb") as file:
+        return file.read()
+
+
+def versions(game_name: str) -> list[str]:
+    return sorted(name for name in os.listdir(get_snapshots_dir(USERNAME, game_name)) if not name.startswith("."))
+
+
+def test_commit_switches_link(game_name):
+    first = write_version(game_name, {"a.sav": b"v1", "b.sav": b"b"})
+    second = write_version(game_name, {"a.sav": b"v2"})
+
+    assert os.path.islink(get_saves_path(USERNAME, game_name))
+    assert second != first
+    assert read(second, "a.sav") == b"v2"
+    # Неизменённый файл — жёсткая ссылка на файл прошлой версии
+    assert read(second, "b.sav") == b"b"
+    # Прошлую версию никто не удерживал: удалена при коммите
+    assert versions(game_name) == [os.path.basename(second)]
+
+
+def test_abort_keeps_current_version(game_name):
+    current = write_version(game_name, {"a.sav": b"v1"})
+
+    with pytest.raises(RuntimeError):
+        with snapshot_writer(USERNAME, game_name) as staging_path:
+            os.remove(os.path.join(staging_path, "a.sav"))
+            raise RuntimeError("upload failed")
+
+    assert resolve_snapshot(USERNAME, game_name) == current
+    assert read(current, "a.sav") == b"v1"
+    assert os.listdir(get_snapshots_dir(USERNAME, game_name)) == [os.path.basename(current)]
+
+
+def test_gc_skips_held_version(game_name):
+    first = write_version(game_name, {"a.sav": b"v1"})
+    hold = hold_snapshot(USERNAME, game_name)
+    assert hold.path == first
+
+    second = write_version(game_name, {"a.sav": b"v2"})
+
+    assert read(first, "a.sav") == b"v1"
+    assert collect_snapshots(USERNAME, game_name) == 0
+    hold.release()
+    assert collect_snapshots(USERNAME, game_name) == 1
+    assert versions(game_name) == [os.path.basename(second)]
+
+
+def test_read_snapshot_releases_on_exit(game_name):
+    write_version(game_name, {"a.sav": b"v1"})
+    with read_snapshot(USERNAME, game_name) as path:
+        write_version(game_name, {"a.sav": b"v2"})
+        assert read(path, "a.sav") == b"v1"
+
+    assert collect_snapshots(USERNAME, game_name) == 1
+
+
+def test_hold_released_when_garbage_collected(game_name):
+    write_version(game_name, {"a.sav": b"v1"})
+    hold = hold_snapshot(USERNAME, game_name)
+    write_version(game_name, {"a.sav": b"v2"})
+    assert collect_snapshots(USERNAME, game_name) == 0
+
+    del hold
+    gc.collect()
+
+    assert collect_snapshots(USERNAME, game_name) == 1
+
+
+def test_missing_game(game_name):
+    assert hold_snapshot(USERNAME, game_name).path is None
+    with read_snapshot(USERNAME, game_name) as path:
+        assert path is None